@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+In-process AES-256-CBC file encryption, compatible with the openssl calls used
+so far on both ends of the link:
+
+    openssl enc    -aes-256-cbc -K <hex of qr_shared.key> -iv 000...0
+    openssl enc -d -aes-256-cbc -K <hex of qr_shared.key> -iv 000...0
+
+i.e. raw key (no salt/KDF, no "Salted__" header), all-zero IV, PKCS#7 padding.
+Files encrypted here decrypt with that openssl command and vice versa.
+
+The key is read once, files are streamed in CHUNK-sized pieces, and batches
+are spread over a thread pool (OpenSSL releases the GIL while it works on a
+chunk).
+
+write_encrypted_zip encrypts a folder in parallel straight into a STORED zip,
+without an encrypted copy of the folder on disk, and decrypt_zip is the
+receiving side: zip members are decrypted straight into their output files,
+in parallel, without extracting the archive first. decrypt_files does the
+same for files already on disk (7z archives extracted by 7-Zip).
+
+Uses the cryptography package when it is installed. Without it every stream
+is piped through the openssl binary instead (OPENSSL), which is still batched
+and parallel but pays one process start per file.
+"""
+
+import io
+import os
+from collections import deque
+import shutil
+import subprocess
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:  # fall back to the openssl binary
+    Cipher = None
+
+KEY_BYTES = 32
+BLOCK_BYTES = 16
+IV = bytes(BLOCK_BYTES)
+CHUNK = 1 << 20
+
+OPENSSL = "openssl"
+
+
+def load_key(key_path: Path) -> bytes:
+    """
+    Read qr_shared.key the way `openssl enc -K <hex>` uses it: longer keys are
+    truncated to 32 bytes, shorter ones padded with zero bytes.
+    """
+    key = Path(key_path).read_bytes()[:KEY_BYTES]
+    return key.ljust(KEY_BYTES, b"\0")
+
+
+def _openssl_pipe(src, dst, key: bytes, decrypt: bool, chunk: int) -> int:
+    cmd = [OPENSSL, "enc"] + (["-d"] if decrypt else []) + [
+        "-aes-256-cbc", "-K", key.hex(), "-iv", IV.hex(),
+    ]
+    try:
+        src.fileno()
+        proc = subprocess.Popen(cmd, stdin=src, stdout=subprocess.PIPE)
+        feeder = None
+    except (AttributeError, io.UnsupportedOperation):  # e.g. a zip member: copy it in
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        def feed():
+            try:
+                shutil.copyfileobj(src, proc.stdin, chunk)
+            except BrokenPipeError:
+                pass
+            finally:
+                proc.stdin.close()
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+    written = 0
+    for block in iter(lambda: proc.stdout.read(chunk), b""):
+        dst.write(block)
+        written += len(block)
+    proc.stdout.close()
+    if feeder is not None:
+        feeder.join()
+    if proc.wait() != 0:
+        raise ValueError("openssl enc failed" + (" (bad decrypt: wrong key or corrupt file)" if decrypt else ""))
+    return written
+
+
+def encrypt_stream(src, dst, key: bytes, chunk: int = CHUNK) -> int:
+    """Encrypt binary file object src into dst. Returns bytes written."""
+    if Cipher is None:
+        return _openssl_pipe(src, dst, key, False, chunk)
+
+    enc = Cipher(algorithms.AES(key), modes.CBC(IV)).encryptor()
+    pad = padding.PKCS7(BLOCK_BYTES * 8).padder()
+    written = 0
+    for block in iter(lambda: src.read(chunk), b""):
+        out = enc.update(pad.update(block))
+        dst.write(out)
+        written += len(out)
+    out = enc.update(pad.finalize()) + enc.finalize()
+    dst.write(out)
+    return written + len(out)
+
+
+def decrypt_stream(src, dst, key: bytes, chunk: int = CHUNK) -> int:
+    """
+    Decrypt binary file object src into dst. Returns bytes written.
+    Raises ValueError on a wrong key or truncated/corrupt input (bad padding).
+    """
+    if Cipher is None:
+        return _openssl_pipe(src, dst, key, True, chunk)
+
+    dec = Cipher(algorithms.AES(key), modes.CBC(IV)).decryptor()
+    unpad = padding.PKCS7(BLOCK_BYTES * 8).unpadder()
+    written = 0
+    for block in iter(lambda: src.read(chunk), b""):
+        out = unpad.update(dec.update(block))
+        dst.write(out)
+        written += len(out)
+    out = unpad.update(dec.finalize()) + unpad.finalize()
+    dst.write(out)
+    return written + len(out)
+
+
+def _stream_to_file(src, out_path: Path, key: bytes, decrypt: bool) -> int:
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    # Write next to the target and rename, so a failed run never leaves a half file
+    tmp = out_path.with_name(out_path.name + ".part")
+    try:
+        with open(tmp, "wb") as dst:
+            if decrypt:
+                decrypt_stream(src, dst, key)
+            else:
+                encrypt_stream(src, dst, key)
+        os.replace(tmp, out_path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return out_path.stat().st_size
+
+
+def _transform_file(in_path: Path, out_path: Path, key: bytes, decrypt: bool) -> int:
+    with open(in_path, "rb") as src:
+        return _stream_to_file(src, out_path, key, decrypt)
+
+
+def decrypt_file(in_path: Path, out_path: Path, key: bytes) -> int:
+    return _transform_file(in_path, out_path, key, True)
+
+
+class BatchStats:
+    """Result of decrypt_files / decrypt_zip."""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        self.errors = []  # (in_path, exception)
+
+    def report(self, what: str) -> str:
+        mb = self.bytes_in / 1e6
+        rate = mb / self.seconds if self.seconds > 0 else 0.0
+        return (f"{what} {self.files} files, {mb:.1f} MB in {self.seconds:.2f}s "
+                f"({self.files / self.seconds if self.seconds > 0 else 0.0:.1f} files/s, {rate:.1f} MB/s)")
+
+    def merge(self, other: "BatchStats") -> "BatchStats":
+        """Add the counts of another batch (e.g. a second pass over the same archive). Returns self."""
+        self.files += other.files
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        self.seconds += other.seconds
+        self.errors.extend(other.errors)
+        return self
+
+
+def _run_batch(pairs, key: bytes, decrypt: bool, workers) -> BatchStats:
+    pairs = [(Path(a), Path(b)) for a, b in pairs]
+    if workers is None:
+        workers = min(8, os.cpu_count() or 1)
+    stats = BatchStats()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [(a, pool.submit(_transform_file, a, b, key, decrypt)) for a, b in pairs]
+        for in_path, fut in futures:
+            try:
+                stats.bytes_out += fut.result()
+                stats.bytes_in += in_path.stat().st_size
+                stats.files += 1
+            except Exception as e:
+                stats.errors.append((in_path, e))
+    stats.seconds = time.perf_counter() - t0
+    return stats
+
+
+def decrypt_files(pairs, key: bytes, workers=None) -> BatchStats:
+    """Decrypt (in_path, out_path) pairs in parallel. Failures are collected in stats.errors."""
+    return _run_batch(pairs, key, True, workers)
+
+
+class ArchiveStats:
+    """Result of write_encrypted_zip."""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes_in = 0
+        self.bytes_out = 0  # size of the finished zip, the only thing written to disk
+        self.seconds = 0.0
+
+    def report(self) -> str:
+        mb = self.bytes_in / 1e6
+        rate = mb / self.seconds if self.seconds > 0 else 0.0
+        return (f"archived {self.files} files, {mb:.1f} MB in {self.seconds:.2f}s ({rate:.1f} MB/s), "
+                f"disk written {self.bytes_out / 1e6:.1f} MB (zip only, no temporary encrypted copy)")
+
+
+def _encrypt_to_bytes(in_path: Path, key: bytes) -> bytes:
+    buf = io.BytesIO()
+    with open(in_path, "rb") as src:
+        encrypt_stream(src, buf, key)
+    return buf.getvalue()
+
+
+def write_encrypted_zip(src_dir: Path, zip_path: Path, key: bytes, workers=None) -> ArchiveStats:
+    """
+    Encrypt every file under src_dir into zip_path in one pass.
+    Entries are stored (ciphertext does not deflate) under their path relative
+    to src_dir, with a directory entry per subfolder, which is the layout
+    shutil.make_archive(root_dir=...) produced, so find_payload_root on the
+    receiving side sees the same tree. Files are encrypted on a thread pool
+    (at most 2 * workers held in memory) and added in sorted order, so the
+    zip does not depend on workers. The zip is written as zip_path.part and
+    renamed when complete.
+    """
+    src_dir = Path(src_dir)
+    zip_path = Path(zip_path)
+    if workers is None:
+        workers = min(8, os.cpu_count() or 1)
+    workers = max(1, workers)
+    tmp = zip_path.with_name(zip_path.name + ".part")
+    stats = ArchiveStats()
+    t0 = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool, \
+                zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_STORED) as zf:
+            pending = deque()  # (ZipInfo, plaintext size, future or None for a folder), in zip order
+
+            def add(limit):
+                while len(pending) > limit:
+                    info, size, fut = pending.popleft()
+                    if fut is None:
+                        zf.writestr(info, b"")
+                        continue
+                    zf.writestr(info, fut.result())
+                    stats.files += 1
+                    stats.bytes_in += size
+
+            for p in sorted(src_dir.rglob("*")):
+                info = zipfile.ZipInfo.from_file(p, p.relative_to(src_dir).as_posix())
+                if p.is_dir():
+                    pending.append((info, 0, None))
+                else:
+                    info.compress_type = zipfile.ZIP_STORED
+                    pending.append((info, p.stat().st_size, pool.submit(_encrypt_to_bytes, p, key)))
+                add(2 * workers)
+            add(0)
+        os.replace(tmp, zip_path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    stats.bytes_out = zip_path.stat().st_size
+    stats.seconds = time.perf_counter() - t0
+    return stats
+
+
+def decrypt_zip(zip_path: Path, members, key: bytes, workers=None) -> BatchStats:
+    """
+    Decrypt (member name, out_path) pairs straight out of zip_path in
+    parallel, without extracting the archive. Output is byte-identical to
+    extracting the members and running decrypt_file on them. Failures are
+    collected in stats.errors as (member name, exception).
+    """
+    members = [(name, Path(out)) for name, out in members]
+    if workers is None:
+        workers = min(8, os.cpu_count() or 1)
+    stats = BatchStats()
+    t0 = time.perf_counter()
+
+    # zipfile serializes reads of a shared archive, so each thread opens its own
+    local = threading.local()
+    opened = []
+    lock = threading.Lock()
+
+    def work(name, out_path):
+        zf = getattr(local, "zf", None)
+        if zf is None:
+            zf = local.zf = zipfile.ZipFile(zip_path)
+            with lock:
+                opened.append(zf)
+        with zf.open(name) as src:
+            written = _stream_to_file(src, out_path, key, True)
+        return zf.getinfo(name).file_size, written
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = [(name, pool.submit(work, name, out)) for name, out in members]
+            for name, fut in futures:
+                try:
+                    size_in, size_out = fut.result()
+                    stats.bytes_in += size_in
+                    stats.bytes_out += size_out
+                    stats.files += 1
+                except Exception as e:
+                    stats.errors.append((name, e))
+    finally:
+        for zf in opened:
+            zf.close()
+    stats.seconds = time.perf_counter() - t0
+    return stats
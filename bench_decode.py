@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark reduced-resolution JPEG screening (--decode_scale) against full decode.
+
+For every JPEG we time a plain full cv2.imread, and read_image() at each
+decode scale (reduced decode + red screen + full re-read if it passes).
+Images the full detector matches but the screen rejected are listed as misses.
+Since a screened-out image also skips detection, decode + detection is timed
+as well, and the share of images the screen would have to reject to pay for
+its reduced decode is printed next to the share it did reject.
+
+Most bundled images are PNG; --as_jpeg re-encodes them to JPEG in a temp
+folder first so the screen has something to work on.
+
+Usage:
+  python bench_decode.py --in_dir 100_images --in_dir optional_images --as_jpeg
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+
+from find_red_circles import JPEG_EXTS, REDUCED_DECODE_FLAGS, has_red_circle, read_image
+
+
+def collect(in_dirs, as_jpeg, tmp_dir):
+    exts = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+    files = []
+    for d in in_dirs:
+        for p in sorted(Path(d).iterdir()):
+            if p.suffix.lower() not in exts:
+                continue
+            if p.suffix.lower() in JPEG_EXTS:
+                files.append(p)
+            elif as_jpeg:
+                img = cv2.imread(str(p))
+                if img is None:
+                    continue
+                out = Path(tmp_dir) / f"{Path(d).name}_{p.stem}.jpg"
+                cv2.imwrite(str(out), img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+                files.append(out)
+    return files
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in_dir", action="append", required=True, help="Image folder (repeatable)")
+    ap.add_argument("--as_jpeg", action="store_true", help="Re-encode non-JPEG inputs as JPEG first")
+    ap.add_argument("--repeat", type=int, default=3, help="Timing repetitions (best is kept)")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = collect(args.in_dir, args.as_jpeg, tmp)
+        if not files:
+            print("No JPEG inputs.")
+            return
+
+        positives = set()
+        full_time = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            imgs = [cv2.imread(str(p)) for p in files]
+            full_time = min(full_time, time.perf_counter() - t0)
+        full_scan = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            for p in files:
+                img = cv2.imread(str(p))
+                if img is not None and has_red_circle(img)[0]:
+                    positives.add(p)
+            full_scan = min(full_scan, time.perf_counter() - t0)
+        del imgs
+
+        print(f"{len(files)} JPEGs, {len(positives)} detector matches")
+        print(f"full decode: {full_time:.3f}s ({full_time / len(files) * 1000:.2f} ms/img), "
+              f"with detection {full_scan:.3f}s")
+
+        for scale in (2, 4, 8):
+            best = reduced = scan = float("inf")
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                for p in files:
+                    cv2.imread(str(p), REDUCED_DECODE_FLAGS[scale])
+                reduced = min(reduced, time.perf_counter() - t0)
+
+                screened = []
+                t0 = time.perf_counter()
+                for p in files:
+                    _, s = read_image(p, scale)
+                    if s:
+                        screened.append(p)
+                best = min(best, time.perf_counter() - t0)
+
+                t0 = time.perf_counter()
+                for p in files:
+                    img, s = read_image(p, scale)
+                    if not s and img is not None:
+                        has_red_circle(img)
+                scan = min(scan, time.perf_counter() - t0)
+
+            missed = [p.name for p in screened if p in positives]
+            saved = full_time - best
+            print(f"1/{scale}: {best:.3f}s ({best / len(files) * 1000:.2f} ms/img), "
+                  f"screened out {len(screened)}/{len(files)} "
+                  f"(break-even {reduced / full_time * 100:.0f}%), "
+                  f"saved {saved:.3f}s ({saved / full_time * 100:.0f}%), "
+                  f"with detection saved {(full_scan - scan) / full_scan * 100:.0f}%, "
+                  f"missed matches: {missed or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Measure what buffer reuse in RedCircleDetector saves per frame.
+
+Every bundled image is resized to one frame size (like a camera dump) and run
+through detection twice:
+  fresh   - a new RedCircleDetector per frame (allocates hsv/band/mask/closed/blur
+            every time, like the old has_red_circle)
+  reused  - one detector for all frames (buffers allocated once, filled via dst=)
+
+Reported per frame: mean latency, traced heap growth (tracemalloc, numpy and
+OpenCV output arrays included) and bytes of frame buffers newly allocated.
+
+Usage:
+  python bench_detector.py --size 1920x1080
+"""
+
+import argparse
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from find_red_circles import RedCircleDetector
+
+DEFAULT_SETS = ["100_images", "optional_images", "red-circle-finder/input_images"]
+
+
+def load_frames(set_dirs, size):
+    exts = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+    frames = []
+    for d in set_dirs:
+        for p in sorted(Path(d).iterdir()):
+            if p.suffix.lower() not in exts:
+                continue
+            img = cv2.imread(str(p))
+            if img is not None:
+                frames.append(cv2.resize(img, size, interpolation=cv2.INTER_AREA))
+    return frames
+
+
+def run(frames, reuse: bool):
+    shared = RedCircleDetector()
+    times, peaks = [], []
+    buffer_bytes = 0
+    found = []
+    for img in frames:
+        det = shared if reuse else RedCircleDetector()
+        before = det._bufs
+
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        res = det.detect(img)
+        times.append(time.perf_counter() - t0)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        peaks.append(peak)
+        if det._bufs is not before:
+            buffer_bytes += sum(b.nbytes for b in det._bufs.values())
+        found.append((res.found, res.circle))
+    return np.array(times), np.array(peaks), buffer_bytes, found
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--set", action="append", default=None, help="Image folder (repeatable)")
+    ap.add_argument("--size", default="1920x1080", help="Frame size WxH every image is resized to")
+    args = ap.parse_args()
+
+    w, h = (int(v) for v in args.size.lower().split("x"))
+    frames = load_frames(args.set or DEFAULT_SETS, (w, h))
+    n = len(frames)
+
+    # Warm up OpenCV so one-time init is not billed to the first mode
+    RedCircleDetector().detect(frames[0])
+
+    results = {}
+    for name, reuse in (("fresh", False), ("reused", True)):
+        times, peaks, buffer_bytes, found = run(frames, reuse)
+        results[name] = found
+        print(f"{name:7s} {n} frames {w}x{h}: {times.mean() * 1000:7.2f} ms/frame, "
+              f"heap growth {peaks.mean() / 1e6:6.2f} MB/frame, "
+              f"frame buffers allocated {buffer_bytes / n / 1e6:6.2f} MB/frame")
+
+    same = results["fresh"] == results["reused"]
+    print(f"Results identical: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Benchmark candidate scoring in has_red_circle: old full-frame scorer vs the
+ROI-local batched scorer now in find_red_circles.py.
+
+For every image we run the HSV/morph/Hough front end once, then score the same
+Hough candidates with both engines and report per-image latency, peak memory
+(tracemalloc, numpy allocations included) and whether the decisions agree.
+
+Usage:
+  python bench_scoring.py --in_dir optional_images --in_dir red-circle-finder/input_images
+  python bench_scoring.py --in_dir 100_images --upscale 4     # simulate ~12-24 MP frames
+"""
+
+import argparse
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from find_red_circles import _angular_coverage, _best_candidate
+
+
+def hough_front_end(img_bgr):
+    hsv = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV)
+    mask_raw = cv2.bitwise_or(
+        cv2.inRange(hsv, np.array([0, 80, 80]), np.array([10, 255, 255])),
+        cv2.inRange(hsv, np.array([170, 80, 80]), np.array([180, 255, 255])),
+    )
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
+    mask = cv2.morphologyEx(mask_raw, cv2.MORPH_CLOSE, kernel, iterations=1)
+    mask_blur = cv2.GaussianBlur(mask, (9, 9), 2)
+    circles = cv2.HoughCircles(
+        mask_blur, cv2.HOUGH_GRADIENT, dp=1.2, minDist=15,
+        param1=100, param2=50, minRadius=3, maxRadius=30,
+    )
+    return mask_raw, circles
+
+
+def score_full_frame(mask_raw, circles):
+    """The original per-candidate full-frame scorer, kept here as the baseline."""
+    best = None
+    h, w = mask_raw.shape
+    yy, xx = np.ogrid[:h, :w]
+
+    if circles is not None:
+        for (x, y, r) in circles[0].astype(np.float32):
+            r = float(r)
+            dist2 = (xx - x) ** 2 + (yy - y) ** 2
+
+            t = max(2.0, r * 0.18)
+            ring = (dist2 <= (r + t) ** 2) & (dist2 >= max(1.0, (r - t)) ** 2)
+            inner_r = max(1.0, r - 2.2 * t)
+            inner = dist2 <= inner_r ** 2
+
+            ring_ratio = (mask_raw[ring].mean() / 255.0) if np.any(ring) else 0.0
+            inner_ratio = (mask_raw[inner].mean() / 255.0) if np.any(inner) else 1.0
+            score = (ring_ratio - inner_ratio) * ring_ratio
+
+            if best is None or score > best["score"]:
+                best = {"score": float(score), "x": float(x), "y": float(y), "r": float(r),
+                        "ring_ratio": float(ring_ratio), "inner_ratio": float(inner_ratio)}
+
+    if best is None:
+        return None, 0
+
+    coords = np.column_stack(np.nonzero(mask_raw > 0))
+    if coords.size == 0:
+        return best, 0
+    dy = coords[:, 0] - best["y"]
+    dx = coords[:, 1] - best["x"]
+    dist = np.sqrt(dx * dx + dy * dy)
+    t = max(2.0, best["r"] * 0.18)
+    ann = coords[(dist >= best["r"] - t) & (dist <= best["r"] + t)]
+    if ann.shape[0] < 12:
+        return best, 0
+    angles = (np.arctan2(ann[:, 0] - best["y"], ann[:, 1] - best["x"]) + 2 * np.pi) % (2 * np.pi)
+    hist = np.bincount(np.floor(angles / (2 * np.pi) * 12).astype(int), minlength=12)
+    return best, int((hist >= 1).sum())
+
+
+def score_roi(mask_raw, circles):
+    if circles is None:
+        return None, 0
+    best = _best_candidate(mask_raw, circles[0].astype(np.float32))
+    return best, _angular_coverage(mask_raw, best["x"], best["y"], best["r"])
+
+
+def measure(fn, mask_raw, circles):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = fn(mask_raw, circles)
+    dt = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, dt, peak
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in_dir", action="append", required=True, help="Image folder (repeatable)")
+    ap.add_argument("--upscale", type=float, default=1.0, help="Resize inputs by this factor first")
+    args = ap.parse_args()
+
+    exts = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+    files = [p for d in args.in_dir for p in sorted(Path(d).iterdir()) if p.suffix.lower() in exts]
+
+    rows = []
+    mismatches = 0
+    for p in files:
+        img = cv2.imread(str(p))
+        if img is None:
+            continue
+        if args.upscale != 1.0:
+            img = cv2.resize(img, None, fx=args.upscale, fy=args.upscale, interpolation=cv2.INTER_NEAREST)
+
+        mask_raw, circles = hough_front_end(img)
+        if circles is None:
+            continue
+
+        (old_best, old_cov), old_dt, old_peak = measure(score_full_frame, mask_raw, circles)
+        (new_best, new_cov), new_dt, new_peak = measure(score_roi, mask_raw, circles)
+
+        if old_best != new_best or old_cov != new_cov:
+            mismatches += 1
+            print(f"MISMATCH {p.name}: {old_best} cov={old_cov} vs {new_best} cov={new_cov}")
+
+        rows.append((old_dt, new_dt, old_peak, new_peak))
+        print(f"{p.name:60s} {img.shape[1]}x{img.shape[0]} cands={circles.shape[1]:3d} "
+              f"full={old_dt * 1000:8.2f}ms/{old_peak / 1e6:7.1f}MB  "
+              f"roi={new_dt * 1000:7.2f}ms/{new_peak / 1e6:6.2f}MB")
+
+    if not rows:
+        print("No images with Hough candidates.")
+        return
+
+    arr = np.array(rows)
+    print()
+    print(f"Images with candidates: {len(rows)}  mismatches: {mismatches}")
+    print(f"Mean scoring latency: full-frame {arr[:, 0].mean() * 1000:.2f} ms, ROI {arr[:, 1].mean() * 1000:.2f} ms")
+    print(f"Max peak memory:      full-frame {arr[:, 2].max() / 1e6:.1f} MB, ROI {arr[:, 3].max() / 1e6:.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
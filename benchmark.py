@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Accuracy + speed benchmark for the red circle detector over the bundled image sets.
+
+Labels come from the file names:
+  positive: pos*, posex*, correct_img*, image<N> (copies of pos*)
+  negative: incorrect_img*, cir*, red*, noise*, space*, and the other stock photos
+
+Each mode runs in a fresh process so its peak RSS is its own. Latency is per
+image and includes decode (so --decode_scale modes are comparable).
+
+Usage:
+  python benchmark.py                                  # full mode, write benchmark_results.json
+  python benchmark.py --mode full --mode pyramid --mode decode4
+  python benchmark.py --out new.json --compare benchmark_results.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import re
+import resource
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_SETS = ["100_images", "optional_images", "red-circle-finder/input_images"]
+
+POSITIVE = re.compile(r"^(pos|correct_img|image\d)")
+
+MODES = {
+    "full": dict(),
+    "pyramid": dict(pyramid=True),
+    "decode2": dict(decode_scale=2),
+    "decode4": dict(decode_scale=4),
+    "decode8": dict(decode_scale=8),
+}
+
+
+def label_for(p: Path) -> bool:
+    return bool(POSITIVE.match(p.name))
+
+
+def collect(set_dirs):
+    exts = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+    return [p for d in set_dirs for p in sorted(Path(d).iterdir()) if p.suffix.lower() in exts]
+
+
+def run_mode(mode: str, files):
+    """Runs in a child process: detect every file and return raw per-image results."""
+    from find_red_circles import has_red_circle, read_image
+
+    opts = MODES[mode]
+    decode_scale = opts.get("decode_scale", 1)
+    pyramid = opts.get("pyramid", False)
+
+    rows = []
+    t_start = time.perf_counter()
+    for p in files:
+        t0 = time.perf_counter()
+        img, screened = read_image(Path(p), decode_scale)
+        if img is None:
+            continue
+        found = False if screened else bool(has_red_circle(img, pyramid=pyramid)[0])
+        rows.append((p, found, time.perf_counter() - t0))
+    wall = time.perf_counter() - t_start
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rows, wall, peak_kb
+
+
+def summarize(rows, wall, peak_kb):
+    tp = fp = fn = tn = 0
+    wrong = []
+    for p, found, _ in rows:
+        positive = label_for(Path(p))
+        if found and positive:
+            tp += 1
+        elif found:
+            fp += 1
+            wrong.append(("fp", p))
+        elif positive:
+            fn += 1
+            wrong.append(("fn", p))
+        else:
+            tn += 1
+
+    lat = np.array([dt for _, _, dt in rows]) * 1000.0
+    return {
+        "images": len(rows),
+        "tp": tp, "fp": fp, "fn": fn, "tn": tn,
+        "precision": tp / (tp + fp) if tp + fp else 0.0,
+        "recall": tp / (tp + fn) if tp + fn else 0.0,
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p95_ms": float(np.percentile(lat, 95)),
+        "max_ms": float(lat.max()),
+        "images_per_s": len(rows) / wall if wall > 0 else 0.0,
+        "peak_rss_mb": peak_kb / 1024.0,
+        "misclassified": [f"{kind} {p}" for kind, p in wrong],
+    }
+
+
+def compare(current, baseline, max_accuracy_drop, max_slowdown):
+    """Return a list of regression messages (empty when everything is within limits)."""
+    failures = []
+    for mode, cur in current["modes"].items():
+        base = baseline.get("modes", {}).get(mode)
+        if base is None:
+            print(f"{mode}: not in baseline, skipped")
+            continue
+
+        for key in ("precision", "recall"):
+            drop = base[key] - cur[key]
+            if drop > max_accuracy_drop:
+                failures.append(f"{mode}: {key} {base[key]:.3f} -> {cur[key]:.3f}")
+
+        if base["images_per_s"] > 0:
+            slowdown = 1.0 - cur["images_per_s"] / base["images_per_s"]
+            if slowdown > max_slowdown:
+                failures.append(f"{mode}: throughput {base['images_per_s']:.1f} -> "
+                                f"{cur['images_per_s']:.1f} img/s ({slowdown * 100:.0f}% slower)")
+
+        print(f"{mode}: precision {base['precision']:.3f} -> {cur['precision']:.3f}, "
+              f"recall {base['recall']:.3f} -> {cur['recall']:.3f}, "
+              f"{base['images_per_s']:.1f} -> {cur['images_per_s']:.1f} img/s")
+    return failures
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--set", action="append", default=None, help="Image folder (repeatable)")
+    ap.add_argument("--mode", action="append", default=None, choices=sorted(MODES),
+                    help="Detector mode to run (repeatable, default: full)")
+    ap.add_argument("--out", default="benchmark_results.json", help="Where to write the results JSON")
+    ap.add_argument("--compare", default=None, help="Baseline results JSON to check against")
+    ap.add_argument("--max_accuracy_drop", type=float, default=0.0,
+                    help="Allowed drop in precision/recall vs baseline")
+    ap.add_argument("--max_slowdown", type=float, default=0.10,
+                    help="Allowed throughput loss vs baseline (fraction)")
+    args = ap.parse_args()
+
+    files = [str(p) for p in collect(args.set or DEFAULT_SETS)]
+    modes = args.mode or ["full"]
+
+    results = {"sets": args.set or DEFAULT_SETS, "modes": {}}
+    ctx = multiprocessing.get_context("spawn")
+    for mode in modes:
+        with ctx.Pool(1) as pool:
+            rows, wall, peak_kb = pool.apply(run_mode, (mode, files))
+        s = summarize(rows, wall, peak_kb)
+        results["modes"][mode] = s
+        print(f"{mode:8s} n={s['images']} P={s['precision']:.3f} R={s['recall']:.3f} "
+              f"(tp={s['tp']} fp={s['fp']} fn={s['fn']} tn={s['tn']})  "
+              f"p50={s['p50_ms']:.1f}ms p95={s['p95_ms']:.1f}ms max={s['max_ms']:.1f}ms  "
+              f"{s['images_per_s']:.1f} img/s  peak RSS {s['peak_rss_mb']:.0f} MB")
+
+    Path(args.out).write_text(json.dumps(results, indent=2) + "\n")
+    print(f"Results -> {args.out}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        failures = compare(results, baseline, args.max_accuracy_drop, args.max_slowdown)
+        if failures:
+            print("REGRESSION:")
+            for f in failures:
+                print("  " + f)
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,246 @@
 #!/usr/bin/env python3
 
 from pathlib import Path
+import json
+import threading
 import time
 import sys
 import subprocess
 
+import receiver
+from manifest import MANIFEST_NAME, find_mismatches, manifest_line, merkle_levels, read_manifest
+
+try:
+    from inotify_watch import IN_CLOSE_WRITE, IN_MOVED_TO, Inotify
+except (ImportError, OSError, AttributeError):  # not Linux: poll instead
+    Inotify = None
+
 BASE_DIR = Path("/home/user/group-9-team-project-main/red-circle-finder/matched")
 
-ORIGINAL_MD5 = BASE_DIR / "matched.manifest.md5"
-RETURNED_MD5 = BASE_DIR / "returned.manifest.md5"
+ORIGINAL_NAME = "matched.manifest.md5"
+RETURNED_NAME = "returned.manifest.md5"
+ORIGINAL_MD5 = BASE_DIR / ORIGINAL_NAME
+RETURNED_MD5 = BASE_DIR / RETURNED_NAME
+
+# matched.manifest.md5 is the Merkle root over the per-file lines of this
+ORIGINAL_MANIFEST = BASE_DIR / MANIFEST_NAME
 
 MATCH_IMAGE = "/home/user/group-9-team-project-main/red-circle-finder/hellothere.jpg"
 MISMATCH_IMAGE = "/home/user/group-9-team-project-main/red-circle-finder/youhavefailed.jpg"
+MISMATCH_SECONDS = 6
 
 FIND_SCRIPT = Path("/home/user/group-9-team-project-main/red-circle-finder/photodiode_receiver.py")
 
+ATTEMPTS = 2
+
+# Node queries after a NAK (see transmission.serve_nodes): wait per try, tries
+QUERY_WAIT = 1.0
+QUERY_TRIES = 3
+
 
 def read_md5(md5_file: Path) -> str:
     return md5_file.read_text().split()[0].strip().lower()
 
 
+def locate_bad_files(base_dir: Path, ask):
+    """
+    When the roots differ, name the files that differ by walking down only
+    the mismatching branches of the Merkle tree, asking the receiver for its
+    node digests over the link: ask(what) returns its answer to "leaves"
+    (file count) or "<level>.<index>" (digest, hex). See serial_receiver and
+    transmission.serve_nodes. Returns None if there is nothing to compare
+    against (no local manifest, or the file lists differ in length).
+    """
+    original = base_dir / ORIGINAL_MANIFEST.name
+    if not original.exists():
+        return None
+
+    local = read_manifest(original)
+    theirs = int(ask("leaves"))
+    if theirs != len(local):
+        # Different file lists give differently shaped trees
+        print(f"Receiver has {theirs} files in its manifest, sender {len(local)}")
+        return None
+    if not local:
+        return []
+
+    mine = merkle_levels([manifest_line(*e) for e in local])
+    bad = find_mismatches(mine, lambda lvl, i: bytes.fromhex(ask(f"{lvl}.{i}")))
+    return [local[i][0] for i in bad]
+
+
 def wait_for_file(file_path: Path, timeout=300):
-    start = time.time()
-    while not file_path.exists():
-        if time.time() - start > timeout:
-            return False
-        time.sleep(1)
-    return True
+    """
+    Wait until file_path has been written (inotify on its folder, so this
+    returns as soon as the writer closes it). Falls back to polling where
+    inotify is not available.
+    """
+    if Inotify is None:
+        start = time.time()
+        while not file_path.exists():
+            if time.time() - start > timeout:
+                return False
+            time.sleep(0.1)
+        return True
 
+    with Inotify() as ino:
+        ino.add_watch(file_path.parent, IN_CLOSE_WRITE | IN_MOVED_TO)
+        # Watch first, then look, so a file written in between is not missed
+        if file_path.exists():
+            return True
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if any(ev.name == file_path.name for ev in ino.read_events(remaining)):
+                return True
 
-def open_image(image_path: Path):
-    subprocess.Popen(
+
+def file_receiver(returned_md5: Path = RETURNED_MD5, timeout=300):
+    """receive() for verify_round_trip: the hash written to returned_md5 by receiver.py."""
+    def receive():
+        if not wait_for_file(returned_md5, timeout):
+            return None
+        return read_md5(returned_md5)
+
+    def retry():
+        returned_md5.unlink(missing_ok=True)
+        restart_find_script()
+
+    receive.retry = retry
+    return receive
+
+
+def serial_receiver(link, returned_md5: Path, timeout=300, resend=None):
+    """
+    receive() for verify_round_trip that reads the framed hash from an open
+    serial link in this process (receiver.receive_frame), so retries do not
+    start a new receiver. The hash is only answered once it has been compared
+    (receive.reply): ACK if the roots match, NAK if not, so the transmitter
+    learns the verdict. Repeats are answered after that (receive.done), off
+    the latency path. The receiver's stage timings (TIM frame) end up in
+    receive.remote. After a NAK, receive.ask() queries the receiver's Merkle
+    nodes (locate_bad_files). Before another attempt, resend() (e.g. show
+    the zip again) is called, since a NAKed receiver has nothing new to send.
+    """
+    last = {}
+
+    def on_other(kind, payload):
+        if kind == b"TIM":
+            receive.remote = receiver.parse_timings(payload)
+
+    def receive():
+        receive.remote = {}
+        payload = receiver.receive_frame(link, timeout=timeout, other=on_other)
+        if payload is None:
+            return None
+        last["payload"] = payload
+        md5_string = payload.decode().lower()
+        returned_md5.write_text(md5_string + "  matched.manifest\n")
+        return md5_string
+
+    def reply(match: bool):
+        if "payload" in last:
+            last["reply"] = "ACK" if match else "NAK"
+            link.send(last["reply"], last["payload"])
+
+    def ask(what: str) -> str:
+        prefix = what.encode() + b"."
+        for _ in range(QUERY_TRIES):
+            link.send("NODE", what)
+            answer = receiver.receive_frame(link, b"HASH", QUERY_WAIT, lambda p: p.startswith(prefix))
+            if answer is not None:
+                return answer[len(prefix):].decode()
+        raise TimeoutError(f"no answer to node query {what}")
+
+    def done():
+        if "payload" in last:
+            reply = last.pop("reply", "ACK")
+            if reply == "NAK":
+                link.send("DONE", "")  # ends the receiver's node queries
+            receiver.answer_repeats(link, last.pop("payload"), reply=reply)
+
+    def retry():
+        done()
+        if resend is not None:
+            resend()
+
+    receive.remote = {}
+    receive.reply = reply
+    receive.ask = ask
+    receive.retry = retry
+    receive.done = done
+    return receive
+
+
+class RoundTrip:
+    """
+    Latency breakdown of one verification attempt (time.time() stamps).
+    remote holds the receiver's own stage times (TIM frame, see
+    transmission.send_md5); its "process" total, taken off the time until the
+    hash arrived, leaves the QR transfer, download and queueing.
+    """
+
+    def __init__(self, attempt: int, sent_at: float):
+        self.attempt = attempt
+        self.sent_at = sent_at        # sender finished (payload on screen)
+        self.received_at = None       # returned hash available
+        self.remote = {}              # receiver stage -> seconds
+        self.compared_at = None       # roots compared
+        self.replied_at = None        # verdict (ACK/NAK) sent back
+        self.located_at = None        # mismatching files named (after a NAK)
+        self.bad = None               # their names, None if not located
+        self.match = None
+
+    def record(self) -> dict:
+        received_s = None if self.received_at is None else self.received_at - self.sent_at
+        transfer_s = None
+        if received_s is not None and "process" in self.remote:
+            transfer_s = received_s - self.remote["process"]
+        return {
+            "attempt": self.attempt,
+            "sent_at": self.sent_at,
+            "received_s": received_s,
+            "transfer_s": transfer_s,
+            "remote": self.remote,
+            "compare_s": None if self.compared_at is None else self.compared_at - self.received_at,
+            "reply_s": None if self.replied_at is None else self.replied_at - self.compared_at,
+            "locate_s": None if self.located_at is None else self.located_at - self.replied_at,
+            "bad": self.bad,
+            "match": self.match,
+        }
+
+    def report(self) -> str:
+        if self.received_at is None:
+            return f"attempt {self.attempt}: no hash received"
+        r = self.record()
+        verdict = "match" if self.match else "MISMATCH"
+        parts = []
+        if r["transfer_s"] is not None:
+            parts.append(f"QR transfer + download + queue {r['transfer_s']:.2f}s")
+        parts += [f"receiver {name} {seconds:.2f}s" for name, seconds in self.remote.items()]
+        split = f" ({', '.join(parts)})" if parts else ""
+        located = ""
+        if self.bad is not None:
+            located = f", located {len(self.bad)} bad files in {r['locate_s']:.2f}s"
+        elif r["locate_s"] is not None:
+            located = ", bad files not located"
+        return (f"attempt {self.attempt}: sender finish -> hash received {r['received_s']:.2f}s{split}, "
+                f"compare {r['compare_s'] * 1e3:.2f} ms, verdict sent {r['reply_s'] * 1e3:.1f} ms{located} "
+                f"({verdict})")
+
+
+def show_image(image_path, seconds=None):
+    """Show image_path full screen without blocking; close it again after seconds, if given."""
+    proc = subprocess.Popen(
         ["eom", "--fullscreen", str(image_path)],
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL
     )
-    time.sleep(6)
-    subprocess.run(["pkill", "eom"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if seconds:
+        threading.Timer(seconds, proc.terminate).start()
+    return proc
 
 
 def restart_find_script():
@@ -47,34 +251,71 @@ def restart_find_script():
     )
 
 
+def verify_round_trip(base_dir: Path, receive, sent_at: float, attempts: int = ATTEMPTS, log_path=None):
+    """
+    Compare the returned hash against matched.manifest.md5 in base_dir.
+    receive() blocks until a hash arrives (None on timeout); receive.reply(match)
+    is called with the verdict if present, receive.ask (see locate_bad_files)
+    names the mismatching files if present, and receive.retry() is called
+    before another attempt. Each attempt's latency breakdown (RoundTrip) is printed and, with
+    log_path, appended there as a JSON line.
+    Returns True on a match.
+    """
+    original_hash = read_md5(base_dir / ORIGINAL_NAME)
+    ok = False
+
+    for attempt in range(1, attempts + 1):
+        rt = RoundTrip(attempt, sent_at)
+        returned_hash = receive()
+        if returned_hash is not None:
+            rt.received_at = time.time()
+            rt.remote = dict(getattr(receive, "remote", {}))
+            rt.match = returned_hash == original_hash
+            rt.compared_at = time.time()
+            reply = getattr(receive, "reply", None)
+            if reply is not None:
+                reply(rt.match)
+            rt.replied_at = time.time()
+
+            ask = getattr(receive, "ask", None)
+            if not rt.match and ask is not None:
+                try:
+                    rt.bad = locate_bad_files(base_dir, ask)
+                except (TimeoutError, ValueError) as e:
+                    print(f"Could not locate the mismatching files: {e}")
+                rt.located_at = time.time()
+
+        print(rt.report())
+        if rt.bad:
+            print("Mismatching files: " + ", ".join(rt.bad))
+        if log_path is not None:
+            with open(log_path, "a") as f:
+                f.write(json.dumps(rt.record()) + "\n")
+
+        if rt.match:
+            show_image(MATCH_IMAGE)
+            ok = True
+            break
+
+        show_image(MISMATCH_IMAGE, MISMATCH_SECONDS)
+        if attempt < attempts:
+            receive.retry()
+            sent_at = time.time()
+
+    done = getattr(receive, "done", None)
+    if done is not None:
+        done()
+    return ok
+
+
 def main():
     if not ORIGINAL_MD5.exists():
         sys.exit(1)
 
-    for _ in range(2):
-        if not wait_for_file(RETURNED_MD5, 300):
-            open_image(MISMATCH_IMAGE)
-            restart_find_script()
-            continue
-
-        original_hash = read_md5(ORIGINAL_MD5)
-        returned_hash = read_md5(RETURNED_MD5)
-
-        if original_hash == returned_hash:
-            subprocess.Popen(
-                ["eom", "--fullscreen", MATCH_IMAGE],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-            sys.exit(0)  
-
-        open_image(MISMATCH_IMAGE)
-        RETURNED_MD5.unlink(missing_ok=True)
-        restart_find_script()
-
-    sys.exit(2)
+    ok = verify_round_trip(BASE_DIR, file_receiver(RETURNED_MD5, 300), time.time(),
+                           log_path=BASE_DIR.parent / (BASE_DIR.name + "_round_trip.jsonl"))
+    sys.exit(0 if ok else 2)
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,20 @@
+import os
+
+import pytest
+
+from serial_frame import SerialLink
+
+
+@pytest.fixture
+def pty_pair():
+    """
+    A serial link over a pseudo-terminal instead of /dev/serial0 or COM4:
+    (link opened by the pty slave's path, link on the master fd).
+    """
+    master, slave = os.openpty()
+    near = SerialLink(os.ttyname(slave), 115200)
+    far = SerialLink("pty-master", fd=master)
+    yield near, far
+    near.close()
+    far.close()
+    os.close(slave)
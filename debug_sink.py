@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Asynchronous sink for --debug_dir artifacts (masks, overlays, crop previews).
+
+The scan hands each image's debug jobs to DebugSink.submit() and moves on; a
+small thread pool does the PNG encoding (cv2.imencode releases the GIL) and one
+background thread writes the results in submission order. Which images are kept
+can be sampled (DebugSampler):
+
+  every          - keep about one image in N (chosen by a hash of the file
+                   name, so the choice does not depend on worker order)
+  only_matches   - keep matched images only
+  near_threshold - keep images whose ring/inner/score/coverage values are
+                   within this fraction of a detector threshold (the
+                   borderline cases worth looking at)
+
+The sampler is a plain picklable object, so the scan can ask it before the
+debug artifacts are even made (detect_image's debug_sample): images that are
+not kept never have their mask copied or sent between processes.
+
+Masks can be shrunk by a factor (mask_scale 4 = a quarter of the width). PNGs use OpenCV's default settings
+(level 1 with the RLE strategy, faster than any explicit zlib level) unless
+png_level is given.
+bundle=True stores everything in one SQLite file (debug_bundle.sqlite) with a
+per-image scores table, instead of thousands of small PNGs; without it the
+scores go to debug_scores.csv next to the PNGs.
+"""
+
+import csv
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+
+BUNDLE_NAME = "debug_bundle.sqlite"
+SCORES_NAME = "debug_scores.csv"
+SCORE_FIELDS = ["name", "status", "score", "ring_ratio", "inner_ratio", "coverage", "x", "y", "r"]
+
+
+def debug_name(p: Path, in_root=None) -> str:
+    """
+    Key of an image's debug artifacts and scores row: its path relative to
+    in_root (the scanned folder) without the extension, so a/x.png and
+    b/x.png of a --recursive scan do not overwrite each other ("x" without
+    in_root).
+    """
+    rel = Path(Path(p).name) if in_root is None else Path(p).relative_to(in_root)
+    return rel.with_suffix("").as_posix()
+
+
+def near_threshold(info: dict, thresholds: dict, margin: float) -> bool:
+    """
+    True if any detector value in info lies within margin (a fraction of the
+    threshold) of its threshold. thresholds maps value name -> threshold.
+    """
+    for key, limit in thresholds.items():
+        value = info.get(key)
+        if value is not None and abs(value - limit) <= margin * limit:
+            return True
+    return False
+
+
+class DebugSampler:
+    """Decides which images keep their debug artifacts (see the module docstring)."""
+
+    def __init__(self, thresholds: dict, every: int = 1, only_matches: bool = False, near: float = 0.0):
+        self.thresholds = thresholds
+        self.every = max(1, every)
+        self.only_matches = only_matches
+        self.near = near
+
+    def want(self, p: Path, status, info: dict) -> bool:
+        if self.only_matches and status != "match":
+            return False
+        if self.near and not near_threshold(info, self.thresholds, self.near):
+            return False
+        return zlib.crc32(Path(p).name.encode()) % self.every == 0
+
+
+class DebugSink:
+    def __init__(self, debug_dir: Path, thresholds: dict, every: int = 1, only_matches: bool = False,
+                 near: float = 0.0, mask_scale: float = 1.0, png_level=None, bundle: bool = False,
+                 workers: int = 2, queue_depth: int = 32):
+        """
+        debug_dir: output folder (created if missing)
+        thresholds: value name -> detector threshold, for near-threshold sampling
+        near: margin for near-threshold sampling, 0 disables it
+        mask_scale: shrink masks by this factor (>= 1)
+        workers: PNG encoding threads
+        queue_depth: images waiting to be written before submit() blocks
+        """
+        if mask_scale < 1.0:
+            raise ValueError(f"mask_scale is a shrink factor and must be >= 1, got {mask_scale}")
+        self.debug_dir = Path(debug_dir)
+        self.debug_dir.mkdir(parents=True, exist_ok=True)
+        self.sampler = DebugSampler(thresholds, every, only_matches, near)
+        self.mask_scale = mask_scale
+        self.png_params = [] if png_level is None else [cv2.IMWRITE_PNG_COMPRESSION, png_level]
+        self.bundle = bundle
+
+        self.submitted = 0
+        self.kept = 0
+        self.files = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self.failed = 0     # images whose artifacts could not be encoded or written
+        self.error = None   # the first such failure
+        self._db = None
+        self._scores_file = None
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self._q = queue.Queue(maxsize=queue_depth)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, p: Path, status, info: dict, in_root=None):
+        """
+        Queue the debug jobs in info["debug"] (from defer_debug) for writing, if
+        sampled. in_root is the scanned folder, for debug_name().
+        """
+        self.submitted += 1
+        jobs = info.get("debug")
+        if not jobs or not self.sampler.want(p, status, info):
+            return
+        self.kept += 1
+        circle = info.get("circle") or (None, None, None)
+        name = debug_name(p, in_root)
+        row = [name, status, info.get("score"), info.get("ring_ratio"), info.get("inner_ratio"),
+               info.get("coverage"), *circle]
+        self._q.put((name, jobs, row, self._pool.submit(self._encode_all, jobs)))
+
+    def _encode(self, kind: str, img):
+        if kind == "mask" and self.mask_scale > 1.0:
+            h, w = img.shape[:2]
+            size = (max(1, round(w / self.mask_scale)), max(1, round(h / self.mask_scale)))
+            img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode(".png", img, self.png_params)
+        return buf if ok else None
+
+    def _encode_all(self, jobs):
+        t0 = time.perf_counter()
+        bufs = [self._encode(kind, img) for _, img, kind in jobs]
+        return bufs, time.perf_counter() - t0
+
+    def _open(self):
+        if self.bundle:
+            self._db = sqlite3.connect(str(self.debug_dir / BUNDLE_NAME))
+            self._db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS images (
+                    name TEXT PRIMARY KEY, status TEXT, score REAL, ring_ratio REAL,
+                    inner_ratio REAL, coverage INTEGER, x REAL, y REAL, r REAL
+                );
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    name TEXT NOT NULL, kind TEXT NOT NULL, png BLOB NOT NULL,
+                    PRIMARY KEY (name, kind)
+                );
+                """
+            )
+        else:
+            scores_path = self.debug_dir / SCORES_NAME
+            new = not scores_path.exists()
+            self._scores_file = open(scores_path, "a", newline="")
+            self._scores = csv.writer(self._scores_file)
+            if new:
+                self._scores.writerow(SCORE_FIELDS)
+
+    def _write(self, name, jobs, row, fut):
+        bufs, encode_s = fut.result()
+        t0 = time.perf_counter()
+        for (target, _, kind), buf in zip(jobs, bufs):
+            if buf is None:
+                continue
+            if self.bundle:
+                self._db.execute("INSERT OR REPLACE INTO artifacts (name, kind, png) VALUES (?, ?, ?)",
+                                 (name, kind, buf.tobytes()))
+            else:
+                with open(target, "wb") as f:
+                    f.write(buf)
+            self.files += 1
+            self.bytes += buf.nbytes
+        if self.bundle:
+            self._db.execute(f"INSERT OR REPLACE INTO images VALUES ({', '.join('?' * len(row))})", row)
+        else:
+            self._scores.writerow(row)
+        self.busy += encode_s + time.perf_counter() - t0
+
+    def _run(self):
+        # Keeps taking items whatever fails, so submit() and close() never block on a dead writer
+        opened = False
+        try:
+            try:
+                self._open()
+                opened = True
+            except Exception as e:
+                self.error = e
+            while True:
+                item = self._q.get()
+                if item is None:
+                    break
+                if not opened:
+                    self.failed += 1
+                    continue
+                try:
+                    self._write(*item)
+                except Exception as e:
+                    self.failed += 1
+                    if self.error is None:
+                        self.error = e
+        finally:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+            if self._scores_file is not None:
+                self._scores_file.close()
+
+    def close(self):
+        """Wait for everything queued to be written."""
+        self._q.put(None)
+        self._thread.join()
+        self._pool.shutdown()
+
+    def report(self) -> str:
+        where = self.debug_dir / BUNDLE_NAME if self.bundle else self.debug_dir
+        failed = f", {self.failed} FAILED (first: {self.error})" if self.failed or self.error else ""
+        return (f"debug: kept {self.kept}/{self.submitted} images, {self.files} artifacts, "
+                f"{self.bytes / 1e6:.1f} MB, encode+write {self.busy:.2f}s{failed} -> {where}")
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of red circle detection results (SQLite).
+
+Results are keyed by (content hash, parameter fingerprint), so re-inserting
+the same USB stick only runs detection on new or changed files, and any change
+to the detector parameters misses the cache automatically.
+
+A second table remembers (path, size, mtime) -> hash, so unchanged files are
+not even re-read to hash them.
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+
+def params_fingerprint(params: dict) -> str:
+    """Stable short hash of a parameter dict (HSV bounds, Hough params, ...)."""
+    blob = json.dumps(params, sort_keys=True, default=str).encode()
+    return hashlib.md5(blob).hexdigest()
+
+
+class DetectionCache:
+    def __init__(self, db_path: Path, fingerprint: str, hash_fn, max_entries: int = 100000):
+        """
+        db_path: SQLite file (created if missing)
+        fingerprint: params_fingerprint() of the current detector settings
+        hash_fn: Path -> hex digest, used for files not seen before
+        max_entries: results kept before least-recently-used ones are evicted
+        """
+        self.db_path = Path(db_path)
+        self.fingerprint = fingerprint
+        self.hash_fn = hash_fn
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Opened by the main thread but may be used by one worker thread (--watch)
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                md5 TEXT NOT NULL,
+                params TEXT NOT NULL,
+                found INTEGER NOT NULL,
+                x REAL, y REAL, r REAL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (md5, params)
+            );
+            CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                md5 TEXT NOT NULL
+            );
+            """
+        )
+
+    def file_hash(self, p: Path) -> str:
+        st = p.stat()
+        key = str(p.resolve())
+        row = self.conn.execute("SELECT size, mtime_ns, md5 FROM files WHERE path = ?", (key,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+
+        digest = self.hash_fn(p)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, md5) VALUES (?, ?, ?, ?)",
+            (key, st.st_size, st.st_mtime_ns, digest),
+        )
+        return digest
+
+    def get(self, digest: str):
+        """Return (found, circle_or_None) for a cached result, or None on a miss."""
+        row = self.conn.execute(
+            "SELECT found, x, y, r FROM results WHERE md5 = ? AND params = ?",
+            (digest, self.fingerprint),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.conn.execute(
+            "UPDATE results SET last_used = ? WHERE md5 = ? AND params = ?",
+            (time.time(), digest, self.fingerprint),
+        )
+        found = bool(row[0])
+        circle = (row[1], row[2], row[3]) if found and row[1] is not None else None
+        return found, circle
+
+    def put(self, digest: str, found: bool, circle=None):
+        x, y, r = circle if circle is not None else (None, None, None)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO results (md5, params, found, x, y, r, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (digest, self.fingerprint, int(found), x, y, r, time.time()),
+        )
+
+    def evict(self) -> int:
+        """Drop least-recently-used results beyond max_entries. Returns rows removed."""
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM results").fetchone()
+        extra = count - self.max_entries
+        if extra <= 0:
+            return 0
+        self.conn.execute(
+            "DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY last_used LIMIT ?)",
+            (extra,),
+        )
+        self.conn.execute("DELETE FROM files WHERE md5 NOT IN (SELECT md5 FROM results)")
+        return extra
+
+    def clear(self):
+        self.conn.execute("DELETE FROM results")
+        self.conn.execute("DELETE FROM files")
+        self.conn.commit()
+
+    def flush(self):
+        """Evict and commit, for long-running users (--watch) that close() only at exit."""
+        self.evict()
+        self.conn.commit()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
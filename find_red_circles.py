@@ -1,13 +1,75 @@
 import shutil
 import argparse
 from pathlib import Path
-import subprocess 
 import hashlib
 import cv2
 import numpy as np
 import time
-import urllib.request
 import os
+import sys
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+import queue
+import select
+import threading
+
+from detection_cache import DetectionCache, params_fingerprint
+from tile_source import open_tile_source
+from debug_sink import DebugSink, debug_name
+from jpeg_budget import QR_LINK_BYTES_PER_S, CropEncoder, EncodeStats, encode_crops
+from inotify_watch import (IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_ISDIR, IN_MOVED_FROM, IN_MOVED_TO,
+                           IN_ONLYDIR, IN_Q_OVERFLOW, IN_UNMOUNT, Inotify)
+
+HOUGH_MIN_RADIUS = 3
+HOUGH_MAX_RADIUS = 30
+
+# (lower, upper) HSV bounds for the two red hue bands
+RED_HSV_RANGES = [
+    ((0,   80, 80), (10,  255,  255)),
+    ((170, 80, 80), (180, 255,  255)),
+]
+
+HOUGH_PARAMS = dict(
+    dp=1.2,
+    minDist=15,
+    param1=100,
+    param2=50,
+    minRadius=HOUGH_MIN_RADIUS,
+    maxRadius=HOUGH_MAX_RADIUS,
+)
+
+# Pyramid mode: don't bother below this long side, and give up on windows
+# (fall back to a full-frame pass) when there are too many red regions.
+PYRAMID_MIN_SIDE = 800
+PYRAMID_MAX_WINDOWS = 64
+
+# Pre-filter: the red mask is checked on a stride-2 subsample in 4x4 blocks
+# (8x8 full-res). A radius-3 ring with ring_ratio > 0.12 needs > 9 red pixels
+# within an 11x11 area, i.e. ~2 subsampled pixels inside one 3x3-block window.
+PREFILTER_STEP = 2
+PREFILTER_MIN_LOCAL = 2
+
+# Hough candidates are scored this many at a time: each one needs a few
+# (2*(r+t))^2 windows, so a noisy frame with hundreds of circles stays bounded.
+CANDIDATE_CHUNK = 32
+
+# Acceptance thresholds for the best candidate (see RedCircleDetector.detect)
+RING_RATIO_MIN = 0.12
+INNER_RATIO_MAX = 0.25
+SCORE_MIN = 0.02
+COVERAGE_MIN = 10
+DEBUG_THRESHOLDS = dict(ring_ratio=RING_RATIO_MIN, inner_ratio=INNER_RATIO_MAX, score=SCORE_MIN,
+                        coverage=COVERAGE_MIN)
+
+# Bump when detection code changes in a way the constants below don't capture,
+# so --cache results from the old code are not reused (see detector_fingerprint)
+DETECTOR_VERSION = 3
+
+# Tiled mode: neighbouring tiles overlap by a full ring (2 * maxRadius) plus
+# ring width and morph/blur support, so every ring lies whole inside some tile.
+TILE_SIZE = 2048
+TILE_OVERLAP = 2 * HOUGH_MAX_RADIUS + 32
 
 def crop_around_circle(img_bgr: np.ndarray, center_x: float, center_y: float, radius: float, #added by Tyler 
                        padding_scale: float = 0.45, min_padding_px: int = 8) -> np.ndarray:
@@ -36,44 +98,178 @@ def crop_around_circle(img_bgr: np.ndarray, center_x: float, center_y: float, ra
     return img_bgr[y1:y2, x1:x2]
 
 
-def has_red_circle(img_bgr, debug=False, return_circle=False):
+def _ring_width(r: float) -> float:
+    return max(2.0, r * 0.18)
+
+
+def _score_candidates(mask_raw: np.ndarray, xs, ys, rs):
     """
-    Detect small thin red circle outlines.
-    Tuned to pass correct_img*.png / incorrect_img*.png in the provided folder.
+    (ring_ratio, inner_ratio) arrays for the candidates (xs, ys, rs), scored
+    together on a stack of small windows around each centre (size ~2*(r+t)).
+    """
+    h, w = mask_raw.shape
+    ts = np.maximum(2.0, rs * 0.18)
+
+    # Common window size for the batch, big enough for the largest r + t
+    half = int(np.ceil((rs + ts).max())) + 1
+    size = 2 * half + 2
+    n = len(xs)
+
+    x0 = np.floor(xs).astype(np.int64) - half
+    y0 = np.floor(ys).astype(np.int64) - half
+
+    windows = np.zeros((n, size, size), dtype=np.uint8)
+    valid = np.zeros((n, size, size), dtype=bool)
+    for i in range(n):
+        wx1, wy1 = max(0, x0[i]), max(0, y0[i])
+        wx2, wy2 = min(w, x0[i] + size), min(h, y0[i] + size)
+        if wx2 <= wx1 or wy2 <= wy1:
+            continue
+        windows[i, wy1 - y0[i]:wy2 - y0[i], wx1 - x0[i]:wx2 - x0[i]] = mask_raw[wy1:wy2, wx1:wx2]
+        valid[i, wy1 - y0[i]:wy2 - y0[i], wx1 - x0[i]:wx2 - x0[i]] = True
 
-    Returns:
-      - if return_circle=False: (found_bool, overlay_or_None, mask_uint8)
-      - if return_circle=True : (found_bool, overlay_or_None, mask_uint8, circle_or_None)
-        where circle_or_None = (x, y, r) as floats.
+    offs = np.arange(size, dtype=np.int64)
+    px = (x0[:, None] + offs[None, :]) - xs[:, None]   # (n, size)
+    py = (y0[:, None] + offs[None, :]) - ys[:, None]   # (n, size)
+    dist2 = px[:, None, :] ** 2 + py[:, :, None] ** 2   # (n, size, size)
+
+    rr = rs[:, None, None]
+    tt = ts[:, None, None]
+    ring = (dist2 <= (rr + tt) ** 2) & (dist2 >= np.maximum(1.0, rr - tt) ** 2) & valid
+    inner_r = np.maximum(1.0, rr - 2.2 * tt)
+    inner = (dist2 <= inner_r ** 2) & valid
+
+    win = windows.astype(np.int64)
+    ring_cnt = ring.sum(axis=(1, 2))
+    inner_cnt = inner.sum(axis=(1, 2))
+    ring_sum = (win * ring).sum(axis=(1, 2))
+    inner_sum = (win * inner).sum(axis=(1, 2))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ring_ratio = np.where(ring_cnt > 0, (ring_sum / ring_cnt) / 255.0, 0.0)
+        inner_ratio = np.where(inner_cnt > 0, (inner_sum / inner_cnt) / 255.0, 1.0)
+    return ring_ratio, inner_ratio
+
+
+def _best_candidate(mask_raw: np.ndarray, circles: np.ndarray):
+    """
+    Score every Hough candidate against the raw red mask and return the best one.
+    Candidates are scored CANDIDATE_CHUNK at a time (_score_candidates), so
+    the window stacks stay small however many circles Hough returns.
+    Returns dict(score, x, y, r, ring_ratio, inner_ratio) or None.
     """
+    if circles is None or len(circles) == 0:
+        return None
+
+    xs = circles[:, 0].astype(np.float64)
+    ys = circles[:, 1].astype(np.float64)
+    rs = circles[:, 2].astype(np.float64)
 
-    hsv = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV)
+    ring_ratio = np.empty(len(circles))
+    inner_ratio = np.empty(len(circles))
+    for a in range(0, len(circles), CANDIDATE_CHUNK):
+        b = a + CANDIDATE_CHUNK
+        ring_ratio[a:b], inner_ratio[a:b] = _score_candidates(mask_raw, xs[a:b], ys[a:b], rs[a:b])
 
-    lower1 = np.array([0,   80, 80])
-    upper1 = np.array([10,  255,  255])
-    lower2 = np.array([170, 80, 80])
-    upper2 = np.array([180, 255,  255])
+    scores = (ring_ratio - inner_ratio) * ring_ratio
+    i = int(np.argmax(scores))
+
+    return {
+        "score": float(scores[i]),
+        "x": float(xs[i]),
+        "y": float(ys[i]),
+        "r": float(rs[i]),
+        "ring_ratio": float(ring_ratio[i]),
+        "inner_ratio": float(inner_ratio[i]),
+    }
+
+
+def _angular_coverage(mask_raw: np.ndarray, x: float, y: float, r: float, bins: int = 12) -> int:
+    """
+    Count how many of `bins` angular sectors contain red pixels on the ring
+    (r - t <= dist <= r + t). Only the window around the circle is searched.
+    Returns 0 when fewer than 12 ring pixels are found.
+    """
+    h, w = mask_raw.shape
+    t = _ring_width(r)
+    reach = int(np.ceil(r + t)) + 1
+
+    wx1 = max(0, int(np.floor(x)) - reach)
+    wy1 = max(0, int(np.floor(y)) - reach)
+    wx2 = min(w, int(np.floor(x)) + reach + 1)
+    wy2 = min(h, int(np.floor(y)) + reach + 1)
+    if wx2 <= wx1 or wy2 <= wy1:
+        return 0
+
+    ys_, xs_ = np.nonzero(mask_raw[wy1:wy2, wx1:wx2])
+    if ys_.size == 0:
+        return 0
+
+    dy = (ys_ + wy1) - y
+    dx = (xs_ + wx1) - x
+    dist = np.sqrt(dx * dx + dy * dy)
+
+    annulus = (dist >= r - t) & (dist <= r + t)
+    if int(annulus.sum()) < 12:
+        return 0
+
+    angles = (np.arctan2(dy[annulus], dx[annulus]) + 2 * np.pi) % (2 * np.pi)
+    bin_idx = np.floor(angles / (2 * np.pi) * bins).astype(int)
+    hist = np.bincount(bin_idx, minlength=bins)
+    return int((hist >= 1).sum())
+
+
+def _lap(stages: dict, name: str, t0: float) -> float:
+    """Add the time since t0 to stages[name] and return the new start time."""
+    now = time.perf_counter()
+    stages[name] = stages.get(name, 0.0) + (now - t0)
+    return now
+
+
+# Built once instead of on every call
+_RED_BOUNDS = [(np.array(lo), np.array(hi)) for lo, hi in RED_HSV_RANGES]
+_CLOSE_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
+
+
+def _red_mask(img_bgr: np.ndarray, stages=None, bufs=None) -> np.ndarray:
+    """
+    Raw red mask. bufs, if given, is a dict of preallocated arrays for this
+    frame size (see RedCircleDetector) that are written in place via dst=.
+    """
+    t = time.perf_counter() if stages is not None else 0.0
+    bufs = bufs or {}
+
+    hsv = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2HSV, dst=bufs.get("hsv"))
+    if stages is not None:
+        t = _lap(stages, "cvtColor", t)
+
+    (lower1, upper1), (lower2, upper2) = _RED_BOUNDS
 
     mask_raw = cv2.bitwise_or(
-        cv2.inRange(hsv, lower1, upper1),
-        cv2.inRange(hsv, lower2, upper2),
+        cv2.inRange(hsv, lower1, upper1, dst=bufs.get("band1")),
+        cv2.inRange(hsv, lower2, upper2, dst=bufs.get("band2")),
+        dst=bufs.get("mask_raw"),
     )
+    if stages is not None:
+        _lap(stages, "inRange", t)
+    return mask_raw
 
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
-    mask = cv2.morphologyEx(mask_raw, cv2.MORPH_CLOSE, kernel, iterations=1)
 
-    mask_blur = cv2.GaussianBlur(mask, (9, 9), 2)
+def _hough_candidates(mask_raw: np.ndarray, stages=None, bufs=None):
+    t = time.perf_counter() if stages is not None else 0.0
+    bufs = bufs or {}
 
-    circles = cv2.HoughCircles(
-        mask_blur,
-        cv2.HOUGH_GRADIENT,
-        dp=1.2,
-        minDist=15,
-        param1=100,
-        param2=50,
-        minRadius=3,
-        maxRadius=30,
-    )
+    mask = cv2.morphologyEx(mask_raw, cv2.MORPH_CLOSE, _CLOSE_KERNEL, iterations=1, dst=bufs.get("closed"))
+    if stages is not None:
+        t = _lap(stages, "morphologyEx", t)
+
+    mask_blur = cv2.GaussianBlur(mask, (9, 9), 2, dst=bufs.get("blur"))
+    if stages is not None:
+        t = _lap(stages, "GaussianBlur", t)
+
+    circles = cv2.HoughCircles(mask_blur, cv2.HOUGH_GRADIENT, **HOUGH_PARAMS)
+    if stages is not None:
+        _lap(stages, "HoughCircles", t)
 
     """if circles is None:
         circles = cv2.HoughCircles(
@@ -87,77 +283,276 @@ def has_red_circle(img_bgr, debug=False, return_circle=False):
             maxRadius=20,
         ) """
 
-    best = None
-    h, w = mask_raw.shape
-    yy, xx = np.ogrid[:h, :w]
+    if circles is None:
+        return None
+    return circles[0].astype(np.float32)
+
+
+def _coarse_red_mask(small_bgr: np.ndarray) -> np.ndarray:
+    """
+    Red mask for a downscaled image. Area averaging (resize or JPEG reduced
+    decode) washes thin red strokes out towards the background colour, so the
+    bounds are looser than the full-res ones.
+    """
+    hsv = cv2.cvtColor(small_bgr, cv2.COLOR_BGR2HSV)
+    return cv2.bitwise_or(
+        cv2.inRange(hsv, np.array([0, 40, 40]), np.array([12, 255, 255])),
+        cv2.inRange(hsv, np.array([168, 40, 40]), np.array([180, 255, 255])),
+    )
+
+
+def _prefilter_rejects(mask_raw: np.ndarray) -> bool:
+    """
+    Cheap early exit before morphology/Hough: True when the red mask is too
+    sparse anywhere to hold a ring of radius HOUGH_MIN_RADIUS..HOUGH_MAX_RADIUS.
+    """
+    sub = mask_raw[::PREFILTER_STEP, ::PREFILTER_STEP]
+    if np.count_nonzero(sub) < PREFILTER_MIN_LOCAL:
+        return True
 
-    if circles is not None:
-        circles = circles[0].astype(np.float32)
+    h, w = sub.shape
+    bh, bw = -(-h // 4), -(-w // 4)
+    padded = np.zeros((bh * 4, bw * 4), dtype=np.float32)
+    padded[:h, :w] = sub > 0
+    blocks = padded.reshape(bh, 4, bw, 4).sum(axis=(1, 3))
+    local = cv2.boxFilter(blocks, -1, (3, 3), normalize=False, borderType=cv2.BORDER_CONSTANT)
+    return float(local.max()) < PREFILTER_MIN_LOCAL
 
-        for (x, y, r) in circles:
-            r = float(r)
-            dist2 = (xx - x) ** 2 + (yy - y) ** 2
 
-            t = max(2.0, r * 0.18)
-            ring = (dist2 <= (r + t) ** 2) & (dist2 >= max(1.0, (r - t)) ** 2)
+def _screen_rejects(small_bgr: np.ndarray, scale: int) -> bool:
+    """
+    _prefilter_rejects() for an image decoded at 1/scale (read_image): True
+    when no area holds enough red for a ring. The full-res test needs
+    PREFILTER_MIN_LOCAL stride-PREFILTER_STEP pixels, i.e. about
+    PREFILTER_MIN_LOCAL * PREFILTER_STEP**2 red pixels, inside a 3x3-block
+    window; window and count shrink with the scale (count at least 1). The
+    detector's own bounds are used, not _coarse_red_mask(): the loose ones
+    pass most skin and brown tones, so nearly nothing would be screened out.
+    """
+    mask = _red_mask(small_bgr)
+    window = max(3, 3 * 4 * PREFILTER_STEP // scale)
+    need = max(1.0, PREFILTER_MIN_LOCAL * PREFILTER_STEP ** 2 / scale ** 2)
+    if cv2.countNonZero(mask) < need:
+        return True
+    local = cv2.boxFilter(mask, cv2.CV_32F, (window, window), normalize=False, borderType=cv2.BORDER_CONSTANT)
+    return float(local.max()) / 255 < need
 
-            inner_r = max(1.0, r - 2.2 * t)
-            inner = dist2 <= inner_r ** 2
 
-            ring_ratio = (mask_raw[ring].mean() / 255.0) if np.any(ring) else 0.0
-            inner_ratio = (mask_raw[inner].mean() / 255.0) if np.any(inner) else 1.0
+def _pyramid_factor(height: int, width: int, min_side: int = PYRAMID_MIN_SIDE) -> int:
+    """
+    Pick the coarse-level downscale factor (power of two).
+    Never shrink the long side below min_side, and never by more than
+    2 * HOUGH_MIN_RADIUS so a minRadius ring still spans a couple of coarse pixels.
+    """
+    factor = 1
+    while (factor * 2 <= 2 * HOUGH_MIN_RADIUS
+           and max(height, width) // (factor * 2) >= min_side):
+        factor *= 2
+    return factor
 
-            score = (ring_ratio - inner_ratio) * ring_ratio
 
-            if best is None or score > best["score"]:
-                best = {
-                    "score": float(score),
-                    "x": float(x),
-                    "y": float(y),
-                    "r": float(r),
-                    "ring_ratio": float(ring_ratio),
-                    "inner_ratio": float(inner_ratio),
-                }
+def _pyramid_windows(img_bgr: np.ndarray, factor: int):
+    """
+    Find red regions on a 1/factor image and return full-res windows (x1, y1, x2, y2)
+    big enough to hold any ring touching them plus the morph/blur support.
+    Returns None when the red area is too spread out for windows to pay off.
+    """
+    h, w = img_bgr.shape[:2]
+    small = cv2.resize(img_bgr, (max(1, w // factor), max(1, h // factor)), interpolation=cv2.INTER_AREA)
+    coarse = _coarse_red_mask(small)
+
+    # Grow every red region by the window margin first, so nearby regions merge
+    # into one window instead of many overlapping ones.
+    margin = 2 * HOUGH_MAX_RADIUS + 16
+    grow = 2 * (-(-margin // factor)) + 1
+    coarse = cv2.dilate(coarse, cv2.getStructuringElement(cv2.MORPH_RECT, (grow, grow)))
+
+    n, _, stats, _ = cv2.connectedComponentsWithStats(coarse, connectivity=8)
+    if n <= 1:
+        return []
+    if n - 1 > PYRAMID_MAX_WINDOWS:
+        return None
+
+    ch, cw = coarse.shape
+    windows = []
+    area = 0
+    for i in range(1, n):
+        x, y, bw, bh = (int(v) for v in stats[i, :4])
+        x1, y1 = x * factor, y * factor
+        # Regions touching the coarse border run to the real image border
+        x2 = w if x + bw >= cw else min(w, (x + bw) * factor)
+        y2 = h if y + bh >= ch else min(h, (y + bh) * factor)
+        windows.append((x1, y1, x2, y2))
+        area += (x2 - x1) * (y2 - y1)
+
+    if area > 0.5 * h * w:
+        return None
+    return windows
+
+
+def _score(mask_raw: np.ndarray, circles, stages=None):
+    """_best_candidate() with optional timing and candidate counting."""
+    if stages is None:
+        return _best_candidate(mask_raw, circles) if circles is not None else None
+
+    t = time.perf_counter()
+    stages["candidates"] = stages.get("candidates", 0) + (0 if circles is None else len(circles))
+    best = _best_candidate(mask_raw, circles) if circles is not None else None
+    _lap(stages, "scoring", t)
+    return best
+
+
+def _detect_pyramid(img_bgr: np.ndarray, stages=None):
+    """
+    Coarse-to-fine detection: propose regions on a downscaled image, then run the
+    usual mask/Hough/scoring at full resolution inside each window.
+    Returns (best_or_None, mask_raw, prefiltered) with best in full-resolution
+    coordinates; mask_raw is only filled in inside the searched windows.
+    prefiltered is True when no region survived the coarse/pre-filter stage.
+    """
+    h, w = img_bgr.shape[:2]
+    factor = _pyramid_factor(h, w)
+    t = time.perf_counter() if stages is not None else 0.0
+    windows = _pyramid_windows(img_bgr, factor) if factor > 1 else None
+    if stages is not None:
+        _lap(stages, "pyramid", t)
+
+    if windows is None:
+        mask_raw = _red_mask(img_bgr, stages)
+        t = time.perf_counter() if stages is not None else 0.0
+        rejected = _prefilter_rejects(mask_raw)
+        if stages is not None:
+            _lap(stages, "prefilter", t)
+        if rejected:
+            return None, mask_raw, True
+        circles = _hough_candidates(mask_raw, stages)
+        return _score(mask_raw, circles, stages), mask_raw, False
+
+    mask_raw = np.zeros((h, w), dtype=np.uint8)
+    best = None
+    for (x1, y1, x2, y2) in windows:
+        win_mask = _red_mask(img_bgr[y1:y2, x1:x2], stages)
+        mask_raw[y1:y2, x1:x2] = win_mask
 
-    def _ret(found: bool, overlay_img, mask_img, circle):
-        if return_circle:
-            return found, overlay_img, mask_img, circle
-        return found, overlay_img, mask_img
+        circles = _hough_candidates(win_mask, stages)
+        if circles is None:
+            continue
+        cand = _score(win_mask, circles, stages)
+        if best is None or cand["score"] > best["score"]:
+            cand["x"] += x1
+            cand["y"] += y1
+            best = cand
 
-    if best is None or best["ring_ratio"] <= 0.12 or best["inner_ratio"] >= 0.25 or best["score"] <= 0.02:
-        return _ret(False, None, mask_raw, None)
+    return best, mask_raw, not windows
 
-    coords = np.column_stack(np.nonzero(mask_raw > 0))
-    if coords.size == 0:
-        return _ret(False, None, mask_raw, None)
 
-    dy = coords[:, 0] - best["y"]
-    dx = coords[:, 1] - best["x"]
-    dist = np.sqrt(dx * dx + dy * dy)
+class Detection:
+    """Result of RedCircleDetector.detect()."""
 
-    t = max(2.0, best["r"] * 0.18)
-    annulus = (dist >= best["r"] - t) & (dist <= best["r"] + t)
-    ann_coords = coords[annulus]
-    if ann_coords.shape[0] < 12:
-        return _ret(False, None, mask_raw, None)
+    __slots__ = ("found", "circle", "score", "ring_ratio", "inner_ratio", "coverage",
+                 "prefilter", "mask", "overlay")
 
-    dy_a = ann_coords[:, 0] - best["y"]
-    dx_a = ann_coords[:, 1] - best["x"]
-    angles = (np.arctan2(dy_a, dx_a) + 2 * np.pi) % (2 * np.pi)
+    def __init__(self, found=False, circle=None, score=None, ring_ratio=None, inner_ratio=None,
+                 coverage=None, prefilter=False, mask=None, overlay=None):
+        self.found = found
+        self.circle = circle            # (x, y, r) floats when found
+        self.score = score              # best candidate's values (None if no candidate)
+        self.ring_ratio = ring_ratio
+        self.inner_ratio = inner_ratio
+        self.coverage = coverage        # filled angular bins out of 12 (None if not reached)
+        self.prefilter = prefilter      # rejected by the red-pixel pre-filter
+        self.mask = mask                # raw red mask (may be a reused buffer, see detect())
+        self.overlay = overlay          # debug drawing, only when debug=True and found
 
-    bins = 12
-    bin_idx = np.floor(angles / (2 * np.pi) * bins).astype(int)
-    hist = np.bincount(bin_idx, minlength=bins)
+    def __repr__(self):
+        return (f"Detection(found={self.found}, circle={self.circle}, score={self.score}, "
+                f"ring_ratio={self.ring_ratio}, inner_ratio={self.inner_ratio}, coverage={self.coverage})")
 
-    coverage = int((hist >= 1).sum())
-    if coverage < 10:
-        return _ret(False, None, mask_raw, None)
 
-    circle = (best["x"], best["y"], best["r"])
+class RedCircleDetector:
+    """
+    Reusable red circle detector.
+    HSV bounds and the morphology kernel are built once at import, and the
+    per-frame hsv / band / mask / closed / blur arrays are allocated once per
+    frame size and then filled in place (OpenCV dst=) for every same-sized frame.
 
-    if not debug:
-        return _ret(True, None, mask_raw, circle)
+    Not thread-safe: use one detector per thread.
+    """
 
+    def __init__(self, pyramid: bool = False, debug: bool = False):
+        self.pyramid = pyramid
+        self.debug = debug
+        self._shape = None
+        self._bufs = None
+
+    def _buffers(self, img_bgr: np.ndarray) -> dict:
+        h, w = img_bgr.shape[:2]
+        if self._shape != (h, w):
+            self._shape = (h, w)
+            self._bufs = {
+                "hsv": np.empty((h, w, 3), dtype=np.uint8),
+                "band1": np.empty((h, w), dtype=np.uint8),
+                "band2": np.empty((h, w), dtype=np.uint8),
+                "mask_raw": np.empty((h, w), dtype=np.uint8),
+                "closed": np.empty((h, w), dtype=np.uint8),
+                "blur": np.empty((h, w), dtype=np.uint8),
+            }
+        return self._bufs
+
+    def detect(self, img_bgr: np.ndarray, stages=None) -> Detection:
+        """
+        Detect one frame. The returned mask is this detector's buffer and is
+        overwritten by the next detect() on a same-sized frame; copy it if it
+        has to outlive that. stages: optional dict for per-stage timings.
+        """
+        rejected = False
+        if self.pyramid:
+            best, mask_raw, rejected = _detect_pyramid(img_bgr, stages)
+        else:
+            bufs = self._buffers(img_bgr)
+            mask_raw = _red_mask(img_bgr, stages, bufs)
+            t = time.perf_counter() if stages is not None else 0.0
+            rejected = _prefilter_rejects(mask_raw)
+            if stages is not None:
+                _lap(stages, "prefilter", t)
+            circles = None if rejected else _hough_candidates(mask_raw, stages, bufs)
+            best = _score(mask_raw, circles, stages)
+
+        res = Detection(prefilter=rejected, mask=mask_raw)
+        if best is None:
+            return res
+        res.score = best["score"]
+        res.ring_ratio = best["ring_ratio"]
+        res.inner_ratio = best["inner_ratio"]
+
+        if (best["ring_ratio"] <= RING_RATIO_MIN or best["inner_ratio"] >= INNER_RATIO_MAX
+                or best["score"] <= SCORE_MIN):
+            return res
+
+        t = time.perf_counter() if stages is not None else 0.0
+        coverage = _angular_coverage(mask_raw, best["x"], best["y"], best["r"])
+        if stages is not None:
+            _lap(stages, "coverage", t)
+        res.coverage = coverage
+        if coverage < COVERAGE_MIN:
+            return res
+
+        res.found = True
+        res.circle = (best["x"], best["y"], best["r"])
+
+        if self.debug:
+            res.overlay = _draw_overlay(img_bgr, best, coverage)
+        return res
+
+    def detect_many(self, images):
+        """Yield a Detection for each image of an iterable (masks are copied, so results can be kept)."""
+        for img_bgr in images:
+            res = self.detect(img_bgr)
+            res.mask = res.mask.copy()
+            yield res
+
+
+def _draw_overlay(img_bgr: np.ndarray, best: dict, coverage: int) -> np.ndarray:
     overlay = img_bgr.copy()
     x, y, r = int(best["x"]), int(best["y"]), int(best["r"])
     cv2.circle(overlay, (x, y), r, (0, 255, 0), 2)
@@ -172,23 +567,101 @@ def has_red_circle(img_bgr, debug=False, return_circle=False):
         2,
         cv2.LINE_AA,
     )
-    return _ret(True, overlay, mask_raw, circle)
-
-def encrypt_file_openssl(in_path: Path, out_path: Path, key_path: Path):
-    key_hex = key_path.read_bytes().hex()
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    subprocess.run(
-        [
-            "openssl", "enc", "-aes-256-cbc",
-            "-K", key_hex,
-            "-iv", "00000000000000000000000000000000",
-            "-in", str(in_path),
-            "-out", str(out_path),
-        ],
-        check=True,
-    )
-    
-    
+    return overlay
+
+
+_thread_state = threading.local()
+
+
+def get_detector(pyramid: bool = False, debug: bool = False) -> RedCircleDetector:
+    """The calling thread's detector for these settings (buffers are reused across calls)."""
+    cache = getattr(_thread_state, "detectors", None)
+    if cache is None:
+        cache = _thread_state.detectors = {}
+    key = (pyramid, debug)
+    if key not in cache:
+        cache[key] = RedCircleDetector(pyramid=pyramid, debug=debug)
+    return cache[key]
+
+
+def has_red_circle(img_bgr, debug=False, return_circle=False, pyramid=False, info=None):
+    """
+    Detect small thin red circle outlines.
+    Tuned to pass correct_img*.png / incorrect_img*.png in the provided folder.
+    Thin wrapper around RedCircleDetector.detect() for existing callers.
+
+    pyramid=True finds candidate regions on a downscaled copy first and only runs
+    the full-resolution detector inside those windows (for large frames).
+    If info is a dict, info["prefilter"] is set to True when the image was
+    rejected by the red-pixel pre-filter before morphology/Hough. If info also
+    holds a "stages" dict, wall time per stage (and the Hough candidate count)
+    is accumulated into it; without it nothing is timed.
+
+    Returns:
+      - if return_circle=False: (found_bool, overlay_or_None, mask_uint8)
+      - if return_circle=True : (found_bool, overlay_or_None, mask_uint8, circle_or_None)
+        where circle_or_None = (x, y, r) as floats.
+    """
+    stages = info.get("stages") if info is not None else None
+    res = get_detector(pyramid, debug).detect(img_bgr, stages)
+    if info is not None:
+        info["prefilter"] = res.prefilter
+
+    # Callers may keep the mask around, so hand out a copy of the reused buffer
+    mask = res.mask.copy()
+    if return_circle:
+        return res.found, res.overlay, mask, res.circle
+    return res.found, res.overlay, mask
+
+def _tile_starts(length: int, tile: int, overlap: int):
+    """Tile offsets along one axis; the last tile is pulled back to end at the border."""
+    if length <= tile:
+        return [0]
+    step = tile - overlap
+    starts = list(range(0, length - tile, step))
+    starts.append(length - tile)
+    return starts
+
+
+def detect_tiled(source, tile_size: int = TILE_SIZE, stages=None):
+    """
+    Detect on a large image one overlapping tile at a time.
+    source is anything with .shape and 2-D slicing (a numpy image or a
+    tile_source reader), so only one tile of pixels is held at once when the
+    source is memory-mapped. All tiles have the same size, so the detector's
+    buffers are reused.
+    Returns found Detections in full-image coordinates, best score first, with
+    duplicates from overlapping tiles merged. Their masks are not kept.
+    """
+    h, w = source.shape[:2]
+    tile_size = max(tile_size, 2 * TILE_OVERLAP)
+    det = RedCircleDetector()
+
+    found = []
+    for y in _tile_starts(h, tile_size, TILE_OVERLAP):
+        for x in _tile_starts(w, tile_size, TILE_OVERLAP):
+            t = time.perf_counter() if stages is not None else 0.0
+            tile = source[y:min(h, y + tile_size), x:min(w, x + tile_size)]
+            if stages is not None:
+                _lap(stages, "imread", t)
+
+            res = det.detect(tile, stages)
+            res.mask = None
+            if res.found:
+                cx, cy, r = res.circle
+                res.circle = (cx + x, cy + y, r)
+                found.append(res)
+
+    # A ring near a seam is seen by several tiles: keep the best-scoring one
+    found.sort(key=lambda d: d.score, reverse=True)
+    merged = []
+    for d in found:
+        cx, cy, r = d.circle
+        if all((cx - m.circle[0]) ** 2 + (cy - m.circle[1]) ** 2 > max(r, m.circle[2]) ** 2 for m in merged):
+            merged.append(d)
+    return merged
+
+
 def md5_file(file_path: Path) -> str: #added by Tyler
     md5 = hashlib.md5()
     with open(file_path, "rb") as f:
@@ -196,170 +669,1330 @@ def md5_file(file_path: Path) -> str: #added by Tyler
             md5.update(chunk)
     return md5.hexdigest()
 
-def start_qrs_server_and_open_chromium(): #added by Tyler
-    qrs_dir = Path.home() / "qrs"
-    
-
-    # Start server in background
-    env = os.environ.copy()
-    env["QRS_DEFAULT_FILE_PATH"] = "/home/user/group-9-team-project-main/red-circle-finder/matched_encrypted.zip"
-    
-    server_proc = subprocess.Popen(
-        ["node", ".output/server/index.mjs"],
-        cwd=str(qrs_dir),
-        env=env,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-        start_new_session=True,   # keeps it alive if script exits
-    )
 
-    # Wait until server responds (or time out)
-    server_url = "http://localhost:3000" 
-    deadline = time.time() + 5.0
-    while time.time() < deadline:
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".ppm"}
+REDUCED_DECODE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+JPEG_EXTS = {".jpg", ".jpeg"}
+
+
+def walk_images(root: Path, recursive: bool = False):
+    """
+    Yield (path, size) for every image under root, in sorted order per folder.
+    Uses os.scandir so file type and size come from the directory listing
+    instead of a stat() per file. Files are read in place, nothing is copied.
+    """
+    stack = [str(root)]
+    while stack:
+        top = stack.pop()
         try:
-            with urllib.request.urlopen(server_url, timeout=0.5) as resp:
-                if 200 <= resp.status < 500:
-                    break
-        except Exception:
-            time.sleep(0.25)
-
-    # Open Chromium maximized
-    subprocess.Popen(
-        ["chromium", "--start-maximized", server_url],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-        start_new_session=True,
-    )
+            with os.scandir(top) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            print(f"ERROR {top}: {e}")
+            continue
 
-    return server_proc
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        subdirs.append(entry.path)
+                elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTS:
+                    yield Path(entry.path), entry.stat().st_size
+            except OSError:
+                continue
+        # Depth-first, folders in name order
+        stack.extend(reversed(subdirs))
+
+
+def dedup_files(entries, hash_fn=None):
+    """
+    Split (path, size) entries into unique files and duplicates.
+    Only files that share a size with another file are hashed (hash_fn,
+    md5_file by default), so a tree without duplicates costs no extra reads.
+    Returns (unique_paths, {duplicate_path: first_path_with_same_content}).
+    """
+    if hash_fn is None:
+        hash_fn = md5_file
+    by_size = {}
+    for p, size in entries:
+        by_size.setdefault(size, []).append(p)
+
+    duplicates = {}
+    for paths in by_size.values():
+        if len(paths) < 2:
+            continue
+        first = {}
+        for p in paths:
+            try:
+                digest = hash_fn(p)
+            except OSError:
+                continue
+            if digest in first:
+                duplicates[p] = first[digest]
+            else:
+                first[digest] = p
 
+    unique = [p for paths in by_size.values() for p in paths if p not in duplicates]
+    order = {p: i for i, (p, _) in enumerate(entries)}
+    unique.sort(key=order.__getitem__)
+    return unique, duplicates
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--in_dir", required=True, help="Folder with input images")
-    ap.add_argument("--out_dir", required=True, help="Folder to write matched (cropped) images into")
-    ap.add_argument("--debug_dir", default=None, help="Optional folder to save debug overlays/masks")
-    ap.add_argument("--crop", action="store_true", help="If set, save cropped match instead of full image")
-    ap.add_argument("--pad_scale", type=float, default=0.45, help="Crop padding as a fraction of radius")
-    ap.add_argument("--min_pad", type=int, default=8, help="Minimum crop padding in pixels")
-    args = ap.parse_args()
 
-    in_dir = Path(args.in_dir)
-    out_dir = Path(args.out_dir)
-    out_dir.mkdir(parents=True, exist_ok=True)
+def read_image(p: Path, decode_scale: int = 1):
+    """
+    Decode an image for detection.
+    With decode_scale 2/4/8, JPEGs are first decoded at that reduction (libjpeg
+    DCT scaling: the IDCT and colour work shrink, the entropy decoding does
+    not) and screened for red (_screen_rejects); only images that pass are
+    decoded again at full resolution. That only pays when most inputs are
+    screened out: bench_decode.py prints the share needed.
+    Returns (img_or_None, screened). When screened is True, img is the reduced
+    image and there is nothing to detect.
+    """
+    if decode_scale > 1 and p.suffix.lower() in JPEG_EXTS:
+        small = cv2.imread(str(p), REDUCED_DECODE_FLAGS[decode_scale])
+        if small is None:
+            return None, False
+        if _screen_rejects(small, decode_scale):
+            return small, True
 
-    debug_dir = Path(args.debug_dir) if args.debug_dir else None
-    if debug_dir:
-        debug_dir.mkdir(parents=True, exist_ok=True)
+    return cv2.imread(str(p)), False
 
-    exts = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
-    files = [p for p in in_dir.iterdir() if p.suffix.lower() in exts]
 
-    matches = 0
-    for p in files:
+def screened_outputs(p: Path, small, debug_dir, debug_sample=None, in_root=None):
+    """
+    Debug files for an image rejected at reduced resolution (nothing else is written).
+    With debug_sample (a DebugSampler), nothing is made for images it does not keep.
+    """
+    if not debug_dir or (debug_sample is not None and not debug_sample.want(p, "screened", {})):
+        return []
+    return [
+        ("debug", debug_path(debug_dir, p, in_root, "mask"), _red_mask(small), "mask"),
+        ("debug", debug_path(debug_dir, p, in_root, "overlay"), small, "overlay"),
+    ]
+
+
+def output_path(out_dir: Path, p: Path, in_root=None, suffix=None) -> Path:
+    """
+    Where the output for input image p goes: out_dir / p's path relative to
+    in_root, so --recursive scans mirror their subfolders and a/x.png and
+    b/x.png do not overwrite each other (out_dir / p.name without in_root).
+    suffix replaces the extension. Creates the subfolder if needed.
+    """
+    rel = Path(p.name) if in_root is None else Path(p).relative_to(in_root)
+    if suffix is not None:
+        rel = rel.with_suffix(suffix)
+    target = out_dir / rel
+    if rel.parent != Path("."):
+        target.parent.mkdir(parents=True, exist_ok=True)
+    return target
+
+
+def debug_path(debug_dir: Path, p: Path, in_root, kind: str) -> Path:
+    """debug_dir / <debug_name>_<kind>.png: like output_path(), subfolders of in_root are mirrored."""
+    target = debug_dir / f"{debug_name(p, in_root)}_{kind}.png"
+    if target.parent != debug_dir:
+        target.parent.mkdir(parents=True, exist_ok=True)
+    return target
+
+
+def cached_outputs(p: Path, circle, out_dir: Path, crop: bool, pad_scale: float, min_pad: int, in_root=None):
+    """Match outputs for a cache hit: same files detect_image() would write, without detection."""
+    if crop and circle is not None:
         img = cv2.imread(str(p))
         if img is None:
-            continue
+            return []
+        cx, cy, r = circle
+        cropped = crop_around_circle(img, cx, cy, r, pad_scale, min_pad)
+        return [("crop", output_path(out_dir, p, in_root, ".jpg"), cropped, [cv2.IMWRITE_JPEG_QUALITY, 95])]
+    return [("copy", output_path(out_dir, p, in_root), p, None)]
+
+
+def detector_fingerprint(pad_scale: float, min_pad: int, pyramid: bool, decode_scale: int,
+                         tile_size: int = 0) -> str:
+    """Everything that can change a detection result (or its crop) for the result cache."""
+    return params_fingerprint(dict(
+        version=DETECTOR_VERSION,
+        red_hsv=RED_HSV_RANGES,
+        hough=HOUGH_PARAMS,
+        prefilter=(PREFILTER_STEP, PREFILTER_MIN_LOCAL),
+        thresholds=(RING_RATIO_MIN, INNER_RATIO_MAX, SCORE_MIN, COVERAGE_MIN),
+        pyramid_limits=(PYRAMID_MIN_SIDE, PYRAMID_MAX_WINDOWS),
+        tile_overlap=TILE_OVERLAP if tile_size else 0,
+        pad_scale=pad_scale,
+        min_pad=min_pad,
+        pyramid=pyramid,
+        decode_scale=decode_scale,
+        tile_size=tile_size,
+    ))
+
+
+def detect_image(p: Path, img, out_dir: Path, debug_dir, crop: bool, pad_scale: float, min_pad: int,
+                 pyramid: bool = False, info=None, debug_sample=None, in_root=None):
+    """
+    Run detection on an already decoded image and work out what has to be written.
+    Returns (status, writes): status is "match", "no match" or "prefilter"
+    (rejected by the red-pixel pre-filter), writes is a list of jobs for write_outputs().
+    info gets "prefilter", "circle" and the best candidate's score, ring_ratio,
+    inner_ratio and coverage, and stage timings if it has a "stages" dict.
+    With debug_sample (a DebugSampler), debug jobs are only made for images it keeps.
+    Outputs are named by output_path(out_dir, p, in_root).
+    """
+    if info is None:
+        info = {}
+    res = get_detector(pyramid, bool(debug_dir)).detect(img, info.get("stages"))
+    ok, overlay, circle = res.found, res.overlay, res.circle
+    info["prefilter"] = res.prefilter
+    info["circle"] = circle
+    info["score"] = res.score
+    info["ring_ratio"] = res.ring_ratio
+    info["inner_ratio"] = res.inner_ratio
+    info["coverage"] = res.coverage
+    if ok:
+        status = "match"
+    else:
+        status = "prefilter" if info.get("prefilter") else "no match"
+    if debug_dir and debug_sample is not None and not debug_sample.want(p, status, info):
+        debug_dir = None
+    # The detector reuses its mask buffer, and debug writes may happen later
+    mask = res.mask.copy() if debug_dir else None
+    writes = []
+
+    if ok:
+        if crop and circle is not None:
+            cx, cy, r = circle
+            cropped = crop_around_circle(
+                img,
+                center_x=cx,
+                center_y=cy,
+                radius=r,
+                padding_scale=pad_scale,
+                min_padding_px=min_pad,
+            )
+            # Write cropped image and change to jpeg
+            out_path = output_path(out_dir, p, in_root, ".jpg")
+            writes.append(("crop", out_path, cropped, [cv2.IMWRITE_JPEG_QUALITY, 95]))
+        else:
+            # copy full image
+            writes.append(("copy", output_path(out_dir, p, in_root), p, None))
 
-        ok, overlay, mask, circle = has_red_circle(img, debug=bool(debug_dir), return_circle=True)
+    if debug_dir:
+        writes.append(("debug", debug_path(debug_dir, p, in_root, "mask"), mask, "mask"))
 
-        if ok:
-            matches += 1
+        if overlay is None:
+            # Nothing drawn: the image itself (it is not modified, so no copy)
+            overlay = img
 
-            if args.crop and circle is not None:
-                cx, cy, r = circle
-                cropped = crop_around_circle(
-                    img,
-                    center_x=cx,
-                    center_y=cy,
-                    radius=r,
-                    padding_scale=args.pad_scale,
-                    min_padding_px=args.min_pad,
-                )
-                # Write cropped image and change to jpeg
-                jpeg_name = p.stem + ".jpg"
-                out_path = out_dir / jpeg_name
-                cv2.imwrite(str(out_path), cropped, [cv2.IMWRITE_JPEG_QUALITY, 95])
-            else:
-                # copy full image
-                shutil.copy2(p, out_dir / p.name)
+        # If cropping is enabled, also save a debug crop preview
+        if crop and ok and circle is not None:
+            cx, cy, r = circle
+            crop_preview = crop_around_circle(img, cx, cy, r, pad_scale, min_pad)
+            writes.append(("debug", debug_path(debug_dir, p, in_root, "crop"), crop_preview, "crop"))
 
-        if debug_dir:
-            base = p.stem
-            cv2.imwrite(str(debug_dir / f"{base}_mask.png"), mask)
+        writes.append(("debug", debug_path(debug_dir, p, in_root, "overlay"), overlay, "overlay"))
 
-            if overlay is None:
-                overlay = img.copy()
+    return status, writes
 
-            # If cropping is enabled, also save a debug crop preview
-            if args.crop and ok and circle is not None:
-                cx, cy, r = circle
-                crop_preview = crop_around_circle(img, cx, cy, r, args.pad_scale, args.min_pad)
-                cv2.imwrite(str(debug_dir / f"{base}_crop.png"), crop_preview)
 
-            cv2.imwrite(str(debug_dir / f"{base}_overlay.png"), overlay)
-            
+def write_outputs(writes):
+    """
+    Perform the (kind, target, payload, params) jobs produced by detect_image().
+    Each file is MD5-hashed while it is written (encoded bytes for images,
+    streamed chunks for copies), so the manifest never has to read it back.
+    Returns [(target, size, md5_hex)] for the files written.
+    """
+    records = []
+    for kind, target, payload, params in writes:
+        h = hashlib.md5()
+        size = 0
+        if kind == "copy":
+            with open(payload, "rb") as src, open(target, "wb") as dst:
+                for block in iter(lambda: src.read(1 << 20), b""):
+                    h.update(block)
+                    dst.write(block)
+                    size += len(block)
+            shutil.copystat(payload, target)
+        else:
+            # Debug jobs carry their artifact kind in the params slot
+            ok, buf = cv2.imencode(Path(target).suffix, payload, params if kind != "debug" and params else [])
+            if not ok:
+                continue
+            h.update(buf)
+            size = buf.nbytes
+            with open(target, "wb") as dst:
+                dst.write(buf)
+        records.append((target, size, h.hexdigest()))
+    return records
+
+
+def record_outputs(written: dict, out_dir: Path, records):
+    """Add write_outputs() records under out_dir to written (relative path -> (size, md5))."""
+    for target, size, digest in records:
+        try:
+            rel = Path(target).relative_to(out_dir).as_posix()
+        except ValueError:
+            continue  # debug files live outside out_dir
+        written[rel] = (size, digest)
 
-    print(f"Scanned {len(files)} images. Found {matches} matches. Output -> {out_dir}")
-    
-    # Always encrypt the zip (predetermined key)
-    key_file = Path("qr_shared.key")  # adjust if needed
-    if not key_file.exists():
-        raise FileNotFoundError(f"Key file not found: {key_file}")
-        
-    # Create MD5 of the matched FOLDER contents (pre-zip, single hash)
-    manifest_lines = []
-    for p in sorted(out_dir.rglob("*")):
-        if p.is_file() and p.name not in {"matched.manifest", "matched.manifest.md5"}:
-            rel = p.relative_to(out_dir).as_posix()
-            size = p.stat().st_size
-            manifest_lines.append(f"{rel}\t{size}")
-
-    manifest_path = out_dir / "matched.manifest"
-    manifest_path.write_text("\n".join(manifest_lines) + "\n")
-    manifest_md5 = hashlib.md5(manifest_path.read_bytes()).hexdigest()
-    (out_dir / "matched.manifest.md5").write_text(f"{manifest_md5}  matched.manifest\n")
-    
-    
-# ENCRYPT THE FOLDER CONTENTS FIRST (creates an encrypted copy folder)
-    encrypted_dir = out_dir.parent / (out_dir.name + "_encrypted")
-    if encrypted_dir.exists():
-        shutil.rmtree(encrypted_dir)
-    encrypted_dir.mkdir(parents=True, exist_ok=True)
-
-    for p in sorted(out_dir.rglob("*")):
-        if p.is_dir():
+
+def _new_info(profile: bool) -> dict:
+    return {"stages": {}} if profile else {}
+
+
+def _note_shape(info: dict, img):
+    if "stages" in info and img is not None:
+        info["height"], info["width"] = img.shape[:2]
+
+
+def scan_tiled(p: Path, out_dir: Path, crop: bool, pad_scale: float, min_pad: int, tile_size: int, info: dict,
+               in_root=None):
+    """
+    Tiled counterpart of read + detect for one (large) image. Returns (status, writes).
+    The crop is cut straight from the tile source, so the full frame is never loaded.
+    """
+    source = open_tile_source(p)
+    if source is None:
+        return "unreadable", []
+    try:
+        if "stages" in info:
+            info["height"], info["width"] = source.shape[:2]
+        hits = detect_tiled(source, tile_size, info.get("stages"))
+        if not hits:
+            return "no match", []
+
+        circle = hits[0].circle
+        info["circle"] = circle
+        if crop:
+            cropped = crop_around_circle(source, *circle, pad_scale, min_pad)
+            if not isinstance(cropped, np.ndarray):
+                # crop_around_circle fell back to the whole image
+                h, w = source.shape[:2]
+                cropped = source[0:h, 0:w]
+            target = output_path(out_dir, p, in_root, ".jpg")
+            writes = [("crop", target, cropped, [cv2.IMWRITE_JPEG_QUALITY, 95])]
+        else:
+            writes = [("copy", output_path(out_dir, p, in_root), p, None)]
+        return "match", writes
+    finally:
+        source.close()
+
+
+def defer_crop_writes(writes, info: dict):
+    """
+    Move the match-crop jobs out of writes into info["crops"] as (target, img),
+    for the budgeted encoder stage (see jpeg_budget.encode_crops). Returns the rest.
+    The crops are copied: crop_around_circle returns a view, and a deferred
+    view would keep its whole frame alive until the encoder runs.
+    """
+    info["crops"] = [(target, img.copy()) for kind, target, img, _ in writes if kind == "crop"]
+    return [w for w in writes if w[0] != "crop"]
+
+
+def defer_debug_writes(writes, info: dict):
+    """
+    Move the debug jobs out of writes into info["debug"] as (target, img, kind),
+    for the asynchronous DebugSink. Returns the rest.
+    """
+    info["debug"] = [(target, img, kind) for job, target, img, kind in writes if job == "debug"]
+    return [w for w in writes if w[0] != "debug"]
+
+
+def scan_image(p: Path, out_dir: Path, debug_dir, crop: bool, pad_scale: float, min_pad: int,
+               pyramid: bool = False, decode_scale: int = 1, profile: bool = False, tile_size: int = 0,
+               defer_crops: bool = False, defer_debug: bool = False, debug_sample=None,
+               in_root=None):
+    """
+    Read one image, run detection and write its outputs (match + debug files).
+    Returns (status, info): status is the detect_image() status, "screened" if
+    rejected at reduced decode, or "unreadable". info["outputs"] lists the
+    write_outputs() records of the files written. With profile=True, info holds
+    per-stage timings (see has_red_circle) plus imread/write and image size.
+    tile_size > 0 switches to tiled detection (see scan_tiled).
+    defer_crops=True leaves match crops unwritten in info["crops"], and
+    defer_debug=True does the same for debug files in info["debug"], and
+    debug_sample (a DebugSampler) skips debug files for images it does not keep.
+    in_root is the scanned folder, for output_path().
+    """
+    info = _new_info(profile)
+    stages = info.get("stages")
+
+    if tile_size:
+        status, writes = scan_tiled(p, out_dir, crop, pad_scale, min_pad, tile_size, info, in_root)
+        if defer_crops:
+            writes = defer_crop_writes(writes, info)
+        info["outputs"] = write_outputs(writes)
+        return status, info
+
+    t = time.perf_counter() if stages is not None else 0.0
+    img, screened = read_image(p, decode_scale)
+    if stages is not None:
+        t = _lap(stages, "imread", t)
+    _note_shape(info, img)
+    if img is None:
+        return "unreadable", info
+
+    if screened:
+        writes = screened_outputs(p, img, debug_dir, debug_sample, in_root)
+        if defer_debug:
+            writes = defer_debug_writes(writes, info)
+        info["outputs"] = write_outputs(writes)
+        return "screened", info
+
+    status, writes = detect_image(p, img, out_dir, debug_dir, crop, pad_scale, min_pad, pyramid, info,
+                                  debug_sample, in_root)
+    if defer_crops:
+        writes = defer_crop_writes(writes, info)
+    if defer_debug:
+        writes = defer_debug_writes(writes, info)
+    if stages is not None:
+        t = time.perf_counter()
+    info["outputs"] = write_outputs(writes)
+    if stages is not None:
+        _lap(stages, "write", t)
+    return status, info
+
+
+def _init_worker():
+    # One OpenCV thread per process, otherwise N workers x N cores threads fight
+    cv2.setNumThreads(1)
+
+
+def scan_files(files, workers: int = 1, **scan_kwargs):
+    """
+    Run scan_image over files, in a process pool when workers > 1.
+    Yields (path, status, error_or_None, info) in the same order as files, so
+    output and summary do not depend on which worker finishes first.
+    """
+    if workers <= 1:
+        for p in files:
+            try:
+                status, info = scan_image(p, **scan_kwargs)
+                yield p, status, None, info
+            except Exception as e:
+                yield p, None, e, {}
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(scan_image, p, **scan_kwargs) for p in files]
+        for p, fut in zip(files, futures):
+            try:
+                status, info = fut.result()
+                yield p, status, None, info
+            except Exception as e:
+                yield p, None, e, {}
+
+
+class StageStats:
+    """Busy/blocked time for one pipeline stage."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+
+    def report(self) -> str:
+        rate = self.items / self.busy if self.busy > 0 else float("inf")
+        return (f"{self.name:8s} {self.items:6d} items  busy {self.busy:7.2f}s "
+                f"({rate:8.1f}/s)  blocked {self.blocked:7.2f}s")
+
+
+def _timed_put(q, item, stats: StageStats):
+    t0 = time.perf_counter()
+    q.put(item)
+    stats.blocked += time.perf_counter() - t0
+
+
+def _timed_get(q, stats: StageStats):
+    t0 = time.perf_counter()
+    item = q.get()
+    stats.blocked += time.perf_counter() - t0
+    return item
+
+
+def scan_pipeline(files, queue_depth: int = 8, stats=None, decode_scale: int = 1, profile: bool = False,
+                  defer_crops: bool = False, defer_debug: bool = False, **scan_kwargs):
+    """
+    Staged version of scan_files(): a reader thread decodes ahead, a detector
+    thread runs has_red_circle, and a writer thread does the crops/copies/debug
+    files. Stages are joined by queues of size queue_depth, so at most about
+    3 * queue_depth decoded images are held at once.
+    Yields (path, status, error_or_None, info) in input order, after the file's
+    outputs are written. If stats is a list, the three StageStats are appended to it.
+    """
+    done = object()
+    read_q = queue.Queue(maxsize=queue_depth)
+    write_q = queue.Queue(maxsize=queue_depth)
+    result_q = queue.Queue(maxsize=queue_depth)
+
+    read_stats = StageStats("read")
+    detect_stats = StageStats("detect")
+    write_stats = StageStats("write")
+    if stats is not None:
+        stats.extend([read_stats, detect_stats, write_stats])
+
+    def reader():
+        for p in files:
+            info = _new_info(profile)
+            t0 = time.perf_counter()
+            try:
+                img, screened = read_image(p, decode_scale)
+                item = (p, img, screened, None, info)
+            except Exception as e:
+                img = None
+                item = (p, None, False, e, info)
+            dt = time.perf_counter() - t0
+            if profile:
+                info["stages"]["imread"] = dt
+                _note_shape(info, img)
+            read_stats.busy += dt
+            read_stats.items += 1
+            _timed_put(read_q, item, read_stats)
+        read_q.put(done)
+
+    def detector():
+        while True:
+            item = _timed_get(read_q, detect_stats)
+            if item is done:
+                break
+            p, img, screened, err, info = item
+            status, writes = None, []
+            if screened:
+                status, writes = "screened", screened_outputs(p, img, scan_kwargs["debug_dir"],
+                                                              scan_kwargs.get("debug_sample"),
+                                                              scan_kwargs.get("in_root"))
+            elif err is None and img is None:
+                status = "unreadable"
+            elif err is None:
+                t0 = time.perf_counter()
+                try:
+                    status, writes = detect_image(p, img, info=info, **scan_kwargs)
+                except Exception as e:
+                    err = e
+                detect_stats.busy += time.perf_counter() - t0
+                detect_stats.items += 1
+            _timed_put(write_q, (p, status, err, writes, info), detect_stats)
+        write_q.put(done)
+
+    def writer():
+        while True:
+            item = _timed_get(write_q, write_stats)
+            if item is done:
+                break
+            p, status, err, writes, info = item
+            if defer_crops:
+                writes = defer_crop_writes(writes, info)
+            if defer_debug:
+                writes = defer_debug_writes(writes, info)
+            if writes:
+                t0 = time.perf_counter()
+                try:
+                    info["outputs"] = write_outputs(writes)
+                except Exception as e:
+                    err = e
+                dt = time.perf_counter() - t0
+                if profile:
+                    info["stages"]["write"] = dt
+                write_stats.busy += dt
+                write_stats.items += 1
+            _timed_put(result_q, (p, status, err, info), write_stats)
+        result_q.put(done)
+
+    threads = [threading.Thread(target=fn, daemon=True) for fn in (reader, detector, writer)]
+    for t in threads:
+        t.start()
+
+    while True:
+        item = result_q.get()
+        if item is done:
+            break
+        yield item
+
+    for t in threads:
+        t.join()
+
+
+class RoiTracker:
+    """
+    Where to look in the next video frame.
+    After a hit only a square around the last (x, y, r) is searched. A full
+    frame search is forced every full_every processed frames, and as soon as
+    the ring has been missed lost_after frames in a row.
+    """
+
+    def __init__(self, roi_scale: float = 4.0, full_every: int = 30, lost_after: int = 3):
+        self.roi_scale = roi_scale
+        self.full_every = full_every
+        self.lost_after = lost_after
+        self.circle = None
+        self.misses = 0
+        self.since_full = 0
+
+    def window(self, height: int, width: int):
+        """(x1, y1, x2, y2) to search, or None for the full frame."""
+        if self.circle is None or self.since_full >= self.full_every:
+            return None
+        x, y, r = self.circle
+        # Half side: room for the ring to move plus the overlap tiled mode needs
+        half = int(max(self.roi_scale * r, TILE_OVERLAP))
+        x1, y1 = max(0, int(x) - half), max(0, int(y) - half)
+        x2, y2 = min(width, int(x) + half), min(height, int(y) + half)
+        return x1, y1, x2, y2
+
+    def update(self, circle, full: bool):
+        self.since_full = 0 if full else self.since_full + 1
+        if circle is not None:
+            self.circle = circle
+            self.misses = 0
+            return
+        self.misses += 1
+        if full or self.misses >= self.lost_after:
+            self.circle = None
+
+
+class StreamStats:
+    """Frame counts and timing for a stream scan."""
+
+    def __init__(self):
+        self.read = 0
+        self.processed = 0
+        self.skipped = 0
+        self.matches = 0
+        self.full_searches = 0
+        self.roi_searches = 0
+        self.roi_hits = 0
+        self.wall = 0.0
+        self.source_fps = 0.0
+
+    def report(self) -> str:
+        fps = self.processed / self.wall if self.wall > 0 else 0.0
+        return (f"Stream: {self.processed}/{self.read} frames processed ({self.skipped} skipped), "
+                f"{self.matches} matches, {fps:.1f} fps sustained (source {self.source_fps:.1f} fps)\n"
+                f"  searches: {self.full_searches} full frame, {self.roi_searches} ROI "
+                f"({self.roi_hits} ROI hits)")
+
+
+def open_stream(source: str):
+    """cv2.VideoCapture for a video file, or a V4L2 device given as /dev/videoN or N."""
+    if source.isdigit():
+        return cv2.VideoCapture(int(source), cv2.CAP_V4L2), True
+    if source.startswith("/dev/video"):
+        return cv2.VideoCapture(source, cv2.CAP_V4L2), True
+    return cv2.VideoCapture(source), False
+
+
+def scan_stream(cap, out_dir: Path, crop: bool, pad_scale: float, min_pad: int, tracker=None,
+                realtime: bool = False, max_frames: int = 0, stats=None, prefix: str = "frame", written=None):
+    """
+    Detect red circles in the frames of an open cv2.VideoCapture.
+    Matched frames go through the same crop + JPEG path as stills and are
+    written to out_dir as <prefix>_<frame index>.jpg.
+
+    realtime=True paces the stream at the source frame rate (always the case for
+    a camera): when detection falls behind, the frames that are already due are
+    grabbed without decoding and dropped, so the output keeps up with the source.
+    If written is a dict, the hashes of the files written are recorded in it
+    (see record_outputs).
+    Yields (frame_index, status, circle_or_None) for every processed frame.
+    """
+    if tracker is None:
+        tracker = RoiTracker()
+    if stats is None:
+        stats = StreamStats()
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    stats.source_fps = fps if fps and fps > 0 else 30.0
+    interval = 1.0 / stats.source_fps
+
+    full_det = RedCircleDetector()
+    roi_det = RedCircleDetector()
+    index = -1
+    t_start = time.perf_counter()
+    while not max_frames or stats.processed < max_frames:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        index += 1
+        stats.read += 1
+
+        h, w = frame.shape[:2]
+        win = tracker.window(h, w)
+        if win is None:
+            stats.full_searches += 1
+            res = full_det.detect(frame)
+            circle = res.circle if res.found else None
+        else:
+            stats.roi_searches += 1
+            x1, y1, x2, y2 = win
+            res = roi_det.detect(frame[y1:y2, x1:x2])
+            circle = None
+            if res.found:
+                stats.roi_hits += 1
+                cx, cy, r = res.circle
+                circle = (cx + x1, cy + y1, r)
+        tracker.update(circle, win is None)
+        stats.processed += 1
+
+        status = "no match"
+        if circle is not None:
+            status = "match"
+            stats.matches += 1
+            target = out_dir / f"{prefix}_{index:06d}.jpg"
+            img = crop_around_circle(frame, *circle, pad_scale, min_pad) if crop else frame
+            records = write_outputs([("crop", target, img, [cv2.IMWRITE_JPEG_QUALITY, 95])])
+            if written is not None:
+                record_outputs(written, out_dir, records)
+        yield index, status, circle
+
+        if realtime:
+            # Drop every frame whose display time has already passed, or wait
+            # for the next one when a file is being replayed ahead of time
+            elapsed = time.perf_counter() - t_start
+            ahead = (index + 1) * interval - elapsed
+            if ahead > 0:
+                time.sleep(ahead)
+                continue
+            behind = int(elapsed / interval) - index - 1
+            for _ in range(max(0, behind)):
+                if not cap.grab():
+                    break
+                index += 1
+                stats.read += 1
+                stats.skipped += 1
+
+    stats.wall = time.perf_counter() - t_start
+
+
+class Medium:
+    """One inserted USB stick (or directory) under the watched media root."""
+
+    def __init__(self, path: Path, mounted: bool):
+        self.path = path
+        self.mounted = mounted
+        self.wds = []
+        self.seen = {}  # path -> (size, mtime_ns) when queued
+        self.queued = 0
+        self.done = 0
+        self.matches = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.last_activity = self.started
+        self.drained = False
+
+    def event(self, elapsed: float) -> dict:
+        return {
+            "event": "drained",
+            "media": str(self.path),
+            "images": self.done,
+            "matches": self.matches,
+            "errors": self.errors,
+            "seconds": round(elapsed, 3),
+        }
+
+
+MEDIA_MASK = IN_CREATE | IN_DELETE | IN_MOVED_TO | IN_MOVED_FROM | IN_ONLYDIR
+FILE_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_UNMOUNT
+
+
+def watch_media(media_root: Path, scan_kwargs: dict, settle: float = 2.0, on_drained=None,
+                verbose: bool = False, stop=None, written=None, debug_sink=None, cache=None):
+    """
+    Long-running replacement for the usb_run_ntmto.sh polling loop.
+
+    Every directory under media_root is a medium. The mount table is watched
+    too, so a stick that udisks mounts onto an existing directory is picked up
+    the moment it is mounted. Existing images are queued on arrival, and files
+    still being copied are queued when inotify reports them closed after
+    writing (or renamed into place), so detection overlaps the copy.
+    One detector thread runs scan_image for the whole life of the daemon,
+    so OpenCV and the detector buffers are loaded once across insert/remove cycles.
+
+    Outputs mirror the folders of the medium (output_path with in_root = the medium).
+    With cache (a DetectionCache), files seen before (e.g. the same stick
+    inserted again) are not detected again; it is committed whenever the
+    detector runs out of work.
+
+    When a medium has nothing queued and no file events for settle seconds,
+    on_drained(medium, event_dict) is called once (again after new files arrive).
+    It runs on its own thread, one call at a time, so a slow send does not hold
+    up the inotify loop or detection of the next medium.
+    If written is a dict, the hashes of the files written are recorded in it
+    (see record_outputs). Deferred debug files go to debug_sink.
+    Runs until stop (a threading.Event) is set.
+    """
+    media_root = Path(media_root)
+    ino = Inotify()
+    root_wd = ino.add_watch(media_root, MEDIA_MASK)
+    media = {}
+    lock = threading.Lock()
+    work_q = queue.Queue()
+    drain_q = queue.Queue()
+
+    def scan(medium, p: Path):
+        if cache is None:
+            return scan_image(p, in_root=medium.path, **scan_kwargs)
+        digest = cache.file_hash(p)
+        hit = cache.get(digest)
+        if hit is not None:
+            found, circle = hit
+            writes = []
+            if found:
+                writes = cached_outputs(p, circle, scan_kwargs["out_dir"], scan_kwargs["crop"],
+                                        scan_kwargs["pad_scale"], scan_kwargs["min_pad"], medium.path)
+            return ("match" if found else "no match"), {"circle": circle, "outputs": write_outputs(writes)}
+        status, info = scan_image(p, in_root=medium.path, **scan_kwargs)
+        if status != "unreadable":
+            cache.put(digest, status == "match", info.get("circle"))
+        return status, info
+
+    def detector():
+        while True:
+            item = work_q.get()
+            if item is None:
+                break
+            medium, p = item
+            try:
+                status, info = scan(medium, p)
+            except Exception as e:
+                status, info = None, {}
+                print(f"ERROR {p.name}: {e}")
+            if debug_sink is not None:
+                debug_sink.submit(p, status, info, medium.path)
+            with lock:
+                if written is not None:
+                    record_outputs(written, scan_kwargs["out_dir"], info.get("outputs", ()))
+                medium.done += 1
+                medium.last_activity = time.perf_counter()
+                if status == "match":
+                    medium.matches += 1
+                elif status in (None, "unreadable"):
+                    medium.errors += 1
+            if verbose:
+                print(f"{p.name}: {status}")
+            if cache is not None and work_q.empty():
+                cache.flush()
+
+    def sender():
+        while True:
+            item = drain_q.get()
+            if item is None:
+                break
+            try:
+                on_drained(*item)
+            except Exception as e:
+                print(f"ERROR after draining {item[0].path}: {e}")
+
+    def enqueue(medium: Medium, p: Path):
+        if p.suffix.lower() not in IMAGE_EXTS:
+            return
+        try:
+            st = p.stat()
+        except OSError:
+            return
+        # A file listed while still being copied is queued again once it is closed
+        version = (st.st_size, st.st_mtime_ns)
+        if medium.seen.get(p) == version:
+            return
+        medium.seen[p] = version
+        with lock:
+            medium.queued += 1
+            medium.drained = False
+            medium.last_activity = time.perf_counter()
+        work_q.put((medium, p))
+
+    def attach(path: Path, mounted: bool):
+        medium = Medium(path, mounted)
+        try:
+            # Watch first, then list: files finished in between are seen twice
+            # and deduplicated, never missed
+            medium.wds = ino.add_tree(path, FILE_MASK)
+        except OSError:
+            return
+        media[path] = medium
+        print(f"Media detected at {path}" + ("" if mounted else " (not a mount point)"))
+        for dirpath, _, filenames in os.walk(path):
+            for name in sorted(filenames):
+                enqueue(medium, Path(dirpath) / name)
+
+    def detach(path: Path):
+        medium = media.pop(path, None)
+        if medium is None:
+            return
+        for wd in medium.wds:
+            ino.rm_watch(wd)
+        print(f"Media removed: {path}")
+
+    def refresh():
+        # (Re)attach when a directory appears, disappears, or gets mounted over
+        current = {}
+        for d in media_root.iterdir():
+            if d.is_dir():
+                current[d] = os.path.ismount(d)
+        for path in list(media):
+            if path not in current or current[path] != media[path].mounted:
+                detach(path)
+        for path, mounted in sorted(current.items()):
+            if path not in media:
+                attach(path, mounted)
+
+    def medium_for(p: Path):
+        for path, medium in media.items():
+            if p == path or path in p.parents:
+                return medium
+        return None
+
+    worker = threading.Thread(target=detector, daemon=True)
+    worker.start()
+    drainer = threading.Thread(target=sender, daemon=True)
+    drainer.start()
+
+    poller = select.poll()
+    poller.register(ino.fileno(), select.POLLIN)
+    mounts = open("/proc/self/mountinfo", "rb")
+    mounts.read()
+    poller.register(mounts.fileno(), select.POLLPRI)
+
+    print(f"Watching {media_root} for media")
+    refresh()
+    try:
+        while stop is None or not stop.is_set():
+            ready = dict(poller.poll(200))
+            if mounts.fileno() in ready:
+                mounts.seek(0)
+                mounts.read()
+                refresh()
+
+            events = ino.read_events(0) if ino.fileno() in ready else []
+            if any(ev.mask & IN_Q_OVERFLOW for ev in events):
+                # Lost events: rebuild every medium from a fresh listing
+                for path in list(media):
+                    detach(path)
+                refresh()
+                events = []
+
+            for ev in events:
+                if ev.wd == root_wd:
+                    refresh()
+                    continue
+                if ev.path is None:
+                    continue
+                medium = medium_for(ev.path)
+                if medium is None:
+                    continue
+                if ev.mask & IN_UNMOUNT:
+                    detach(medium.path)
+                elif ev.mask & IN_ISDIR and ev.mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        medium.wds.extend(ino.add_tree(ev.path, FILE_MASK))
+                    except OSError:
+                        continue
+                    for dirpath, _, filenames in os.walk(ev.path):
+                        for name in sorted(filenames):
+                            enqueue(medium, Path(dirpath) / name)
+                elif ev.mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    enqueue(medium, ev.path)
+                elif ev.mask & IN_CREATE:
+                    with lock:
+                        medium.last_activity = time.perf_counter()
+
+            now = time.perf_counter()
+            for medium in list(media.values()):
+                with lock:
+                    idle = (not medium.drained and medium.done == medium.queued
+                            and now - medium.last_activity >= settle
+                            and (medium.queued or medium.mounted))
+                    if idle:
+                        medium.drained = True
+                        ev = medium.event(medium.last_activity - medium.started)
+                if idle:
+                    print(json.dumps(ev), flush=True)
+                    if on_drained is not None:
+                        drain_q.put((medium, ev))
+    finally:
+        work_q.put(None)
+        worker.join()
+        drain_q.put(None)
+        drainer.join()
+        mounts.close()
+        ino.close()
+
+
+PROFILE_STAGES = [
+    "imread", "cvtColor", "inRange", "prefilter", "pyramid", "morphologyEx",
+    "GaussianBlur", "HoughCircles", "scoring", "coverage", "write",
+]
+
+
+def profile_record(p: Path, status, info: dict) -> dict:
+    stages = info.get("stages", {})
+    rec = {
+        "file": p.name,
+        "status": status,
+        "width": info.get("width"),
+        "height": info.get("height"),
+        "candidates": int(stages.get("candidates", 0)),
+    }
+    for name in PROFILE_STAGES:
+        rec[f"{name}_ms"] = round(stages.get(name, 0.0) * 1000.0, 3)
+    rec["total_ms"] = round(sum(rec[f"{name}_ms"] for name in PROFILE_STAGES), 3)
+    return rec
+
+
+def write_profile(path: Path, records):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix.lower() == ".csv":
+        with open(path, "w", newline="") as f:
+            if records:
+                w = csv.DictWriter(f, fieldnames=list(records[0].keys()))
+                w.writeheader()
+                w.writerows(records)
+        return
+    with open(path, "w") as f:
+        for rec in records:
+            f.write(json.dumps(rec) + "\n")
+
+
+def profile_table(records) -> str:
+    """Aggregate a profile trace into a per-stage table (total, mean, p95, share)."""
+    if not records:
+        return "No profiled images."
+
+    grand = sum(r["total_ms"] for r in records) or 1.0
+    lines = [f"{'stage':14s} {'total ms':>10s} {'mean ms':>9s} {'p95 ms':>9s} {'share':>6s}"]
+    for name in PROFILE_STAGES + ["total"]:
+        vals = np.array([r[f"{name}_ms"] for r in records])
+        if not vals.any():
             continue
-        rel = p.relative_to(out_dir)
-        out_p = encrypted_dir / rel
-        encrypt_file_openssl(p, out_p, key_file)
+        lines.append(f"{name:14s} {vals.sum():10.1f} {vals.mean():9.2f} "
+                     f"{np.percentile(vals, 95):9.2f} {vals.sum() / grand * 100:5.1f}%")
+    cands = np.array([r["candidates"] for r in records])
+    lines.append(f"{len(records)} images, {int(cands.sum())} Hough candidates (max {int(cands.max())} per image)")
+    return "\n".join(lines)
 
-    print(f"Encrypted folder contents -> {encrypted_dir}")
 
-    # ZIP THE ENCRYPTED FOLDER
-    zip_base = encrypted_dir.parent / encrypted_dir.name
-    zip_path = Path(str(zip_base) + ".zip")
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--in_dir", default=None, help="Folder (or source tree, see --recursive) with input images")
+    ap.add_argument("--recursive", action="store_true",
+                    help="Also scan images in subfolders of --in_dir (read in place, duplicates scanned once)")
+    ap.add_argument("--watch", default=None,
+                    help="Run as a daemon: detect images on media appearing under this folder (e.g. /media/user)")
+    ap.add_argument("--settle", type=float, default=2.0,
+                    help="Watch: seconds without new files before a medium counts as drained")
+    ap.add_argument("--send", action="store_true",
+                    help="Watch: encrypt, zip and start the QR transfer each time a medium is drained")
+    ap.add_argument("--stream", default=None,
+                    help="Video file or V4L2 device (/dev/videoN or N) to scan instead of --in_dir")
+    ap.add_argument("--out_dir", required=True, help="Folder to write matched (cropped) images into")
+    ap.add_argument("--debug_dir", default=None, help="Optional folder to save debug overlays/masks")
+    ap.add_argument("--debug_every", type=int, default=1,
+                    help="Debug: keep about one image in N (picked by file name hash)")
+    ap.add_argument("--debug_only_matches", action="store_true", help="Debug: keep matched images only")
+    ap.add_argument("--debug_near", type=float, default=0.0,
+                    help="Debug: keep only images within this fraction of a detector threshold (e.g. 0.25)")
+    ap.add_argument("--debug_mask_scale", type=float, default=1.0,
+                    help="Debug: shrink masks by this factor (>= 1, e.g. 4 = quarter width)")
+    ap.add_argument("--debug_png_level", type=int, default=None, choices=range(10),
+                    help="Debug: PNG zlib level 0-9 (default: OpenCV's fast RLE setting)")
+    ap.add_argument("--debug_bundle", action="store_true",
+                    help="Debug: store artifacts and scores in one debug_bundle.sqlite instead of PNG files")
+    ap.add_argument("--crop", action="store_true", help="If set, save cropped match instead of full image")
+    ap.add_argument("--pad_scale", type=float, default=0.45, help="Crop padding as a fraction of radius")
+    ap.add_argument("--min_pad", type=int, default=8, help="Minimum crop padding in pixels")
+    ap.add_argument("--pyramid", action="store_true", help="Coarse-to-fine detection for large images")
+    ap.add_argument("--decode_scale", type=int, default=1, choices=[1, 2, 4, 8],
+                    help="Screen JPEGs at 1/N decode first; full decode only for images with enough red")
+    ap.add_argument("--tiled", action="store_true",
+                    help="Detect in overlapping tiles (BMP/PPM are memory-mapped) for very large frames")
+    ap.add_argument("--tile_size", type=int, default=TILE_SIZE, help="Tile edge length in pixels for --tiled")
+    ap.add_argument("--realtime", action="store_true",
+                    help="Stream: pace a video file at its frame rate and drop frames when behind "
+                         "(always on for cameras)")
+    ap.add_argument("--max_frames", type=int, default=0, help="Stream: stop after this many processed frames")
+    ap.add_argument("--roi_scale", type=float, default=4.0,
+                    help="Stream: track inside a square of +-roi_scale*r around the last ring")
+    ap.add_argument("--full_every", type=int, default=30,
+                    help="Stream: full-frame search at least every N processed frames")
+    ap.add_argument("--jpeg_max_bytes", type=int, default=0,
+                    help="Byte budget per crop: lower JPEG quality, then downscale, until it fits")
+    ap.add_argument("--jpeg_total_bytes", type=int, default=0,
+                    help="Byte budget for all crops together (shared in proportion to their size)")
+    ap.add_argument("--jpeg_min_quality", type=int, default=40, help="Lowest JPEG quality a budget may use")
+    ap.add_argument("--jpeg_progressive", action="store_true", help="Write progressive JPEG crops")
+    ap.add_argument("--jpeg_optimize", action="store_true", help="Optimize JPEG Huffman tables for crops")
+    ap.add_argument("--encode_workers", type=int, default=None, help="Threads for the crop encoder stage")
+    ap.add_argument("--link_rate", type=float, default=QR_LINK_BYTES_PER_S,
+                    help="QR link payload rate in bytes/s, for the transfer time estimate")
+    ap.add_argument("--verbose", action="store_true", help="Print one status line per image")
+    ap.add_argument("--profile", default=None,
+                    help="Write per-image stage timings to this .jsonl or .csv file and print a summary")
+    ap.add_argument("--workers", type=int, default=1, help="Number of worker processes for detection")
+    ap.add_argument("--pipeline", action="store_true",
+                    help="Overlap reading, detection and writing in separate stages")
+    ap.add_argument("--queue_depth", type=int, default=8, help="Max images queued between pipeline stages")
+    ap.add_argument("--cache", default=None,
+                    help="Detection cache SQLite file; results for files seen before are reused "
+                         "(default: no cache, nothing is written outside --out_dir)")
+    ap.add_argument("--cache_clear", action="store_true", help="Empty the detection cache before scanning")
+    ap.add_argument("--cache_max_entries", type=int, default=100000,
+                    help="Results kept in the cache before least-recently-used ones are evicted")
+    args = ap.parse_args()
+    if sum(x is not None for x in (args.in_dir, args.stream, args.watch)) != 1:
+        ap.error("give exactly one of --in_dir, --stream or --watch")
+    if args.watch and (args.pipeline or args.workers > 1):
+        ap.error("--watch cannot be combined with --pipeline or --workers")
+    if (args.watch or args.stream) and (args.jpeg_max_bytes or args.jpeg_total_bytes):
+        ap.error("JPEG byte budgets need --in_dir (crops are encoded together after the scan)")
+    if args.stream and (args.pipeline or args.workers > 1 or args.tiled or args.debug_dir):
+        ap.error("--stream cannot be combined with --pipeline, --workers, --tiled or --debug_dir")
+    if args.debug_mask_scale < 1:
+        ap.error("--debug_mask_scale is a shrink factor and must be >= 1")
+    if args.pipeline and args.workers > 1:
+        ap.error("--pipeline and --workers > 1 cannot be combined")
+    if args.tiled and (args.pipeline or args.debug_dir or args.pyramid or args.decode_scale > 1):
+        ap.error("--tiled cannot be combined with --pipeline, --debug_dir, --pyramid or --decode_scale")
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    if args.watch:
+        run_watch(args, out_dir)
+        return
+    # Hashes of the files written in this run, keyed by path relative to out_dir
+    written = {}
+    if args.stream:
+        run_stream(args, out_dir, written)
+    else:
+        run_stills(args, out_dir, written)
 
+    # Only here: the detector itself (workers, benchmarks) never loads the transport stack
+    from sender import package_and_send
+    if not package_and_send(out_dir, written):
+        sys.exit(2)
 
 
-    shutil.make_archive(
-        base_name=str(zip_base),
-        format="zip",
-        root_dir=str(encrypted_dir),
+def run_watch(args, out_dir: Path):
+    debug_dir = Path(args.debug_dir) if args.debug_dir else None
+    sink = make_debug_sink(args)
+    scan_kwargs = dict(
+        out_dir=out_dir,
+        debug_dir=debug_dir,
+        crop=args.crop,
+        pad_scale=args.pad_scale,
+        min_pad=args.min_pad,
+        pyramid=args.pyramid,
+        decode_scale=args.decode_scale,
+    )
+    if args.tiled:
+        scan_kwargs["tile_size"] = args.tile_size
+    if sink is not None:
+        scan_kwargs["defer_debug"] = True
+        scan_kwargs["debug_sample"] = sink.sampler
+    cache = make_detection_cache(args, debug_dir, scan_kwargs.get("tile_size", 0))
+
+    written = {}
+
+    def drained(medium, event):
+        print(f"Done with {medium.path}: {event['matches']} matches in {event['images']} images. "
+              f"Output -> {out_dir}")
+        if args.send:
+            try:
+                from sender import package_and_send
+                package_and_send(out_dir, written)
+            except Exception as e:
+                print(f"ERROR sending {out_dir}: {e}")
+
+    try:
+        watch_media(Path(args.watch), scan_kwargs, args.settle, drained, args.verbose, written=written,
+                    debug_sink=sink, cache=cache)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if cache is not None:
+            print(f"cache: {cache.hits} hits, {cache.misses} detected")
+            cache.close()
+        if sink is not None:
+            sink.close()
+            print(sink.report())
+
+
+def run_stream(args, out_dir: Path, written: dict):
+    cap, live = open_stream(args.stream)
+    if not cap.isOpened():
+        raise FileNotFoundError(f"Could not open stream: {args.stream}")
+
+    stats = StreamStats()
+    tracker = RoiTracker(args.roi_scale, args.full_every)
+    try:
+        for index, status, circle in scan_stream(cap, out_dir, args.crop, args.pad_scale, args.min_pad, tracker,
+                                                 realtime=live or args.realtime, max_frames=args.max_frames,
+                                                 stats=stats, written=written):
+            if args.verbose:
+                print(f"frame {index}: {status}")
+    finally:
+        cap.release()
+
+    print(stats.report())
+    print(f"Output -> {out_dir}")
+
+
+def make_debug_sink(args):
+    """DebugSink for --debug_dir and its sampling/encoding options, or None."""
+    if not args.debug_dir:
+        return None
+    return DebugSink(Path(args.debug_dir), DEBUG_THRESHOLDS, every=args.debug_every,
+                     only_matches=args.debug_only_matches, near=args.debug_near,
+                     mask_scale=args.debug_mask_scale, png_level=args.debug_png_level,
+                     bundle=args.debug_bundle)
+
+
+def make_detection_cache(args, debug_dir, tile_size: int = 0):
+    """DetectionCache for the --cache options, or None (no --cache, or debug runs)."""
+    # Debug runs need the mask/overlay of every image, so they always detect
+    if not args.cache or debug_dir:
+        return None
+    cache_path = Path(args.cache)
+    fingerprint = detector_fingerprint(args.pad_scale, args.min_pad, args.pyramid, args.decode_scale, tile_size)
+    cache = DetectionCache(cache_path, fingerprint, md5_file, args.cache_max_entries)
+    if args.cache_clear:
+        cache.clear()
+    return cache
+
+
+def run_stills(args, out_dir: Path, written: dict):
+    in_dir = Path(args.in_dir)
+    debug_dir = Path(args.debug_dir) if args.debug_dir else None
+    sink = make_debug_sink(args)
+
+    scan_kwargs = dict(
+        out_dir=out_dir,
+        debug_dir=debug_dir,
+        crop=args.crop,
+        pad_scale=args.pad_scale,
+        min_pad=args.min_pad,
+        pyramid=args.pyramid,
+        decode_scale=args.decode_scale,
+        profile=bool(args.profile),
+        in_root=in_dir,
     )
+    if args.tiled:
+        scan_kwargs["tile_size"] = args.tile_size
+
+    # With a byte budget, crops are collected and encoded together at the end
+    encoder = None
+    if args.jpeg_max_bytes or args.jpeg_total_bytes or args.jpeg_progressive or args.jpeg_optimize:
+        encoder = CropEncoder(args.jpeg_max_bytes, args.jpeg_total_bytes, min_quality=args.jpeg_min_quality,
+                              progressive=args.jpeg_progressive, optimize=args.jpeg_optimize)
+        scan_kwargs["defer_crops"] = True
+    crops = []
+    if sink is not None:
+        scan_kwargs["defer_debug"] = True
+        scan_kwargs["debug_sample"] = sink.sampler
+
+    cache = make_detection_cache(args, debug_dir, scan_kwargs.get("tile_size", 0))
+
+    t_ingest = time.perf_counter()
+    entries = list(walk_images(in_dir, args.recursive))
+    files, duplicates = dedup_files(entries, cache.file_hash if cache is not None else md5_file)
+    total_bytes = sum(size for _, size in entries)
+    if args.verbose:
+        for dup, orig in duplicates.items():
+            print(f"{dup}: duplicate of {orig}")
 
-    print(f"Created zip: {zip_path}")
+    matches = 0
+    prefiltered = 0
+    to_scan = files
+    hashes = {}
+    if cache is not None:
+        to_scan = []
+        for p in files:
+            try:
+                hashes[p] = cache.file_hash(p)
+            except OSError as e:
+                print(f"ERROR {p.name}: {e}")
+                continue
+            hit = cache.get(hashes[p])
+            if hit is None:
+                to_scan.append(p)
+                continue
+            found, circle = hit
+            if found:
+                matches += 1
+                writes = cached_outputs(p, circle, out_dir, args.crop, args.pad_scale, args.min_pad, in_dir)
+                if encoder is not None:
+                    info = {}
+                    writes = defer_crop_writes(writes, info)
+                    crops.extend(info["crops"])
+                record_outputs(written, out_dir, write_outputs(writes))
+            if args.verbose:
+                print(f"{p.name}: {'match' if found else 'no match'} (cached)")
+
+    stage_stats = []
+    if args.pipeline:
+        results = scan_pipeline(to_scan, args.queue_depth, stats=stage_stats, **scan_kwargs)
+    else:
+        results = scan_files(to_scan, args.workers, **scan_kwargs)
+
+    trace = []
+    for p, status, err, info in results:
+        if "stages" in info:
+            trace.append(profile_record(p, status, info))
+        if err is not None:
+            print(f"ERROR {p.name}: {err}")
+            continue
+        record_outputs(written, out_dir, info.get("outputs", ()))
+        crops.extend(info.get("crops", ()))
+        if sink is not None:
+            sink.submit(p, status, info, in_dir)
+        if status == "match":
+            matches += 1
+        elif status == "prefilter":
+            prefiltered += 1
+        if cache is not None and status != "unreadable":
+            cache.put(hashes[p], status == "match", info.get("circle"))
+        if args.verbose:
+            print(f"{p.name}: {status}")
+
+    if cache is not None:
+        cache.close()
+
+    if sink is not None:
+        sink.close()
 
+    enc_stats = None
+    if encoder is not None:
+        enc_stats = EncodeStats()
+        record_outputs(written, out_dir, encode_crops(crops, encoder, args.encode_workers, enc_stats))
+
+    ingest = time.perf_counter() - t_ingest
+    print(f"Scanned {len(files)} images. Found {matches} matches. Output -> {out_dir}")
+    if duplicates:
+        print(f"  duplicates skipped: {len(duplicates)}")
+    if ingest > 0:
+        print(f"  ingest: {len(entries)} files, {total_bytes / 1e6:.1f} MB in {ingest:.2f}s "
+              f"({len(entries) / ingest:.1f} files/s, {total_bytes / 1e6 / ingest:.1f} MB/s)")
+    if cache is not None:
+        print(f"  cache: {cache.hits} hits, {cache.misses} detected")
+    if enc_stats is not None:
+        print("  " + enc_stats.report(args.link_rate))
+    if sink is not None:
+        print("  " + sink.report())
+    if args.verbose:
+        print(f"  rejected by pre-filter: {prefiltered}")
+    if args.profile:
+        write_profile(Path(args.profile), trace)
+        print(profile_table(trace))
+        print(f"Profile trace -> {args.profile}")
+    if stage_stats:
+        bottleneck = max(stage_stats, key=lambda s: s.busy)
+        for s in stage_stats:
+            print("  " + s.report())
+        print(f"  bottleneck: {bottleneck.name}")
 
-    # md5_path = enc_path.with_suffix(enc_path.suffix + ".md5")
-    # md5_path.write_text(f"{md5_value} {enc_path.name}\n")
-    # print(f"MD5(enc): {md5_value} (saved to {md5_path})")
 
-    start_qrs_server_and_open_chromium()
-    subprocess.run(["python3", "receiver.py"])
-    subprocess.run(["python3", "compare_md5.py"])
-    
-    
 if __name__ == "__main__":
     main()
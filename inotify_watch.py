@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Minimal Linux inotify wrapper (ctypes, no extra packages).
+
+    ino = Inotify()
+    wd = ino.add_watch(Path("/media/user"), IN_CREATE | IN_DELETE)
+    for ev in ino.read_events(timeout=1.0):
+        print(ev.path, ev.mask)
+
+Events come back as Event(wd, mask, cookie, name, path), where path is the
+watched directory joined with name.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from collections import namedtuple
+from pathlib import Path
+
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN = 0x00000020
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+Event = namedtuple("Event", "wd mask cookie name path")
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+_libc.inotify_init1.argtypes = [ctypes.c_int]
+_libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+_libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+
+def _check(ret: int, what: str) -> int:
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, f"{what}: {os.strerror(err)}")
+    return ret
+
+
+class Inotify:
+    def __init__(self):
+        self.fd = _check(_libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC), "inotify_init1")
+        self.paths = {}  # wd -> watched directory
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def add_watch(self, path: Path, mask: int) -> int:
+        wd = _check(_libc.inotify_add_watch(self.fd, os.fsencode(str(path)), mask), f"inotify_add_watch {path}")
+        self.paths[wd] = Path(path)
+        return wd
+
+    def add_tree(self, root: Path, mask: int):
+        """Watch root and every directory below it. Returns the watch descriptors."""
+        wds = [self.add_watch(root, mask)]
+        for dirpath, dirnames, _ in os.walk(root):
+            for d in dirnames:
+                try:
+                    wds.append(self.add_watch(Path(dirpath) / d, mask))
+                except OSError:
+                    pass  # removed while walking
+        return wds
+
+    def rm_watch(self, wd: int):
+        # The kernel already drops the watch when the directory goes away
+        if self.paths.pop(wd, None) is not None:
+            _libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout=None):
+        """Wait up to timeout seconds (None: forever) and return the pending events."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = data[pos:pos + length].rstrip(b"\0").decode(errors="surrogateescape")
+            pos += length
+            base = self.paths.get(wd)
+            path = (base / name if name else base) if base is not None else None
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+            events.append(Event(wd, mask, cookie, name, path))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+            self.paths.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
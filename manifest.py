@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Per-file manifest of the matched folder and its Merkle root.
+
+matched.manifest has one line per file, sorted by relative path:
+
+    <relative path>\t<size>\t<md5 of content>
+
+matched.manifest.md5 holds the Merkle root over those lines instead of the MD5
+of the manifest file. It is still 32 hex characters, so the serial link and
+compare_md5.py carry it unchanged. Leaves are md5(line); each parent is the
+md5 of its two children's digests, and an odd node at the end of a level is
+carried up as is. If two sides disagree on the root, find_mismatches() walks
+down only the differing branches to the files that differ.
+
+Hashes come from write_outputs() in find_red_circles.py, which hashes each
+crop/copy while writing it. Only files not written in this run are read back.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+
+MANIFEST_NAME = "matched.manifest"
+ROOT_NAME = "matched.manifest.md5"
+SKIP_NAMES = {MANIFEST_NAME, ROOT_NAME}
+
+
+def md5_path(p: Path, chunk: int = 1 << 20) -> str:
+    h = hashlib.md5()
+    with open(p, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def manifest_line(rel: str, size: int, md5_hex: str) -> str:
+    return f"{rel}\t{size}\t{md5_hex}"
+
+
+def merkle_levels(lines):
+    """All tree levels, leaves first: levels[0][i] is md5(lines[i]), levels[-1][0] the root."""
+    level = [hashlib.md5(line.encode()).digest() for line in lines]
+    if not level:
+        level = [hashlib.md5(b"").digest()]
+    levels = [level]
+    while len(level) > 1:
+        up = [hashlib.md5(level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            up.append(level[-1])
+        levels.append(up)
+        level = up
+    return levels
+
+
+def merkle_root(lines) -> str:
+    return merkle_levels(lines)[-1][0].hex()
+
+
+def find_mismatches(levels, remote_node):
+    """
+    Leaf indices where the remote tree differs from levels.
+    remote_node(level, index) returns the other side's digest (bytes) for that
+    node. Only children of differing nodes are asked for, so one bad file
+    costs about 2 * log2(n) lookups instead of n.
+    """
+    top = len(levels) - 1
+    if remote_node(top, 0) == levels[top][0]:
+        return []
+
+    bad = [0]
+    for lvl in range(top - 1, -1, -1):
+        below = []
+        for i in bad:
+            for child in (2 * i, 2 * i + 1):
+                if child < len(levels[lvl]) and remote_node(lvl, child) != levels[lvl][child]:
+                    below.append(child)
+        bad = below
+    return bad
+
+
+def read_manifest(path: Path):
+    """(rel, size, md5) entries of a manifest file. Old size-only lines get md5 None."""
+    entries = []
+    for line in Path(path).read_text().splitlines():
+        parts = line.split("\t")
+        if len(parts) >= 2 and parts[0]:
+            entries.append((parts[0], int(parts[1]), parts[2] if len(parts) > 2 else None))
+    return entries
+
+
+def build_entries(out_dir: Path, written: dict):
+    """
+    Manifest entries for every file under out_dir.
+    written maps relative path -> (size, md5) for files hashed while they were
+    written; a file is only read back if it is missing there or its size changed.
+    Returns (entries, files_rehashed).
+    """
+    out_dir = Path(out_dir)
+    entries = []
+    rehashed = 0
+    for dirpath, dirnames, filenames in os.walk(out_dir):
+        dirnames.sort()
+        for name in filenames:
+            p = Path(dirpath) / name
+            rel = p.relative_to(out_dir).as_posix()
+            if rel in SKIP_NAMES:
+                continue
+            size = p.stat().st_size
+            known = written.get(rel)
+            if known is not None and known[0] == size:
+                digest = known[1]
+            else:
+                digest = md5_path(p)
+                rehashed += 1
+            entries.append((rel, size, digest))
+    entries.sort()
+    return entries, rehashed
+
+
+def write_manifest(out_dir: Path, entries) -> str:
+    """Write matched.manifest and matched.manifest.md5 (Merkle root). Returns the root."""
+    out_dir = Path(out_dir)
+    lines = [manifest_line(*e) for e in entries]
+    (out_dir / MANIFEST_NAME).write_text("\n".join(lines) + "\n")
+    root = merkle_root(lines)
+    (out_dir / ROOT_NAME).write_text(f"{root}  {MANIFEST_NAME}\n")
+    return root
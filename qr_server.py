@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Lifecycle of the QR transfer server (~/qrs, node .output/server/index.mjs)
+and the Chromium window showing it.
+
+Instead of a new node process and a new browser window for every zip:
+
+  - the server is started once, with QRS_DEFAULT_FILE_PATH pointing at a
+    stable link (PAYLOAD_NAME in the qrs folder), and its pid is kept in
+    PID_NAME. Later runs that find it healthy reuse it; an unhealthy one
+    left over from an earlier run is stopped before a new one is started,
+    but only if /proc/<pid>/cmdline shows it is still that server (the pid
+    may have been reused by something else since).
+  - readiness is checked with exponential backoff (20 ms doubling up to
+    0.5 s) instead of fixed 0.25 s sleeps. Only a 2xx answer counts as
+    ready. The check goes to health_path if given, else to payload_path
+    (the server can hand out the payload, which is swapped in first), and
+    only without either to "/" (the server answers at all).
+  - a new zip is swapped in by atomically replacing the link, so node keeps
+    running. The page is then refreshed through Chromium's DevTools HTTP
+    endpoints (/json/list, /json/new, /json/close); Chromium is only
+    launched when no instance with DEVTOOLS_PORT is running.
+
+send() reports the time to first QR frame: from the call until the server
+serves the new zip at payload_path (the URL under which it hands out the
+payload) and the page has been (re)opened on it. Without payload_path there
+is no way to tell when the new zip is served, so only the page time is
+reported and first_frame_s stays None.
+
+    server = QrServer()
+    stats = server.send(Path("matched_encrypted.zip"))
+    print(stats.report())
+
+The command is configurable, so a stub HTTP server can stand in for node:
+
+    QrServer(qrs_dir=tmp, port=8123, browser=None, payload_path="/payload.zip",
+             command=[sys.executable, "-m", "http.server", "8123"])
+"""
+
+import json
+import os
+import shutil
+import signal
+import subprocess
+import time
+import urllib.parse
+import urllib.request
+from pathlib import Path
+
+QRS_DIR = Path.home() / "qrs"
+QRS_PORT = 3000
+QRS_COMMAND = ["node", ".output/server/index.mjs"]
+# Routes of the qrs server (server/api in the qrs checkout): the file named by
+# QRS_DEFAULT_FILE_PATH is served at QRS_PAYLOAD_PATH, and QRS_HEALTH_PATH
+# answers 2xx once the server is up
+QRS_PAYLOAD_PATH = "/api/file"
+QRS_HEALTH_PATH = "/api/health"
+PAYLOAD_NAME = "payload.zip"
+PID_NAME = ".qrs_server.pid"
+DEVTOOLS_PORT = 9222
+
+
+def wait_until(check, timeout: float, first: float = 0.02, cap: float = 0.5):
+    """
+    Call check() until it returns True or timeout seconds pass, sleeping
+    first, 2*first, ... (at most cap) in between. Returns (ok, attempts).
+    """
+    deadline = time.monotonic() + timeout
+    delay = first
+    attempts = 0
+    while True:
+        attempts += 1
+        if check():
+            return True, attempts
+        left = deadline - time.monotonic()
+        if left <= 0:
+            return False, attempts
+        time.sleep(min(delay, left))
+        delay = min(delay * 2, cap)
+
+
+def _cmdline(pid: int):
+    """Argument list of a running process from /proc, or None if it cannot be read."""
+    try:
+        raw = Path(f"/proc/{pid}/cmdline").read_bytes()
+    except OSError:
+        return None
+    return [arg.decode(errors="replace") for arg in raw.rstrip(b"\0").split(b"\0")]
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SendStats:
+    """Timings of one QrServer.send()."""
+
+    def __init__(self):
+        self.reused = False
+        self.start_s = 0.0     # until the server answered healthy
+        self.probes = 0        # health checks needed
+        self.swap_s = 0.0      # payload link replaced
+        self.show_s = 0.0      # page (re)opened
+        self.first_frame_s = None  # new payload served and page open; None if not measurable
+
+    def report(self) -> str:
+        how = "reused" if self.reused else "started"
+        if self.first_frame_s is None:
+            first = "time to first QR frame not measured (no payload_path)"
+        else:
+            first = f"time to first QR frame {self.first_frame_s:.2f}s"
+        return (f"QR server {how} ({self.start_s:.2f}s, {self.probes} probes), payload swap "
+                f"{self.swap_s * 1e3:.1f} ms, page {self.show_s:.2f}s, {first}")
+
+
+class QrServer:
+    def __init__(self, qrs_dir: Path = QRS_DIR, port: int = QRS_PORT, health_path=None,
+                 payload_path=None, command=None, browser="chromium", devtools_port: int = DEVTOOLS_PORT,
+                 start_timeout: float = 10.0):
+        """
+        qrs_dir: the qrs checkout; the server runs there and the payload link lives there
+        health_path: path that answers 2xx once the server is ready (default: payload_path, else "/")
+        payload_path: path under which the server serves the payload, None if it has none
+        command: server command line (default QRS_COMMAND)
+        browser: Chromium executable, None to never open a browser
+        """
+        self.qrs_dir = Path(qrs_dir)
+        self.port = port
+        self.url = f"http://localhost:{port}"
+        self.health_path = health_path
+        self.payload_path = payload_path
+        self.command = list(command or QRS_COMMAND)
+        self.browser = browser
+        self.devtools = f"http://localhost:{devtools_port}"
+        self.devtools_port = devtools_port
+        self.start_timeout = start_timeout
+        self.payload = self.qrs_dir / PAYLOAD_NAME
+        self.pid_file = self.qrs_dir / PID_NAME
+        self.proc = None
+        self.version = 0
+
+    def _get(self, url: str, timeout: float = 0.5, method: str = "GET"):
+        req = urllib.request.Request(url, method=method)
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.read()
+
+    def healthy(self) -> bool:
+        path = self.health_path or self.payload_path or "/"
+        try:
+            status, _ = self._get(self.url + path)
+        except Exception:
+            return False
+        return 200 <= status < 300
+
+    def _read_pid(self):
+        try:
+            return int(self.pid_file.read_text().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _is_server(self, pid: int) -> bool:
+        """True if pid is still running self.command (and not something that got the pid later)."""
+        return _cmdline(pid) == self.command
+
+    def _stop_stale(self):
+        """Stop a server from an earlier run that is still alive but not healthy."""
+        pid = self._read_pid()
+        if pid is not None and _pid_alive(pid) and self._is_server(pid):
+            try:
+                os.killpg(pid, signal.SIGTERM)  # started with its own session
+            except ProcessLookupError:
+                pass
+            wait_until(lambda: not _pid_alive(pid), 3.0)
+        self.pid_file.unlink(missing_ok=True)
+
+    def ensure_running(self, stats=None) -> bool:
+        """Reuse a healthy server or start one. Returns True if it was reused."""
+        if stats is None:
+            stats = SendStats()
+        t0 = time.perf_counter()
+        if self.healthy():
+            stats.reused = True
+            stats.probes = 1
+            stats.start_s = time.perf_counter() - t0
+            return True
+
+        self._stop_stale()
+        env = os.environ.copy()
+        env["QRS_DEFAULT_FILE_PATH"] = str(self.payload)
+        env["PORT"] = str(self.port)
+        self.proc = subprocess.Popen(
+            self.command,
+            cwd=str(self.qrs_dir),
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,  # keeps it alive if the script exits
+        )
+        self.pid_file.write_text(f"{self.proc.pid}\n")
+
+        ok, stats.probes = wait_until(self.healthy, self.start_timeout)
+        stats.start_s = time.perf_counter() - t0
+        if not ok:
+            raise TimeoutError(f"QR server at {self.url} not healthy after {self.start_timeout:.0f}s")
+        return False
+
+    def set_payload(self, zip_path: Path):
+        """Point the payload link at zip_path. Readers see either the old or the new zip."""
+        tmp = self.payload.with_name("." + PAYLOAD_NAME + ".tmp")
+        tmp.unlink(missing_ok=True)
+        try:
+            tmp.symlink_to(Path(zip_path).resolve())
+        except OSError:  # no symlinks on this filesystem
+            shutil.copyfile(zip_path, tmp)
+        os.replace(tmp, self.payload)
+        self.version += 1
+
+    def _serves_payload(self, size: int) -> bool:
+        try:
+            status, body = self._get(self.url + self.payload_path, timeout=2.0)
+        except Exception:
+            return False
+        return 200 <= status < 300 and len(body) == size
+
+    def show(self):
+        """Reload the QR page in the running Chromium, or launch Chromium on it."""
+        if self.browser is None:
+            return
+        page = f"{self.url}/?v={self.version}"  # new URL so nothing is served from cache
+        try:
+            _, body = self._get(self.devtools + "/json/list")
+        except Exception:
+            subprocess.Popen(
+                [self.browser, "--start-maximized", f"--remote-debugging-port={self.devtools_port}",
+                 f"--user-data-dir={self.qrs_dir / '.chromium-profile'}", page],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+            return
+
+        old = [t["id"] for t in json.loads(body) if t.get("type") == "page" and t.get("url", "").startswith(self.url)]
+        self._get(self.devtools + "/json/new?" + urllib.parse.quote(page, safe=""), method="PUT")
+        for target in old:
+            self._get(self.devtools + "/json/close/" + target)
+
+    def send(self, zip_path: Path) -> SendStats:
+        """Make sure the server runs, swap in zip_path and show it. Returns the timings."""
+        stats = SendStats()
+        t0 = time.perf_counter()
+        # Payload first: a fresh server is only healthy once it can serve it
+        t = time.perf_counter()
+        self.set_payload(zip_path)
+        stats.swap_s = time.perf_counter() - t
+
+        self.ensure_running(stats)
+
+        t = time.perf_counter()
+        self.show()
+        stats.show_s = time.perf_counter() - t
+
+        if self.payload_path is not None:
+            size = Path(zip_path).stat().st_size
+            ok, _ = wait_until(lambda: self._serves_payload(size), self.start_timeout)
+            if not ok:
+                raise TimeoutError(f"QR server does not serve the new payload at {self.payload_path}")
+            stats.first_frame_s = time.perf_counter() - t0
+        return stats
+
+    def stop(self):
+        """Stop the server (whether started by this object or an earlier run)."""
+        if self.proc is None:
+            self._stop_stale()
+            return
+        try:
+            os.killpg(self.proc.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        self.proc.wait(timeout=5)
+        self.proc = None
+        self.pid_file.unlink(missing_ok=True)
@@ -1,43 +1,146 @@
 #!/usr/bin/env python3
 
 from pathlib import Path
+import argparse
 import time
-import os
-import select
 import sys
 
+from serial_frame import SerialLink
+
 SERIAL_PORT = "/dev/serial0"
+BAUD_RATE = 9600
 BASE_DIR = Path("/home/user/group-9-team-project-main/red-circle-finder/matched")
 OUTPUT_FILE = BASE_DIR / "returned.manifest.md5"
+HEX_DIGITS = set(b"0123456789abcdef")
+# After the ACK, keep answering repeats until the line is quiet this long
+ACK_QUIET = 1.0
 
-def main():
-    os.system(f"stty -F {SERIAL_PORT} 9600 raw -echo -crtscts")
 
-    md5_chars = []
-    start = time.time()
-    timeout_seconds = 300
+class ReceiveStats:
+    def __init__(self):
+        self.bytes = 0
+        self.seconds = 0.0
+        self.frames = 0
+        self.rejected = 0
+        self.noise = 0
 
-    with open(SERIAL_PORT, "rb", buffering=0) as serial_file:
-        serial_fd = serial_file.fileno()
+    def report(self) -> str:
+        rate = self.bytes / self.seconds if self.seconds > 0 else 0.0
+        return (f"received {self.bytes} bytes in {self.seconds:.2f}s ({rate:.0f} B/s), "
+                f"{self.frames} frames, {self.rejected} rejected, {self.noise} noise bytes")
 
-        while len(md5_chars) < 32:
-            remaining = timeout_seconds - (time.time() - start)
-            if remaining <= 0:
-                sys.exit(3)
 
-            readable, _, _ = select.select([serial_fd], [], [], min(0.1, remaining))
-            if not readable:
-                continue
+def valid_md5(payload: bytes) -> bool:
+    return len(payload) == 32 and set(payload.lower()) <= HEX_DIGITS
+
+
+def parse_timings(payload: bytes) -> dict:
+    """Stage name -> seconds from a TIM frame (transmission.format_timings); bad pairs are skipped."""
+    timings = {}
+    for pair in payload.decode(errors="replace").split(","):
+        name, _, seconds = pair.partition("=")
+        try:
+            timings[name] = float(seconds)
+        except ValueError:
+            continue
+    return timings
 
-            byte = os.read(serial_fd, 1)
-            if not byte:
+
+def receive_frame(link: SerialLink, kind: bytes = b"MD5", timeout: float = 300.0, accept=valid_md5, stats=None,
+                  other=None):
+    """
+    Read the link in bulk until the first valid frame of kind whose payload
+    passes accept(). Frames of other kinds go to other(kind, payload) if
+    given; anything else and noise are discarded. Returns the payload, or
+    None on timeout.
+    """
+    if stats is None:
+        stats = ReceiveStats()
+    parser = link.parser
+    start = time.monotonic()
+    bytes0 = link.bytes_in
+    found = None
+
+    while found is None:
+        remaining = timeout - (time.monotonic() - start)
+        if remaining <= 0:
+            break
+        try:
+            frames = link.read_frames(remaining)
+        except OSError:
+            break  # the other end of a pty went away
+
+        for got_kind, payload in frames:
+            if got_kind == kind and accept(payload):
+                found = payload
+                break
+            if other is not None and got_kind != kind:
+                other(got_kind, payload)
                 continue
+            parser.rejected += 1
+
+    stats.seconds = time.monotonic() - start
+    stats.bytes = link.bytes_in - bytes0
+    stats.frames = parser.frames
+    stats.rejected = parser.rejected
+    stats.noise = parser.noise
+    return found
+
+
+def answer_repeats(link: SerialLink, payload: bytes, kind: bytes = b"MD5", quiet: float = ACK_QUIET,
+                   reply: str = "ACK"):
+    """
+    The ACK (or NAK, with reply="NAK") can get lost, so answer repeats of the
+    same frame with another one until the line has been quiet for `quiet`
+    seconds. This also drains the repeats, so the next receive_frame() starts
+    clean; it stops at the first different frame and leaves that unread.
+    Returns replies sent.
+    """
+    sent = 0
+    deadline = time.monotonic() + 10 * quiet  # a noisy line is never quiet
+    while time.monotonic() < deadline:
+        before = link.bytes_in
+        try:
+            frames = link.read_frames(quiet)
+        except OSError:
+            break
+        if link.bytes_in == before:
+            break
+        for i, frame in enumerate(frames):
+            if frame != (kind, payload):
+                # Something new (e.g. a retry): leave it for the next receive_frame()
+                link.unread(frames[i:])
+                return sent
+            link.send(reply, payload)
+            sent += 1
+    return sent
+
+
+def acknowledge(link: SerialLink, payload: bytes, kind: bytes = b"MD5", quiet: float = ACK_QUIET):
+    """Send ACK for payload and answer repeats (answer_repeats). Returns the number of ACKs sent."""
+    link.send("ACK", payload)
+    return 1 + answer_repeats(link, payload, kind, quiet)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Receive the framed manifest root over serial and acknowledge it.")
+    ap.add_argument("--port", default=SERIAL_PORT)
+    ap.add_argument("--baud", type=int, default=BAUD_RATE)
+    ap.add_argument("--timeout", type=float, default=300)
+    args = ap.parse_args()
+
+    stats = ReceiveStats()
+    with SerialLink(args.port, args.baud) as link:
+        payload = receive_frame(link, timeout=args.timeout, stats=stats)
+        if payload is not None:
+            acks = acknowledge(link, payload)
 
-            char = byte.decode(errors="ignore")
-            if char in "0123456789abcdefABCDEF":
-                md5_chars.append(char.lower())
+    print(stats.report())
+    if payload is None:
+        sys.exit(3)
+    print(f"acknowledged ({acks} ACK{'s' if acks > 1 else ''})")
 
-    md5_string = "".join(md5_chars)
+    md5_string = payload.decode().lower()
     OUTPUT_FILE.write_text(md5_string + "  matched.manifest\n")
     sys.exit(0)
 
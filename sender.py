@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Sending side of the transfer: manifest, encrypt and zip the matched folder,
+show it as QR codes and verify the root the receiver sends back over serial.
+
+Kept out of find_red_circles.py, so scanning (worker processes, benchmarks)
+does not load the QR server and serial link modules.
+"""
+
+import time
+from pathlib import Path
+
+import receiver
+from aes_engine import load_key, write_encrypted_zip
+from compare_md5 import RETURNED_NAME, serial_receiver, verify_round_trip
+from manifest import build_entries, write_manifest
+from qr_server import QRS_HEALTH_PATH, QRS_PAYLOAD_PATH, QrServer
+from serial_frame import SerialLink
+
+_QR_SERVER = None
+
+
+def start_qrs_server_and_open_chromium(zip_path: Path): #added by Tyler
+    """
+    Show zip_path as QR codes. The server and Chromium window from an earlier
+    send (or run) are reused and only the payload is swapped; see qr_server.py.
+    """
+    global _QR_SERVER
+    if _QR_SERVER is None:
+        _QR_SERVER = QrServer(health_path=QRS_HEALTH_PATH, payload_path=QRS_PAYLOAD_PATH)
+    stats = _QR_SERVER.send(zip_path)
+    print("  " + stats.report())
+    return _QR_SERVER
+
+
+def package_and_send(out_dir: Path, written=None) -> bool:
+    """
+    Manifest, encrypt and zip out_dir, show it as QR codes and verify the
+    root the receiver sends back. Returns True if it matches.
+    """
+    # Always encrypt the zip (predetermined key)
+    key_file = Path("qr_shared.key")  # adjust if needed
+    if not key_file.exists():
+        raise FileNotFoundError(f"Key file not found: {key_file}")
+        
+    # Per-file manifest of the matched FOLDER (pre-zip) and its Merkle root.
+    # Files written in this run were hashed while writing; only older ones are read.
+    t_manifest = time.perf_counter()
+    entries, rehashed = build_entries(out_dir, written or {})
+    manifest_root = write_manifest(out_dir, entries)
+    t_manifest = time.perf_counter() - t_manifest
+    print(f"Manifest: {len(entries)} files ({rehashed} re-read), Merkle root {manifest_root}")
+    
+    
+# ENCRYPT THE FOLDER CONTENTS STRAIGHT INTO THE ZIP (no encrypted copy folder)
+    # Same name and entry layout as the old <out_dir>_encrypted tree + make_archive
+    zip_path = out_dir.parent / (out_dir.name + "_encrypted.zip")
+    zip_stats = write_encrypted_zip(out_dir, zip_path, load_key(key_file))
+
+    print(f"Created zip: {zip_path}")
+    print(f"  manifest {t_manifest:.2f}s, " + zip_stats.report())
+
+
+    # md5_path = enc_path.with_suffix(enc_path.suffix + ".md5")
+    # md5_path.write_text(f"{md5_value} {enc_path.name}\n")
+    # print(f"MD5(enc): {md5_value} (saved to {md5_path})")
+
+    start_qrs_server_and_open_chromium(zip_path)
+    sent_at = time.time()
+
+    # Receive the returned root and compare in this process: the serial link
+    # stays open between retries and the verdict (ACK/NAK) follows the hash
+    # immediately. After a NAK the zip is shown again for the second attempt
+    with SerialLink(receiver.SERIAL_PORT, receiver.BAUD_RATE) as link:
+        receive = serial_receiver(link, out_dir / RETURNED_NAME,
+                                  resend=lambda: start_qrs_server_and_open_chromium(zip_path))
+        ok = verify_round_trip(out_dir, receive, sent_at,
+                               log_path=out_dir.parent / (out_dir.name + "_round_trip.jsonl"))
+    print(f"Round trip {'verified' if ok else 'FAILED'}: {out_dir}")
+    return ok
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Framing for the serial link between the two Pis.
+
+A frame is one ASCII line, so it can be written from anything that can
+write a string to a port:
+
+    $<kind>,<payload>*<crc>\r\n
+
+kind is e.g. MD5, payload is printable ASCII without '$', '*' or line breaks,
+and crc is zlib.crc32 of "<kind>,<payload>" as 8 lowercase hex digits. '$'
+is the sync marker: a frame that is cut off (noise, a transmitter restarted
+mid-frame) is dropped as soon as the next '$' shows up, so two partial
+messages are never spliced together.
+
+RingBuffer collects bytes from a file descriptor in bulk (one readv per
+call, straight into the ring), and FrameParser pulls complete frames out of
+it and counts what it had to throw away. SerialLink puts both behind a port
+that is opened once: termios on Linux (so a pty works too), pyserial where
+there is no termios (COMx on Windows). pyserial is listed in requirements.txt
+for Windows only; without it SerialLink raises instead of running without a
+port (require_serial() checks this up front).
+"""
+
+import os
+import select
+import zlib
+
+try:
+    import termios
+    import tty
+except ImportError:  # Windows: framing only, no open_serial()
+    termios = None
+
+try:
+    import serial  # pyserial, only needed where termios is missing
+except ImportError:
+    serial = None
+
+SYNC = b"$"
+END = b"\r\n"
+MAX_FRAME = 256
+
+
+def frame_crc(kind: bytes, payload: bytes) -> bytes:
+    return b"%08x" % zlib.crc32(kind + b"," + payload)
+
+
+def encode_frame(kind, payload) -> bytes:
+    """kind and payload as str or bytes; returns the bytes to put on the wire."""
+    kind = kind.encode() if isinstance(kind, str) else bytes(kind)
+    payload = payload.encode() if isinstance(payload, str) else bytes(payload)
+    if any(c in payload for c in b"$*\r\n"):
+        raise ValueError("payload may not contain '$', '*' or line breaks")
+    return SYNC + kind + b"," + payload + b"*" + frame_crc(kind, payload) + END
+
+
+def decode_frame(line: bytes):
+    """(kind, payload) of a frame without the leading '$' and trailing CRLF, or None if invalid."""
+    body, star, crc = line.rpartition(b"*")
+    kind, comma, payload = body.partition(b",")
+    if not star or not comma or not kind:
+        return None
+    if crc.lower() != frame_crc(kind, payload):
+        return None
+    return kind, payload
+
+
+class RingBuffer:
+    def __init__(self, capacity: int = 4096):
+        self.buf = bytearray(capacity)
+        self.view = memoryview(self.buf)
+        self.capacity = capacity
+        self.head = 0  # oldest byte
+        self.size = 0
+
+    def free(self) -> int:
+        return self.capacity - self.size
+
+    def fill(self, fd: int) -> int:
+        """Read whatever fd has (up to the free space) into the ring. Returns bytes read, 0 at EOF."""
+        tail = (self.head + self.size) % self.capacity
+        if tail >= self.head:
+            parts = [self.view[tail:], self.view[:self.head]]
+        else:
+            parts = [self.view[tail:self.head]]
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return 0
+        n = os.readv(fd, parts)
+        self.size += n
+        return n
+
+    def write(self, data: bytes) -> int:
+        """Append data (as much as fits). Returns bytes stored."""
+        n = min(len(data), self.free())
+        tail = (self.head + self.size) % self.capacity
+        first = min(n, self.capacity - tail)
+        self.buf[tail:tail + first] = data[:first]
+        self.buf[:n - first] = data[first:n]
+        self.size += n
+        return n
+
+    def peek(self) -> bytes:
+        end = self.head + self.size
+        if end <= self.capacity:
+            return bytes(self.view[self.head:end])
+        return bytes(self.view[self.head:]) + bytes(self.view[:end - self.capacity])
+
+    def consume(self, n: int):
+        n = min(n, self.size)
+        self.head = (self.head + n) % self.capacity
+        self.size -= n
+        if not self.size:
+            self.head = 0
+
+
+class FrameParser:
+    """Pulls frames out of a RingBuffer and keeps count of what it rejected."""
+
+    def __init__(self, ring: RingBuffer):
+        self.ring = ring
+        self.frames = 0     # valid frames
+        self.rejected = 0   # started frames that were cut off, too long or failed the CRC
+        self.noise = 0      # bytes outside any frame
+
+    def frames_available(self):
+        """Return the (kind, payload) of every complete frame in the ring and consume them."""
+        data = self.ring.peek()
+        out = []
+        pos = 0
+        while True:
+            start = data.find(SYNC, pos)
+            if start < 0:
+                self.noise += len(data) - pos
+                pos = len(data)
+                break
+            self.noise += start - pos
+            end = data.find(END, start)
+            nxt = data.find(SYNC, start + 1)
+            if nxt >= 0 and (end < 0 or nxt < end):
+                # Another frame started before this one ended
+                self.rejected += 1
+                pos = nxt
+                continue
+            if end < 0:
+                if len(data) - start > MAX_FRAME:
+                    self.rejected += 1
+                    pos = len(data)
+                else:
+                    pos = start  # incomplete, wait for more
+                break
+            frame = decode_frame(data[start + 1:end])
+            if frame is None:
+                self.rejected += 1
+            else:
+                self.frames += 1
+                out.append(frame)
+            pos = end + len(END)
+        self.ring.consume(pos)
+        return out
+
+
+def open_serial(path, baud: int = 9600) -> int:
+    """
+    Open a serial device (or pty) raw, 8N1, no flow control, no echo, at
+    baud. Returns the file descriptor. Replaces `stty -F <port> <baud> raw -echo -crtscts`.
+    """
+    if termios is None:
+        raise OSError("open_serial needs termios (Linux); use pyserial on Windows")
+    speed = getattr(termios, f"B{baud}", None)
+    if speed is None:
+        raise ValueError(f"Unsupported baud rate: {baud}")
+    fd = os.open(str(path), os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        tty.setraw(fd)
+        attrs = termios.tcgetattr(fd)
+        attrs[2] = (attrs[2] & ~termios.CRTSCTS) | termios.CLOCAL | termios.CREAD
+        attrs[3] &= ~termios.ECHO
+        attrs[4] = attrs[5] = speed
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        termios.tcflush(fd, termios.TCIFLUSH)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def write_all(fd: int, data: bytes):
+    """os.write everything to a (possibly non-blocking) fd."""
+    view = memoryview(data)
+    while view:
+        try:
+            n = os.write(fd, view)
+        except BlockingIOError:
+            select.select([], [fd], [])
+            continue
+        view = view[n:]
+
+
+def require_serial():
+    """Raise OSError if this platform cannot open a serial port (no termios and no pyserial)."""
+    if termios is None and serial is None:
+        raise OSError("No serial support: pyserial is needed where termios is missing (Windows). "
+                      "Install it with: pip install -r requirements.txt")
+
+
+class SerialLink:
+    def __init__(self, path, baud: int = 9600, fd=None):
+        """Open path at baud, or wrap an already open fd (e.g. a pty master) if given."""
+        self.path = str(path)
+        self.baud = baud
+        self.ring = RingBuffer()
+        self.parser = FrameParser(self.ring)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.pending = []  # frames handed back with unread()
+        self.fd = None
+        self.ser = None
+        if fd is not None:
+            os.set_blocking(fd, False)
+            self.fd = fd
+        elif termios is not None:
+            self.fd = open_serial(path, baud)
+        else:
+            require_serial()
+            self.ser = serial.Serial(self.path, baud, timeout=0)
+
+    def send(self, kind, payload):
+        data = encode_frame(kind, payload)
+        if self.fd is not None:
+            write_all(self.fd, data)
+        else:
+            self.ser.write(data)
+            self.ser.flush()
+        self.bytes_out += len(data)
+
+    def read_frames(self, timeout: float):
+        """Wait up to timeout for input and return the (kind, payload) frames it completed."""
+        if self.pending:
+            frames, self.pending = self.pending, []
+            return frames
+        if self.fd is not None:
+            readable, _, _ = select.select([self.fd], [], [], max(0.0, timeout))
+            if not readable:
+                return []
+            try:
+                n = self.ring.fill(self.fd)
+            except BlockingIOError:
+                return []
+        else:
+            self.ser.timeout = max(0.0, timeout)
+            data = self.ser.read(1)
+            if data:
+                data += self.ser.read(min(self.ser.in_waiting, self.ring.free() - 1))
+            n = self.ring.write(data)
+        self.bytes_in += n
+        return self.parser.frames_available()
+
+    def unread(self, frames):
+        """Put frames back; the next read_frames() returns them first."""
+        self.pending = list(frames) + self.pending
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self.ser is not None:
+            self.ser.close()
+            self.ser = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
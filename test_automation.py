@@ -0,0 +1,119 @@
+import threading
+import time
+import zipfile
+
+import pytest
+
+import automation
+
+
+def make_zip(path, members=3):
+    with zipfile.ZipFile(path, "w") as zf:
+        for i in range(members):
+            zf.writestr(f"matched/crop_{i}.jpg", bytes(range(256)) * 64)
+
+
+def copy_slowly(src, dst, chunk=4096):
+    """Write dst in chunks with pauses in between, like a download in progress."""
+    data = src.read_bytes()
+    with open(dst, "wb") as f:
+        for pos in range(0, len(data), chunk):
+            f.write(data[pos:pos + chunk])
+            f.flush()
+            time.sleep(0.01)
+
+
+def run_watch(watch_dir, arrive, expected, timeout=10.0):
+    """Watch watch_dir while arrive() writes archives; returns (archives processed, IngestQueue)."""
+    got = []
+    lock = threading.Lock()
+
+    def handler(archive):
+        # Only complete archives may reach the handler
+        assert zipfile.is_zipfile(archive)
+        with lock:
+            got.append(archive.name)
+
+    ingest = automation.IngestQueue(handler, workers=2)
+    stop = threading.Event()
+    watcher = threading.Thread(target=automation.watch_archives, args=(watch_dir, ingest, stop),
+                               kwargs={"poll": 0.05, "quiet": 0.1})
+    watcher.start()
+    time.sleep(0.3)  # watch is set up
+    arrive()
+    deadline = time.monotonic() + timeout
+    while len(got) < expected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.3)  # nothing is queued twice
+    stop.set()
+    watcher.join()
+    ingest.close()
+    return sorted(got), ingest
+
+
+def arrive_three(src, watch_dir):
+    def arrive():
+        copy_slowly(src, watch_dir / "a.zip")
+        # Browser download: written under a temporary name, then renamed
+        copy_slowly(src, watch_dir / "b.zip.crdownload")
+        (watch_dir / "b.zip.crdownload").rename(watch_dir / "b.zip")
+        copy_slowly(src, watch_dir / "c.zip")
+        (watch_dir / "notes.txt").write_text("not an archive")
+    return arrive
+
+
+@pytest.fixture
+def src(tmp_path):
+    path = tmp_path / "payload.zip"
+    make_zip(path)
+    return path
+
+
+@pytest.mark.skipif(automation.Inotify is None, reason="needs inotify (Linux)")
+def test_inotify_queues_every_archive(tmp_path, src):
+    watch_dir = tmp_path / "transmission_images"
+    watch_dir.mkdir()
+    got, ingest = run_watch(watch_dir, arrive_three(src, watch_dir), 3)
+    assert got == ["a.zip", "b.zip", "c.zip"]
+    assert ingest.stats.done == 3 and ingest.stats.failed == 0
+    assert ingest.stats.depth == 0 and len(ingest.stats.waits) == 3
+
+
+@pytest.mark.skipif(automation.Observer is None, reason="needs watchdog")
+def test_watchdog_queues_every_archive(tmp_path, src, monkeypatch):
+    # The Windows path: change notifications without inotify
+    monkeypatch.setattr(automation, "Inotify", None)
+    watch_dir = tmp_path / "transmission_images"
+    watch_dir.mkdir()
+    got, ingest = run_watch(watch_dir, arrive_three(src, watch_dir), 3)
+    assert got == ["a.zip", "b.zip", "c.zip"]
+    assert ingest.stats.done == 3
+
+
+def test_archive_complete(tmp_path, src):
+    data = src.read_bytes()
+    partial = tmp_path / "partial.zip"
+    partial.write_bytes(data[:len(data) // 2])
+    assert automation.archive_complete(src)
+    assert not automation.archive_complete(partial)
+    assert not automation.archive_complete(tmp_path / "missing.zip")
+
+
+def test_ingest_queue_keeps_failures_counted(tmp_path):
+    def handler(archive):
+        if archive.name == "bad.zip":
+            raise RuntimeError("broken")
+
+    ingest = automation.IngestQueue(handler, workers=2)
+    for name in ("a.zip", "bad.zip", "c.zip"):
+        ingest.put(tmp_path / name)
+    ingest.close()
+    assert ingest.stats.done == 2 and ingest.stats.failed == 1
+
+
+def test_verify_payload_without_manifest(tmp_path):
+    # Nothing to verify against: the root of an empty manifest is sent, never the sender's own
+    (tmp_path / "crop_0.jpg").write_bytes(b"jpeg")
+    (tmp_path / automation.ROOT_NAME).write_text("0" * 32 + "  matched.manifest\n")
+    assert automation.verify_payload(tmp_path) == []
+    assert (tmp_path / automation.ROOT_NAME).read_text().split()[0] == automation.merkle_root([])
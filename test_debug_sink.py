@@ -0,0 +1,58 @@
+import csv
+import sqlite3
+import threading
+
+import numpy as np
+
+from debug_sink import BUNDLE_NAME, SCORES_NAME, DebugSink, debug_name
+
+
+def info_for(jobs):
+    return {"debug": jobs, "score": 0.5, "circle": (1.0, 2.0, 3.0)}
+
+
+def test_failures_are_counted_and_the_writer_keeps_going(tmp_path):
+    sink = DebugSink(tmp_path, {}, queue_depth=2)
+    img = np.zeros((8, 8), dtype=np.uint8)
+    for i in range(10):
+        if i % 3 == 0:
+            # Target folder missing: the write fails
+            jobs = [(tmp_path / "missing" / f"img{i}_mask.png", img, "mask")]
+        else:
+            jobs = [(tmp_path / f"img{i}_mask.png", img, "mask")]
+        sink.submit(tmp_path / f"img{i}.png", "no_match", info_for(jobs))
+    # More items than the queue holds went through, so close() must not hang
+    closer = threading.Thread(target=sink.close)
+    closer.start()
+    closer.join(10)
+    assert not closer.is_alive()
+
+    assert sink.failed == 4 and sink.files == 6
+    assert "4 FAILED" in sink.report()
+    with open(tmp_path / SCORES_NAME, newline="") as f:
+        assert len(list(csv.reader(f))) == 1 + 6
+
+
+def test_encode_errors_do_not_kill_the_bundle_writer(tmp_path):
+    sink = DebugSink(tmp_path, {}, bundle=True, queue_depth=1)
+    good = np.zeros((8, 8), dtype=np.uint8)
+    bad = np.zeros((0, 0), dtype=np.uint8)  # cv2.imencode raises on an empty image
+    for i in range(5):
+        sink.submit(tmp_path / f"img{i}.png", "match", info_for([(None, bad if i == 1 else good, "mask")]))
+    sink.close()
+    assert sink.failed == 1 and sink.files == 4
+
+
+def test_same_name_in_different_folders_is_kept_apart(tmp_path):
+    root = tmp_path / "in"
+    assert debug_name(root / "a" / "img1.jpg", root) == "a/img1"
+    assert debug_name(root / "a" / "img1.jpg") == "img1"
+
+    sink = DebugSink(tmp_path / "debug", {}, bundle=True)
+    img = np.zeros((8, 8), dtype=np.uint8)
+    for sub in ("a", "b"):
+        sink.submit(root / sub / "img1.jpg", "no match", info_for([(None, img, "mask")]), root)
+    sink.close()
+    db = sqlite3.connect(str(tmp_path / "debug" / BUNDLE_NAME))
+    assert sorted(db.execute("SELECT name FROM images")) == [("a/img1",), ("b/img1",)]
+    assert db.execute("SELECT COUNT(*) FROM artifacts").fetchone() == (2,)
@@ -0,0 +1,105 @@
+import os
+import socket
+import subprocess
+import sys
+import urllib.request
+
+import pytest
+
+from qr_server import PID_NAME, QrServer
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def server(tmp_path):
+    # A stub HTTP server stands in for node: it serves the qrs folder, so the
+    # payload link is at /payload.zip
+    qrs_dir = tmp_path / "qrs"
+    qrs_dir.mkdir()
+    port = free_port()
+    srv = QrServer(qrs_dir=qrs_dir, port=port, browser=None, payload_path="/payload.zip",
+                   command=[sys.executable, "-m", "http.server", str(port), "--bind", "localhost"])
+    yield srv
+    srv.stop()
+
+
+def make_zip(path, size):
+    path.write_bytes(os.urandom(size))
+    return path
+
+
+def fetch(srv, path):
+    with urllib.request.urlopen(srv.url + path, timeout=2) as resp:
+        return resp.read()
+
+
+def test_start_then_reuse_and_swap(server, tmp_path):
+    first = make_zip(tmp_path / "first.zip", 1000)
+    stats = server.send(first)
+    assert not stats.reused
+    assert stats.probes >= 1
+    assert stats.first_frame_s is not None and stats.first_frame_s >= stats.swap_s
+    assert fetch(server, "/payload.zip") == first.read_bytes()
+    pid = server.proc.pid
+
+    # Second zip: same server process, new payload served
+    second = make_zip(tmp_path / "second.zip", 2000)
+    stats = server.send(second)
+    assert stats.reused
+    assert server.proc.pid == pid
+    assert fetch(server, "/payload.zip") == second.read_bytes()
+    assert "reused" in stats.report() and "first QR frame" in stats.report()
+
+
+def test_later_run_reuses_running_server(server, tmp_path):
+    server.send(make_zip(tmp_path / "a.zip", 100))
+    # A new QrServer (a later run) finds the healthy server and keeps it
+    later = QrServer(qrs_dir=server.qrs_dir, port=server.port, browser=None, payload_path="/payload.zip",
+                     command=server.command)
+    stats = later.send(make_zip(tmp_path / "b.zip", 300))
+    assert stats.reused and later.proc is None
+    assert len(fetch(server, "/payload.zip")) == 300
+
+
+def test_stale_pid_of_another_process_is_not_killed(server, tmp_path):
+    other = subprocess.Popen(["sleep", "30"], start_new_session=True)
+    try:
+        (server.qrs_dir / PID_NAME).write_text(f"{other.pid}\n")
+        server.send(make_zip(tmp_path / "a.zip", 100))
+        assert other.poll() is None
+        assert (server.qrs_dir / PID_NAME).read_text().strip() == str(server.proc.pid)
+    finally:
+        other.kill()
+        other.wait()
+
+
+def test_first_frame_not_measured_without_payload_path(tmp_path):
+    qrs_dir = tmp_path / "qrs"
+    qrs_dir.mkdir()
+    port = free_port()
+    srv = QrServer(qrs_dir=qrs_dir, port=port, browser=None,
+                   command=[sys.executable, "-m", "http.server", str(port), "--bind", "localhost"])
+    try:
+        stats = srv.send(make_zip(tmp_path / "a.zip", 100))
+        assert stats.first_frame_s is None
+        assert "not measured" in stats.report()
+    finally:
+        srv.stop()
+
+
+def test_health_path_must_answer_2xx(tmp_path):
+    qrs_dir = tmp_path / "qrs"
+    qrs_dir.mkdir()
+    port = free_port()
+    srv = QrServer(qrs_dir=qrs_dir, port=port, browser=None, health_path="/missing", start_timeout=0.5,
+                   command=[sys.executable, "-m", "http.server", str(port), "--bind", "localhost"])
+    try:
+        with pytest.raises(TimeoutError):
+            srv.send(make_zip(tmp_path / "a.zip", 100))
+    finally:
+        srv.stop()
@@ -0,0 +1,76 @@
+import hashlib
+import os
+import threading
+import time
+
+import pytest
+
+import receiver
+from serial_frame import FrameParser, RingBuffer, decode_frame, encode_frame, termios
+
+MD5 = hashlib.md5(b"matched").hexdigest()
+OTHER = hashlib.md5(b"other").hexdigest()
+
+needs_pty = pytest.mark.skipif(termios is None, reason="pty loopback needs termios (Linux)")
+
+
+def corrupted(kind, payload):
+    frame = bytearray(encode_frame(kind, payload))
+    frame[6] ^= 1  # inside the payload: the CRC no longer matches
+    return bytes(frame)
+
+
+def write_slowly(fd, data, step=7):
+    for i in range(0, len(data), step):
+        os.write(fd, data[i:i + step])
+        time.sleep(0.001)
+
+
+def test_frame_round_trip_and_crc():
+    frame = encode_frame("MD5", MD5)
+    assert frame.startswith(b"$MD5,") and frame.endswith(b"\r\n")
+    assert decode_frame(frame[1:-2]) == (b"MD5", MD5.encode())
+    assert decode_frame(corrupted("MD5", MD5)[1:-2]) is None
+    with pytest.raises(ValueError):
+        encode_frame("MD5", "a*b")
+
+
+def test_parser_drops_truncated_and_corrupt_frames():
+    ring = RingBuffer(256)
+    parser = FrameParser(ring)
+    wire = (b"\x00noise" + encode_frame("MD5", OTHER)[:20]   # cut off mid-frame by the next '$'
+            + corrupted("MD5", OTHER) + encode_frame("MD5", MD5))
+    ring.write(wire)
+    assert parser.frames_available() == [(b"MD5", MD5.encode())]
+    assert parser.rejected == 2 and parser.noise == 6
+
+    # A frame split across reads is held until it is complete
+    frame = encode_frame("ACK", MD5)
+    ring.write(frame[:10])
+    assert parser.frames_available() == []
+    ring.write(frame[10:])
+    assert parser.frames_available() == [(b"ACK", MD5.encode())]
+
+
+@needs_pty
+def test_receiver_takes_first_valid_frame_over_pty(pty_pair):
+    near, far = pty_pair
+    wire = (b"\xff\x00garbage" + encode_frame("MD5", OTHER)[:20] + corrupted("MD5", OTHER)
+            + encode_frame("ACK", "x") + encode_frame("MD5", MD5) * 5)
+    writer = threading.Thread(target=write_slowly, args=(far.fd, wire))
+    writer.start()
+    stats = receiver.ReceiveStats()
+    got = receiver.receive_frame(near, timeout=5, stats=stats)
+    writer.join()
+    assert got == MD5.encode()
+    # truncated + corrupt + an ACK is not what we wait for
+    assert stats.rejected == 3
+    assert stats.frames >= 2 and stats.bytes > 0
+    assert "rejected" in stats.report()
+
+
+@needs_pty
+def test_receiver_times_out_on_garbage_only(pty_pair):
+    near, far = pty_pair
+    os.write(far.fd, b"0123456789abcdef" * 4 + corrupted("MD5", MD5))
+    assert receiver.receive_frame(near, timeout=0.3) is None
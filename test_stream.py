@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+import pytest
+
+from find_red_circles import RoiTracker, StreamStats, open_stream, scan_stream
+
+FRAMES = 40
+GAP = range(20, 26)  # frames without a ring
+
+
+@pytest.fixture
+def clip(tmp_path):
+    """A small MJPG clip: a red ring moving across a noisy background, gone for a few frames."""
+    path = tmp_path / "clip.avi"
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 15, (320, 240))
+    if not writer.isOpened():
+        pytest.skip("OpenCV build cannot write MJPG")
+    rng = np.random.default_rng(0)
+    for i in range(FRAMES):
+        frame = np.full((240, 320, 3), (90, 110, 100), np.uint8)
+        frame = cv2.add(frame, rng.integers(0, 20, frame.shape, dtype=np.uint8))
+        if i not in GAP:
+            cv2.circle(frame, (40 + 6 * i, 120), 14, (0, 0, 230), 3)
+        writer.write(frame)
+    writer.release()
+    return str(path)
+
+
+def scan(clip, out_dir, full_every):
+    out_dir.mkdir()
+    cap, is_camera = open_stream(clip)
+    assert not is_camera
+    stats = StreamStats()
+    results = list(scan_stream(cap, out_dir, True, 0.45, 8, tracker=RoiTracker(full_every=full_every), stats=stats))
+    cap.release()
+    return [i for i, status, _ in results if status == "match"], stats
+
+
+def test_stream_scan_follows_the_ring(clip, tmp_path):
+    # full_every=1: every frame searched whole, the reference for the ROI scan
+    full, full_stats = scan(clip, tmp_path / "full", full_every=1)
+    matches, stats = scan(clip, tmp_path / "roi", full_every=30)
+
+    assert stats.read == stats.processed == FRAMES and stats.skipped == 0
+    assert stats.matches == len(matches) and matches
+    assert stats.roi_searches > 0 and stats.roi_hits > 0
+    assert stats.full_searches < full_stats.full_searches
+    # Searching around the last hit keeps most of what a full frame scan finds
+    assert len(matches) * 2 >= len(full)
+    assert not set(matches) & set(GAP) and not set(full) & set(GAP)
+
+    written = sorted(p.name for p in (tmp_path / "roi").iterdir())
+    assert written == [f"frame_{i:06d}.jpg" for i in matches]
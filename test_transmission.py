@@ -0,0 +1,71 @@
+import hashlib
+import os
+import threading
+import time
+
+import pytest
+
+import receiver
+import transmission
+from serial_frame import termios
+
+pytestmark = pytest.mark.skipif(termios is None, reason="pty loopback needs termios (Linux)")
+
+MD5 = hashlib.md5(b"matched").hexdigest()
+
+
+def run_handoff(near, far, reply="ACK", delay=0.0, drop_first=False, timeout=5.0):
+    """send_md5 on near while far receives and answers with reply; returns (TransmitStats, replies sent)."""
+    out = {}
+
+    def far_side():
+        if delay:
+            time.sleep(delay)
+            os.read(far.fd, 4096)  # sent before the receiver was listening: lost
+        payload = receiver.receive_frame(far, timeout=5)
+        if drop_first:
+            send, calls = far.send, []
+
+            def lossy(kind, data):
+                calls.append(kind)
+                if len(calls) > 1:
+                    send(kind, data)
+            far.send = lossy
+        far.send(reply, payload)
+        out["replies"] = 1 + receiver.answer_repeats(far, payload, quiet=0.3, reply=reply)
+
+    t = threading.Thread(target=far_side)
+    t.start()
+    stats = transmission.send_md5(near, MD5, timeout=timeout)
+    t.join()
+    return stats, out.get("replies")
+
+
+def test_ack_after_one_transmission(pty_pair):
+    stats, replies = run_handoff(*pty_pair)
+    assert stats.acked and not stats.rejected
+    assert stats.attempts == 1 and replies == 1
+    assert "acknowledged" in stats.report()
+
+
+def test_retransmits_until_receiver_listens(pty_pair):
+    stats, _ = run_handoff(*pty_pair, delay=0.5)
+    assert stats.acked and stats.attempts > 1
+
+
+def test_lost_ack_is_answered_again(pty_pair):
+    stats, replies = run_handoff(*pty_pair, drop_first=True)
+    assert stats.acked and stats.attempts >= 2 and replies >= 2
+
+
+def test_nak_is_a_verdict(pty_pair):
+    stats, _ = run_handoff(*pty_pair, reply="NAK")
+    assert stats.rejected and not stats.acked
+    assert "REJECTED" in stats.report()
+
+
+def test_no_receiver_gives_up(pty_pair):
+    near, _ = pty_pair
+    stats = transmission.send_md5(near, MD5, first_wait=0.05, timeout=0.5)
+    assert not stats.acked and not stats.rejected and stats.attempts > 1
+    assert "NOT acknowledged" in stats.report()
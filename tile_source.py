@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Windowed pixel access for very large images.
+
+open_tile_source(path) returns an object with .shape (h, w, 3) that can be
+sliced like a BGR array (src[y1:y2, x1:x2] -> contiguous uint8 copy of just that
+window). Uncompressed BMP and binary PPM (P6) are memory-mapped, so only the
+rows a window touches are paged in. Any other format falls back to a full
+cv2.imread, because there is no strip-wise decoder for it here.
+"""
+
+import struct
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+
+class ArraySource:
+    """Whole image already in memory (fallback for compressed formats)."""
+
+    mapped = False
+
+    def __init__(self, img: np.ndarray):
+        self.img = img
+        self.shape = img.shape
+
+    def __getitem__(self, key):
+        return np.ascontiguousarray(self.img[key])
+
+    def close(self):
+        self.img = None
+
+
+class BmpSource:
+    """Memory-mapped uncompressed 24/32-bit BMP (bottom-up or top-down)."""
+
+    mapped = True
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            header = f.read(54)
+        if len(header) < 54 or header[:2] != b"BM":
+            raise ValueError(f"not a BMP file: {path}")
+
+        offset = struct.unpack_from("<I", header, 10)[0]
+        width, height = struct.unpack_from("<ii", header, 18)
+        bpp = struct.unpack_from("<H", header, 28)[0]
+        compression = struct.unpack_from("<I", header, 30)[0]
+        if bpp not in (24, 32) or compression not in (0, 3):
+            raise ValueError(f"unsupported BMP layout ({bpp} bpp, compression {compression}): {path}")
+
+        self.bottom_up = height > 0
+        h, w = abs(height), width
+        self.channels = bpp // 8
+        stride = (w * self.channels + 3) & ~3
+
+        self.rows = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(h, stride))
+        self.shape = (h, w, 3)
+
+    def __getitem__(self, key):
+        ys, xs = key
+        h, w = self.shape[:2]
+        y1, y2, _ = ys.indices(h)
+        x1, x2, _ = xs.indices(w)
+        c = self.channels
+
+        if self.bottom_up:
+            rows = self.rows[h - y2:h - y1][::-1]
+        else:
+            rows = self.rows[y1:y2]
+        px = rows[:, x1 * c:x2 * c].reshape(y2 - y1, x2 - x1, c)
+        return np.ascontiguousarray(px[:, :, :3])
+
+    def close(self):
+        self.rows = None
+
+
+class PpmSource:
+    """Memory-mapped binary PPM (P6, maxval <= 255)."""
+
+    mapped = True
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            head = f.read(512)
+
+        fields = []
+        pos = 0
+        while len(fields) < 4:
+            while pos < len(head) and head[pos:pos + 1].isspace():
+                pos += 1
+            if head[pos:pos + 1] == b"#":
+                pos = head.index(b"\n", pos) + 1
+                continue
+            end = pos
+            while end < len(head) and not head[end:end + 1].isspace():
+                end += 1
+            fields.append(head[pos:end])
+            pos = end
+        pos += 1  # single whitespace before the pixel data
+
+        if fields[0] != b"P6" or int(fields[3]) > 255:
+            raise ValueError(f"unsupported PPM (need P6, 8-bit): {path}")
+
+        w, h = int(fields[1]), int(fields[2])
+        self.pixels = np.memmap(path, dtype=np.uint8, mode="r", offset=pos, shape=(h, w, 3))
+        self.shape = (h, w, 3)
+
+    def __getitem__(self, key):
+        # PPM is RGB, callers expect BGR
+        return np.ascontiguousarray(self.pixels[key][:, :, ::-1])
+
+    def close(self):
+        self.pixels = None
+
+
+def open_tile_source(path: Path):
+    """Open path for windowed reads. Returns None if the image can't be read."""
+    path = Path(path)
+    suffix = path.suffix.lower()
+    try:
+        if suffix == ".bmp":
+            return BmpSource(path)
+        if suffix in {".ppm", ".pnm"}:
+            return PpmSource(path)
+    except (ValueError, OSError):
+        pass  # unusual layout, let OpenCV decode it
+
+    img = cv2.imread(str(path))
+    return ArraySource(img) if img is not None else None
@@ -1,30 +1,172 @@
 from pathlib import Path
-import subprocess
+import argparse
+import time
 
+from manifest import ROOT_NAME, merkle_levels
+from serial_frame import SerialLink
+
+# automation.py decrypts each archive into BASE_DIR / <archive name>
 BASE_DIR = Path(r"C:\Users\L&L\Desktop\transmission_images\decrypted_images")
-MD5_FILE = BASE_DIR / "matched.manifest.md5"
 
 SERIAL_PORT = "COM4"
 BAUD_RATE = 9600
 
+# Retransmit after FIRST_WAIT s without ACK, doubling up to MAX_WAIT, for at most TIMEOUT s
+FIRST_WAIT = 0.2
+MAX_WAIT = 2.0
+TIMEOUT = 30.0
+# After a NAK, answer Merkle node queries until DONE or this long without one
+NODE_QUIET = 5.0
 
-def main():
-    if not MD5_FILE.exists():
+
+class TransmitStats:
+    def __init__(self):
+        self.acked = False
+        self.rejected = False  # NAK: the other side compared and the roots differ
+        self.attempts = 0
+        self.time_to_ack = 0.0
+        self.bytes_out = 0
+        self.nodes = 0  # node queries answered after a NAK
+
+    def report(self) -> str:
+        sent = f"{self.attempts} transmission{'s' if self.attempts > 1 else ''}, {self.bytes_out} bytes"
+        if self.acked:
+            return f"MD5 acknowledged after {self.time_to_ack:.2f}s ({sent})"
+        if self.rejected:
+            return (f"MD5 REJECTED (roots differ) after {self.time_to_ack:.2f}s ({sent}), "
+                    f"answered {self.nodes} node queries")
+        return f"MD5 NOT acknowledged after {self.time_to_ack:.2f}s ({self.attempts} transmissions)"
+
+
+def format_timings(timings: dict) -> str:
+    """TIM frame payload: name=seconds pairs, e.g. decrypt=0.301,verify=0.052."""
+    return ",".join(f"{name}={seconds:.3f}" for name, seconds in timings.items())
+
+
+def send_md5(link: SerialLink, md5_string: str, first_wait: float = FIRST_WAIT, max_wait: float = MAX_WAIT,
+             timeout: float = TIMEOUT, timings=None) -> TransmitStats:
+    """
+    Send md5_string as an MD5 frame and retransmit with exponential backoff
+    until the other side answers with its verdict: an ACK frame carrying the
+    same value (roots match) or a NAK (they differ). timings (stage name ->
+    seconds spent on this side) go ahead of it once, as a TIM frame, so the
+    other side can break down its round-trip time.
+    """
+    stats = TransmitStats()
+    payload = md5_string.encode()
+    start = time.monotonic()
+    deadline = start + timeout
+    wait = first_wait
+    bytes0 = link.bytes_out
+
+    if timings:
+        link.send("TIM", format_timings(timings))
+    while time.monotonic() < deadline:
+        link.send("MD5", payload)
+        stats.attempts += 1
+        retry_at = min(time.monotonic() + wait, deadline)
+        while not (stats.acked or stats.rejected):
+            remaining = retry_at - time.monotonic()
+            if remaining <= 0:
+                break
+            frames = link.read_frames(remaining)
+            for i, frame in enumerate(frames):
+                stats.acked = frame == (b"ACK", payload)
+                stats.rejected = frame == (b"NAK", payload)
+                if stats.acked or stats.rejected:
+                    # Node queries can follow a NAK in the same read: leave them for serve_nodes
+                    link.unread(frames[i + 1:])
+                    break
+        if stats.acked or stats.rejected:
+            break
+        wait = min(wait * 2, max_wait)
+
+    stats.time_to_ack = time.monotonic() - start
+    stats.bytes_out = link.bytes_out - bytes0
+    return stats
+
+
+def serve_nodes(link: SerialLink, lines, quiet: float = NODE_QUIET) -> int:
+    """
+    After a NAK the other side asks which files differ, walking down the
+    Merkle tree over the link: a NODE frame "<level>.<index>" is answered with
+    HASH "<level>.<index>.<hex digest>" (empty digest past the end of a level),
+    and NODE "leaves" with HASH "leaves.<file count>". lines are this side's
+    manifest lines (the ones its root was computed from). Runs until a DONE
+    frame or quiet seconds without a query. Returns the queries answered.
+    """
+    levels = merkle_levels(lines)
+    served = 0
+    while True:
+        before = link.bytes_in
+        frames = link.read_frames(quiet)
+        if link.bytes_in == before and not frames:
+            return served
+        for kind, payload in frames:
+            if kind == b"DONE":
+                return served
+            if kind != b"NODE":
+                continue
+            what = payload.decode(errors="replace")
+            if what == "leaves":
+                answer = str(len(lines))
+            else:
+                try:
+                    lvl, i = (int(x) for x in what.split("."))
+                    answer = levels[lvl][i].hex() if 0 <= lvl < len(levels) and 0 <= i < len(levels[lvl]) else ""
+                except ValueError:
+                    continue
+            link.send("HASH", f"{what}.{answer}")
+            served += 1
+
+
+def latest_md5_file(base_dir: Path = BASE_DIR) -> Path:
+    """The root (matched.manifest.md5) of the most recently decrypted archive under base_dir."""
+    roots = list(base_dir.glob(f"*/{ROOT_NAME}"))
+    if not roots:
+        return base_dir / ROOT_NAME
+    return max(roots, key=lambda p: p.stat().st_mtime)
+
+
+def transmit(md5_file: Path, port: str = SERIAL_PORT, baud: int = BAUD_RATE,
+             timeout: float = TIMEOUT, timings=None, lines=None) -> TransmitStats:
+    """
+    Send the manifest root in md5_file over the serial link (timings: see
+    send_md5). If it is rejected and lines (the manifest lines the root was
+    computed from) are given, answer the other side's node queries
+    (serve_nodes) so it can name the files that differ. Used directly by
+    automation.py.
+    """
+    if not md5_file.exists():
         raise RuntimeError("manifest.md5 not found")
 
-    md5_string = MD5_FILE.read_text().split()[0].strip()
+    md5_string = md5_file.read_text().split()[0].strip()
 
     if len(md5_string) != 32:
         raise RuntimeError("Invalid MD5 length")
 
-    command = (
-        f"$p = New-Object System.IO.Ports.SerialPort '{SERIAL_PORT}',{BAUD_RATE},None,8,one;"
-        "$p.Open();"
-        f"for($i=0;$i -lt 5;$i++){{$p.Write('{md5_string}'); Start-Sleep -Milliseconds 500}};"
-        "$p.Close();"
-    )
+    with SerialLink(port, baud) as link:
+        stats = send_md5(link, md5_string, timeout=timeout, timings=timings)
+        if stats.rejected and lines is not None:
+            stats.nodes = serve_nodes(link, lines)
+        return stats
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Send the manifest root over serial until it is acknowledged.")
+    ap.add_argument("--port", default=SERIAL_PORT)
+    ap.add_argument("--baud", type=int, default=BAUD_RATE)
+    ap.add_argument("--timeout", type=float, default=TIMEOUT)
+    ap.add_argument("--md5_file", type=Path, default=None,
+                    help="Root to send (default: the most recently decrypted archive's)")
+    args = ap.parse_args()
 
-    subprocess.run(["powershell", "-Command", command])
+    stats = transmit(args.md5_file or latest_md5_file(), args.port, args.baud, args.timeout)
+    print(stats.report())
+    if stats.rejected:
+        raise SystemExit(2)
+    if not stats.acked:
+        raise SystemExit(3)
 
 
 if __name__ == "__main__":
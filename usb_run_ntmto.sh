@@ -1,35 +1,14 @@
 #!/bin/bash
 
-while true; do
-    for d in /media/user/*; do
-        if [ -d "$d" ]; then
-            echo "USB detected at $d"
+# Event-driven replacement for the old polling loop: one long-running process
+# watches /media/user with inotify, detects images while they are still being
+# copied, and encrypts/zips/sends once each USB stick is drained.
+# It survives any number of insert/remove cycles.
 
-            cd /home/user/group-9-team-project-main/red-circle-finder || exit 1
+# Run from red-circle-finder like before: matched/ there is where receiver.py
+# and compare_md5.py look, and qr_shared.key is read from there
+cd /home/user/group-9-team-project-main/red-circle-finder || exit 1
 
-            # clear old images
-            rm -f input_images/*
-
-            # copy images from USB commented out, only if there are no subfolders.
-            # cp "$d"/*.{jpg,jpeg,png,JPG,JPEG,PNG} input_images/ 2>/dev/null
-
-            #if there are subfolders
-            find "$d" -type f \( -iname "*.jpg" -o -iname "*.jpeg" -o -iname "*.png" \) -print0 
-            | xargs -0 -I{} cp "{}" input_images/
-
-
-            # run the script
-            python find_red_circles.py --in_dir input_images --out_dir matched --crop
-
-            echo "Done. Waiting for next USB."
-            
-            # wait until USB is removed before triggering again
-            while [ -d "$d" ]; do
-                sleep 1
-            done
-        fi
-    done
-    sleep 1
-done
+exec python ../find_red_circles.py --watch /media/user --out_dir matched --crop --send
 
 #TJP
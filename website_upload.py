@@ -2,6 +2,7 @@ import time
 import requests
 import base64
 import os
+import sys
 from pathlib import Path
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
@@ -89,14 +90,16 @@ def upload_all(IMAGES_DIR):
     
     time.sleep(2) # Give the DNS/Server 2 seconds 
     
-    # Iterate over all images in the directory
-    for file in IMAGES_DIR.iterdir():
+    # Iterate over all images in the directory, subfolders included (--recursive
+    # scans keep the source tree's folders)
+    for file in sorted(IMAGES_DIR.rglob("*")):
         # Create full file path for each image
         filepath = file
+        # Path relative to the folder, so a/img1.jpg and b/img1.jpg stay apart
+        filename = file.relative_to(IMAGES_DIR).as_posix()
         
-        # Skip directories (shouldn't happen)
+        # Subfolders themselves are not uploaded, only the files in them
         if not Path.is_file(filepath):
-            print(f"Skipping directory: {filepath}")
             continue
             
         # Skip non-jpg files (also shouldn't happen)
@@ -107,7 +110,7 @@ def upload_all(IMAGES_DIR):
         print(f"Uploading {filepath} to Firebase Storage...")
         
         # Upload the image to Firebase Storage
-        if upload_image(session, API_URL, API_KEY, filepath, file.name):
+        if upload_image(session, API_URL, API_KEY, filepath, filename):
             print(f"Uploaded {file} successfully.")
 
         time.sleep(0.5)
@@ -117,4 +120,5 @@ if __name__ == "__main__":
     if API_KEY == "YOUR_SECRET_API_KEY" or API_URL == "https://your-app-url.com/api/upload":
         print("Please update the placeholder values for API_URL and API_KEY in the script before running.")
     else:    
-        upload_all(IMAGES_DIR)
+        # automation.py passes the folder of the archive it just decrypted
+        upload_all(Path(sys.argv[1]) if len(sys.argv) > 1 else IMAGES_DIR)